@@ -0,0 +1,26 @@
+"""purge punteggio_totale blind index tokens
+
+Revision ID: 55dc8e1639f5
+Revises: b9e1a3c5d7f0
+Create Date: 2026-10-18 14:26:09.418273
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '55dc8e1639f5'
+down_revision = 'b9e1a3c5d7f0'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Il punteggio è già proiettato in chiaro e ha pochi valori possibili:
+    # i suoi token permetterebbero di confrontare l'HMAC con valori noti
+    op.execute("DELETE FROM blind_index WHERE field = 'punteggio_totale'")
+
+
+def downgrade():
+    # Nessun ripristino: il filtro sul punteggio usa module_entry_projection
+    pass
@@ -0,0 +1,46 @@
+"""module_entry data as bytea
+
+Revision ID: a3c5e7f9b1d2
+Revises: 7f2f633549b3
+Create Date: 2026-10-17 09:12:40.512903
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel.sql.sqltypes
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3c5e7f9b1d2'
+down_revision = '7f2f633549b3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Le righe esistenti restano in formato legacy (testo base64 come byte ASCII):
+    # il reader le accetta e app/reencode_payloads.py le converte online.
+    op.alter_column(
+        'module_entry', 'data',
+        existing_type=sa.Text(),
+        type_=sa.LargeBinary(),
+        existing_nullable=False,
+        postgresql_using="convert_to(data, 'UTF8')",
+    )
+
+
+def downgrade():
+    # Le righe in formato binario (primo byte = 0x01) tornano a base64(base64url(token))
+    op.alter_column(
+        'module_entry', 'data',
+        existing_type=sa.LargeBinary(),
+        type_=sa.Text(),
+        existing_nullable=False,
+        postgresql_using="""
+            CASE WHEN get_byte(data, 0) = 1 THEN
+                replace(encode(convert_to(
+                    translate(replace(encode(substring(data from 2), 'base64'), E'\\n', ''), '+/', '-_'),
+                'UTF8'), 'base64'), E'\\n', '')
+            ELSE convert_from(data, 'UTF8') END
+        """,
+    )
@@ -0,0 +1,26 @@
+"""purge ROG26/1.4 clinical values from module_entry_projection
+
+Revision ID: a8d0f2b4c6e9
+Revises: f6b8d0e2a4c7
+Create Date: 2026-10-18 09:12:51.337820
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'a8d0f2b4c6e9'
+down_revision = 'f6b8d0e2a4c7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Peso, altezza, TAO, ossigenoterapia e farmaci erano copiati in chiaro:
+    # ROG26/1.4 non ha più campi proiettati
+    op.execute("DELETE FROM module_entry_projection WHERE module_code = 'ROG26/1.4'")
+
+
+def downgrade():
+    # Nessun ripristino: i valori clinici non tornano in chiaro
+    pass
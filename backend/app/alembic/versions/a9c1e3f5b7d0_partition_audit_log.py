@@ -0,0 +1,103 @@
+"""monthly range partitioning of audit_log
+
+Revision ID: a9c1e3f5b7d0
+Revises: f7b9d1e3a5c8
+Create Date: 2026-10-17 15:48:30.112094
+
+"""
+from datetime import date
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a9c1e3f5b7d0'
+down_revision = 'f7b9d1e3a5c8'
+branch_labels = None
+depends_on = None
+
+COLUMNS = "audit_id, ts, user_id, username, action, table_name, record_id, before, after, ip_address, endpoint"
+COLUMN_DEFINITIONS = """
+    audit_id integer NOT NULL DEFAULT nextval('audit_log_audit_id_seq'::regclass),
+    ts timestamp without time zone NOT NULL,
+    user_id uuid,
+    username varchar(255),
+    action varchar(20) NOT NULL,
+    table_name varchar(100) NOT NULL,
+    record_id varchar(50) NOT NULL,
+    before jsonb,
+    after jsonb,
+    ip_address varchar(45),
+    endpoint varchar(255)
+"""
+SINGLE_COLUMN_INDEXES = ['action', 'record_id', 'table_name', 'ts', 'user_id']
+PARTITIONS_AHEAD = 3
+
+
+def _add_months(month, months):
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def _create_composite_indexes():
+    op.create_index('idx_audit_record', 'audit_log', ['table_name', 'record_id'], unique=False)
+    op.create_index('idx_audit_ts_action', 'audit_log', ['ts', 'action'], unique=False)
+    op.create_index('idx_audit_user_table', 'audit_log', ['user_id', 'table_name'], unique=False)
+
+
+def upgrade():
+    bind = op.get_bind()
+
+    op.execute("ALTER TABLE audit_log RENAME TO audit_log_old")
+    op.execute("ALTER TABLE audit_log_old RENAME CONSTRAINT audit_log_pkey TO audit_log_old_pkey")
+    for name in ['idx_audit_record', 'idx_audit_ts_action', 'idx_audit_user_table']:
+        op.drop_index(name, table_name='audit_log_old')
+    for column in SINGLE_COLUMN_INDEXES:
+        op.drop_index(f'ix_audit_log_{column}', table_name='audit_log_old')
+
+    # La chiave primaria di una tabella partizionata deve includere ts
+    op.execute(f"""
+        CREATE TABLE audit_log ({COLUMN_DEFINITIONS},
+            CONSTRAINT audit_log_pkey PRIMARY KEY (audit_id, ts)
+        ) PARTITION BY RANGE (ts)
+    """)
+    op.execute("ALTER SEQUENCE audit_log_audit_id_seq OWNED BY audit_log.audit_id")
+    _create_composite_indexes()
+    op.create_index('idx_audit_ts_brin', 'audit_log', ['ts'], unique=False, postgresql_using='brin')
+
+    op.execute("CREATE TABLE audit_log_default PARTITION OF audit_log DEFAULT")
+    today = date.today()
+    first = bind.execute(sa.text("SELECT min(ts) FROM audit_log_old")).scalar() or today
+    month = date(first.year, first.month, 1)
+    last = _add_months(date(today.year, today.month, 1), PARTITIONS_AHEAD)
+    while month <= last:
+        upper = _add_months(month, 1)
+        op.execute(
+            f"CREATE TABLE audit_log_y{month.year}m{month.month:02d} PARTITION OF audit_log "
+            f"FOR VALUES FROM ('{month.isoformat()}') TO ('{upper.isoformat()}')"
+        )
+        month = upper
+
+    op.execute(f"INSERT INTO audit_log ({COLUMNS}) SELECT {COLUMNS} FROM audit_log_old")
+    op.execute("DROP TABLE audit_log_old")
+
+
+def downgrade():
+    op.execute("ALTER TABLE audit_log RENAME TO audit_log_partitioned")
+    op.execute("ALTER TABLE audit_log_partitioned RENAME CONSTRAINT audit_log_pkey TO audit_log_partitioned_pkey")
+    for name in ['idx_audit_record', 'idx_audit_ts_action', 'idx_audit_user_table', 'idx_audit_ts_brin']:
+        op.drop_index(name, table_name='audit_log_partitioned')
+
+    op.execute(f"""
+        CREATE TABLE audit_log ({COLUMN_DEFINITIONS},
+            CONSTRAINT audit_log_pkey PRIMARY KEY (audit_id)
+        )
+    """)
+    op.execute("ALTER SEQUENCE audit_log_audit_id_seq OWNED BY audit_log.audit_id")
+    op.execute(f"INSERT INTO audit_log ({COLUMNS}) SELECT {COLUMNS} FROM audit_log_partitioned")
+    op.execute("DROP TABLE audit_log_partitioned")
+
+    _create_composite_indexes()
+    for column in SINGLE_COLUMN_INDEXES:
+        op.create_index(op.f(f'ix_audit_log_{column}'), 'audit_log', [column], unique=False)
@@ -0,0 +1,27 @@
+"""hit count and last access for coalesced READ audit events
+
+Revision ID: b2d4f6a8c0e1
+Revises: a9c1e3f5b7d0
+Create Date: 2026-10-17 16:20:05.731842
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b2d4f6a8c0e1'
+down_revision = 'a9c1e3f5b7d0'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Su tabella partizionata le colonne si propagano a tutte le partizioni
+    op.add_column('audit_log', sa.Column('hit_count', sa.Integer(), server_default='1', nullable=False))
+    op.add_column('audit_log', sa.Column('last_ts', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('audit_log', 'last_ts')
+    op.drop_column('audit_log', 'hit_count')
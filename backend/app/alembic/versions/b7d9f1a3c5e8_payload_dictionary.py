@@ -0,0 +1,35 @@
+"""payload compression dictionaries
+
+Revision ID: b7d9f1a3c5e8
+Revises: a3c5e7f9b1d2
+Create Date: 2026-10-17 10:04:18.227431
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel.sql.sqltypes
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7d9f1a3c5e8'
+down_revision = 'a3c5e7f9b1d2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('payload_dictionary',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('module_code', sqlmodel.sql.sqltypes.AutoString(length=50), nullable=False),
+    sa.Column('dictionary', sa.LargeBinary(), nullable=False),
+    sa.Column('sample_size', sa.Integer(), nullable=False),
+    sa.Column('ratio', sa.Float(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_payload_dictionary_module_code'), 'payload_dictionary', ['module_code'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_payload_dictionary_module_code'), table_name='payload_dictionary')
+    op.drop_table('payload_dictionary')
@@ -0,0 +1,45 @@
+"""backfill dossier_summary for dossiers without a row
+
+Revision ID: b9e1a3c5d7f0
+Revises: a8d0f2b4c6e9
+Create Date: 2026-10-18 11:04:37.562190
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'b9e1a3c5d7f0'
+down_revision = 'a8d0f2b4c6e9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Una riga per ogni dossier che non ne ha ancora una, anche senza entry
+    op.execute("""
+        INSERT INTO dossier_summary (dossier_id, entries_count, last_entry_at, module_counts, last_scores, updated_at)
+        SELECT d.id,
+               coalesce(sum(c.entries), 0),
+               max(c.last_at),
+               coalesce(jsonb_object_agg(c.module_code, c.entries) FILTER (WHERE c.module_code IS NOT NULL), '{}'::jsonb),
+               '{}'::jsonb,
+               now()
+        FROM dossiers AS d
+        LEFT JOIN (
+            SELECT dossier_id, module_code, count(*) AS entries, max(occurred_at) AS last_at
+            FROM module_entry
+            WHERE deleted_at IS NULL
+            GROUP BY dossier_id, module_code
+        ) AS c ON c.dossier_id = d.id
+        GROUP BY d.id
+        ON CONFLICT (dossier_id) DO NOTHING
+    """)
+    # last_scores resta vuoto: dipende da module_entry_projection, che si popola
+    # solo decrittando i payload (app/backfill_projections.py). Lo riempie
+    # app/rebuild_dossier_summaries.py, che esegue prima il backfill delle proiezioni
+
+
+def downgrade():
+    # Le righe calcolate restano valide: nulla da annullare
+    pass
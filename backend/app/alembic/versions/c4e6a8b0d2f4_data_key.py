@@ -0,0 +1,41 @@
+"""envelope encryption data keys
+
+Revision ID: c4e6a8b0d2f4
+Revises: b7d9f1a3c5e8
+Create Date: 2026-10-17 11:32:40.518204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel.sql.sqltypes
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4e6a8b0d2f4'
+down_revision = 'b7d9f1a3c5e8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('data_key',
+    sa.Column('id', sa.Uuid(), nullable=False),
+    sa.Column('owner_type', sqlmodel.sql.sqltypes.AutoString(length=20), nullable=False),
+    sa.Column('owner_id', sa.Uuid(), nullable=False),
+    sa.Column('wrapped_key', sa.LargeBinary(), nullable=False),
+    sa.Column('master_key_id', sqlmodel.sql.sqltypes.AutoString(length=16), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('rotated_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('owner_type', 'owner_id', name='uq_data_key_owner')
+    )
+    op.create_index(op.f('ix_data_key_master_key_id'), 'data_key', ['master_key_id'], unique=False)
+
+
+def downgrade():
+    # Senza la tabella i payload envelope (formato 0x02) non sarebbero più leggibili
+    conn = op.get_bind()
+    if conn.execute(sa.text("SELECT count(*) FROM data_key")).scalar():
+        raise RuntimeError("data_key is not empty: envelope-encrypted payloads depend on it")
+    op.drop_index(op.f('ix_data_key_master_key_id'), table_name='data_key')
+    op.drop_table('data_key')
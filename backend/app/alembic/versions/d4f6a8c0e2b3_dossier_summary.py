@@ -0,0 +1,36 @@
+"""dossier_summary read model
+
+Revision ID: d4f6a8c0e2b3
+Revises: c3e5a7b9d1f2
+Create Date: 2026-10-17 19:12:44.150263
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'd4f6a8c0e2b3'
+down_revision = 'c3e5a7b9d1f2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'dossier_summary',
+        sa.Column('dossier_id', sa.Uuid(), nullable=False),
+        sa.Column('entries_count', sa.Integer(), nullable=False),
+        sa.Column('last_entry_at', sa.DateTime(), nullable=True),
+        sa.Column('module_counts', postgresql.JSONB(astext_type=sa.Text()), nullable=False),
+        sa.Column('last_scores', postgresql.JSONB(astext_type=sa.Text()), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['dossier_id'], ['dossiers.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('dossier_id'),
+    )
+    # Popolamento iniziale nella migrazione b9e1a3c5d7f0
+
+
+def downgrade():
+    op.drop_table('dossier_summary')
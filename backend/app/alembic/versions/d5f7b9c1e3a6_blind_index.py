@@ -0,0 +1,37 @@
+"""blind index for encrypted fields
+
+Revision ID: d5f7b9c1e3a6
+Revises: c4e6a8b0d2f4
+Create Date: 2026-10-17 13:05:12.904117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel.sql.sqltypes
+
+
+# revision identifiers, used by Alembic.
+revision = 'd5f7b9c1e3a6'
+down_revision = 'c4e6a8b0d2f4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('blind_index',
+    sa.Column('entry_id', sa.Uuid(), nullable=False),
+    sa.Column('field', sqlmodel.sql.sqltypes.AutoString(length=100), nullable=False),
+    sa.Column('token', sa.LargeBinary(), nullable=False),
+    sa.ForeignKeyConstraint(['entry_id'], ['module_entry.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('entry_id', 'field')
+    )
+    op.create_index('idx_blind_index_lookup', 'blind_index', ['field', 'token'], unique=False)
+    op.add_column('patient', sa.Column('health_card_number_bidx', sa.LargeBinary(), nullable=True))
+    op.create_index(op.f('ix_patient_health_card_number_bidx'), 'patient', ['health_card_number_bidx'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_patient_health_card_number_bidx'), table_name='patient')
+    op.drop_column('patient', 'health_card_number_bidx')
+    op.drop_index('idx_blind_index_lookup', table_name='blind_index')
+    op.drop_table('blind_index')
@@ -0,0 +1,38 @@
+"""pg_trgm search indexes on patient and dossiers
+
+Revision ID: e5a7c9e1f3b5
+Revises: d4f6a8c0e2b3
+Create Date: 2026-10-17 21:04:37.518204
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5a7c9e1f3b5'
+down_revision = 'd4f6a8c0e2b3'
+branch_labels = None
+depends_on = None
+
+
+TRIGRAM_INDEXES = {
+    'idx_patient_first_name_trgm': ('patient', 'lower(first_name)'),
+    'idx_patient_last_name_trgm': ('patient', 'lower(last_name)'),
+    'idx_patient_fiscal_code_trgm': ('patient', 'fiscal_code'),
+    'idx_dossier_notes_trgm': ('dossiers', 'lower(notes)'),
+}
+
+
+def upgrade():
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    # Espressioni identiche a quelle di app/services/search.py
+    for name, (table, expression) in TRIGRAM_INDEXES.items():
+        op.execute(f"CREATE INDEX {name} ON {table} USING gin ({expression} gin_trgm_ops)")
+    op.execute("CREATE INDEX idx_patient_fiscal_code_prefix ON patient (fiscal_code varchar_pattern_ops)")
+
+
+def downgrade():
+    op.execute("DROP INDEX IF EXISTS idx_patient_fiscal_code_prefix")
+    for name in TRIGRAM_INDEXES:
+        op.execute(f"DROP INDEX IF EXISTS {name}")
+    # L'estensione pg_trgm resta: può servire ad altri oggetti del database
@@ -0,0 +1,35 @@
+"""plaintext projection of analytic module fields
+
+Revision ID: e6a8c0d2f4b7
+Revises: d5f7b9c1e3a6
+Create Date: 2026-10-17 14:21:47.630215
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel.sql.sqltypes
+
+
+# revision identifiers, used by Alembic.
+revision = 'e6a8c0d2f4b7'
+down_revision = 'd5f7b9c1e3a6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('module_entry_projection',
+    sa.Column('entry_id', sa.Uuid(), nullable=False),
+    sa.Column('field', sqlmodel.sql.sqltypes.AutoString(length=100), nullable=False),
+    sa.Column('module_code', sqlmodel.sql.sqltypes.AutoString(length=50), nullable=False),
+    sa.Column('num_value', sa.Float(), nullable=True),
+    sa.Column('text_value', sqlmodel.sql.sqltypes.AutoString(length=100), nullable=True),
+    sa.ForeignKeyConstraint(['entry_id'], ['module_entry.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('entry_id', 'field')
+    )
+    op.create_index('idx_projection_module_field', 'module_entry_projection', ['module_code', 'field'], unique=False)
+
+
+def downgrade():
+    op.drop_index('idx_projection_module_field', table_name='module_entry_projection')
+    op.drop_table('module_entry_projection')
@@ -0,0 +1,40 @@
+"""partial indexes on non-deleted rows for the route queries
+
+Revision ID: f6b8d0e2a4c7
+Revises: e5a7c9e1f3b5
+Create Date: 2026-10-17 22:31:08.904417
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f6b8d0e2a4c7'
+down_revision = 'e5a7c9e1f3b5'
+branch_labels = None
+depends_on = None
+
+
+LIVE = sa.text('deleted_at IS NULL')
+
+# nome: (tabella, colonne, colonne INCLUDE)
+LIVE_INDEXES = {
+    'idx_dossier_live_admission': ('dossiers', ['admission_date', 'id'], None),
+    'idx_dossier_live_structure_admission': ('dossiers', ['structure_id', 'admission_date', 'id'], None),
+    'idx_dossier_live_structure_patient': ('dossiers', ['structure_id', 'patient_id'], None),
+    'idx_dossier_live_patient': ('dossiers', ['patient_id'], ['structure_id', 'status']),
+    'idx_patient_live_name': ('patient', ['last_name', 'first_name', 'id'], None),
+    'idx_module_entry_live_dossier_occurred': ('module_entry', ['dossier_id', 'occurred_at', 'id'], None),
+    'idx_module_entry_live_module_occurred': ('module_entry', ['module_code', 'occurred_at', 'id'], None),
+}
+
+
+def upgrade():
+    for name, (table, columns, include) in LIVE_INDEXES.items():
+        op.create_index(name, table, columns, postgresql_where=LIVE, postgresql_include=include or [])
+
+
+def downgrade():
+    for name, (table, _, _) in LIVE_INDEXES.items():
+        op.drop_index(name, table_name=table)
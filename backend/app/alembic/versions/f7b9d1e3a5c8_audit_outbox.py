@@ -0,0 +1,39 @@
+"""audit outbox for batched audit writes
+
+Revision ID: f7b9d1e3a5c8
+Revises: e6a8c0d2f4b7
+Create Date: 2026-10-17 15:02:11.408317
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel.sql.sqltypes
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'f7b9d1e3a5c8'
+down_revision = 'e6a8c0d2f4b7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('audit_outbox',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('ts', sa.DateTime(), nullable=False),
+    sa.Column('user_id', sa.Uuid(), nullable=True),
+    sa.Column('username', sqlmodel.sql.sqltypes.AutoString(length=255), nullable=True),
+    sa.Column('action', sqlmodel.sql.sqltypes.AutoString(length=20), nullable=False),
+    sa.Column('table_name', sqlmodel.sql.sqltypes.AutoString(length=100), nullable=False),
+    sa.Column('record_id', sqlmodel.sql.sqltypes.AutoString(length=50), nullable=False),
+    sa.Column('before', postgresql.JSONB(astext_type=sa.Text()), nullable=True),
+    sa.Column('after', postgresql.JSONB(astext_type=sa.Text()), nullable=True),
+    sa.Column('ip_address', sqlmodel.sql.sqltypes.AutoString(length=45), nullable=True),
+    sa.Column('endpoint', sqlmodel.sql.sqltypes.AutoString(length=255), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('audit_outbox')
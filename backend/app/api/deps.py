@@ -2,18 +2,22 @@
 
 from collections.abc import Generator
 from typing import Annotated
+import uuid
 
 from fastapi import Depends, HTTPException, status, Request
 from fastapi.security import OAuth2PasswordBearer
 from pydantic import ValidationError
 from sqlmodel import Session
 
-from jose import jwt, JWTError   
+from jose import JWTError
 
 from app.core import security
 from app.core.config import settings
 from app.core.db import engine
-from app.models import TokenPayload, User, Role
+from app.middleware.audit_middleware import scope_claims
+from app.models import TokenPayload, User
+from app.services.principal import Principal, principal_from_token
+from app.services.rbac import AccessEvaluator
 
 reusable_oauth2 = OAuth2PasswordBearer(
     tokenUrl=f"{settings.API_V1_STR}/login/access-token"
@@ -29,20 +33,27 @@ SessionDep = Annotated[Session, Depends(get_db)]
 TokenDep = Annotated[str, Depends(reusable_oauth2)]
 
 
-def get_current_user(session: SessionDep, token: TokenDep) -> User:
+def get_token_claims(request: Request, token: TokenDep) -> dict:
+    # Claims già decodificati da AuditMiddleware per questo token (None se non valido)
+    found, payload = scope_claims(request.scope, token)
     try:
-        payload = jwt.decode(
-            token,
-            settings.SECRET_KEY,
-            algorithms=[security.ALGORITHM],  # es. "HS256" o "RS256"
-        )
-        token_data = TokenPayload(**payload)
+        if not found:
+            payload = security.decode_access_token(token)
+        if payload is None:
+            raise JWTError("invalid token")
+        TokenPayload(**payload)
+        return payload
     except (JWTError, ValidationError):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Could not validate credentials",
         )
-    user = session.get(User, token_data.sub)
+
+TokenClaimsDep = Annotated[dict, Depends(get_token_claims)]
+
+
+def get_current_user(session: SessionDep, claims: TokenClaimsDep) -> User:
+    user = session.get(User, claims.get("sub"))
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     if not user.is_active:
@@ -51,6 +62,35 @@ def get_current_user(session: SessionDep, token: TokenDep) -> User:
 
 CurrentUser = Annotated[User, Depends(get_current_user)]
 
+
+def get_current_principal(session: SessionDep, claims: TokenClaimsDep) -> Principal:
+    """
+    Utente e ruolo dalla cache dei principal o dai claim del token se ancora
+    validi: nessuna query a cache calda
+    """
+    try:
+        user_id = uuid.UUID(claims.get("sub"))
+    except (TypeError, ValueError):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Could not validate credentials",
+        )
+    principal = principal_from_token(session, user_id, claims)
+    if not principal:
+        raise HTTPException(status_code=404, detail="User not found")
+    if not principal.is_active:
+        raise HTTPException(status_code=400, detail="Inactive user")
+    return principal
+
+CurrentPrincipal = Annotated[Principal, Depends(get_current_principal)]
+
+
+def get_access_evaluator(session: SessionDep, current_user: CurrentPrincipal) -> AccessEvaluator:
+    """Decisioni RBAC in memoria per la durata della richiesta"""
+    return AccessEvaluator(session, current_user)
+
+AccessDep = Annotated[AccessEvaluator, Depends(get_access_evaluator)]
+
 # Dependency per ottenere request (per audit log READ)
 def get_request_info(request: Request) -> dict:
     """Estrae info dalla request per audit log"""
@@ -62,7 +102,7 @@ def get_request_info(request: Request) -> dict:
 RequestInfo = Annotated[dict, Depends(get_request_info)]
 
 # Sarebbe l'admin il superuser
-def get_current_active_superuser(current_user: CurrentUser) -> User:
+def get_current_active_superuser(current_user: CurrentPrincipal) -> Principal:
     if not current_user.is_superuser:
         raise HTTPException(
             status_code=403, detail="The user doesn't have enough privileges"
@@ -72,9 +112,8 @@ def get_current_active_superuser(current_user: CurrentUser) -> User:
 
 # Passargli il ruolo che richiede per accedere alla rotta
 def require_role(role_name: str):
-    def role_checker(current_user: CurrentUser, session: SessionDep) -> User:
-        role = session.get(Role, current_user.role_id) if current_user.role_id else None
-        if not role or role.name.lower() != role_name.lower():
+    def role_checker(current_user: CurrentPrincipal) -> Principal:
+        if not current_user.role_name or current_user.role_name.lower() != role_name.lower():
             raise HTTPException(
                 status_code=403,
                 detail=f"Requires role: {role_name}",
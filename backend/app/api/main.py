@@ -1,6 +1,6 @@
 from fastapi import APIRouter
 
-from app.api.routes import login, private, users, utils, roles, structures, patients, dossiers, modules
+from app.api.routes import login, private, users, utils, roles, structures, patients, dossiers, modules, audit
 from app.core.config import settings
 
 api_router = APIRouter()
@@ -12,6 +12,7 @@ api_router.include_router(structures.router)
 api_router.include_router(patients.router)
 api_router.include_router(dossiers.router)
 api_router.include_router(modules.router)
+api_router.include_router(audit.router)
 
 # api_router.include_router(items.router)
 
@@ -0,0 +1,121 @@
+from datetime import datetime, timezone
+from typing import Optional
+from uuid import UUID
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from sqlmodel import select
+
+from app.api.deps import CurrentPrincipal, RequestInfo, SessionDep, get_current_active_superuser
+from app.core.db import engine
+from app.models import AuditLog, AuditLogListResponse
+from app.services.audit import log_read_access
+from app.services.audit_export import (
+    EXPORT_MEDIA_TYPES,
+    ExportFormat,
+    export_statement,
+    filter_audit,
+    stream_audit_export,
+)
+from app.services.pagination import CountStrategy, paginate
+from app.services.principal import Principal
+
+router = APIRouter(prefix="/audit", tags=["audit"])
+
+
+# ============================================================================
+# LIST - Eventi di audit con filtri indicizzati
+# ============================================================================
+
+@router.get("", response_model=AuditLogListResponse)
+def list_audit_events(
+    current_user: CurrentPrincipal,
+    session: SessionDep,
+    user_id: Optional[UUID] = Query(None, description="Eventi di un utente"),
+    table_name: Optional[str] = Query(None, description="Tabella (es. patient, dossiers, module_entries)"),
+    record_id: Optional[str] = Query(None, description="Record della tabella (richiede table_name)"),
+    action: Optional[str] = Query(None, description="CREATE, READ, UPDATE, DELETE"),
+    since: Optional[datetime] = Query(None, description="Da (incluso)"),
+    until: Optional[datetime] = Query(None, description="A (escluso)"),
+    page_size: int = Query(50, ge=1, le=500, description="Elementi per pagina"),
+    cursor: str = Query("", description="Cursore opaco (next_cursor); vuoto per la prima pagina"),
+    count: CountStrategy = Query("none", description="Totale: exact, cached, estimate o none"),
+):
+    """
+    Eventi di audit dal più recente, in keyset su (ts, audit_id).
+
+    **Domande tipiche:**
+    - chi ha toccato il paziente X: `table_name=patient&record_id=X`
+    - cosa ha fatto l'utente Y la settimana scorsa: `user_id=Y&since=...&until=...`
+
+    **Controllo accesso:**
+    - superuser: tutti gli eventi
+    - altri utenti: solo i propri eventi
+    """
+    if not current_user.is_superuser:
+        if user_id is not None and user_id != current_user.id:
+            raise HTTPException(403, "Access denied to other users' audit events")
+        user_id = current_user.id
+
+    stmt = filter_audit(
+        select(AuditLog),
+        user_id=user_id, table_name=table_name, record_id=record_id,
+        action=action, since=since, until=until,
+    )
+    result = paginate(
+        session, stmt, [AuditLog.ts, AuditLog.audit_id],
+        page_size=page_size, cursor=cursor, count=count
+    )
+
+    return AuditLogListResponse(
+        items=result.items,
+        total=result.total,
+        page_size=page_size,
+        has_next=result.has_next,
+        next_cursor=result.next_cursor,
+        total_estimated=result.total_estimated
+    )
+
+
+# ============================================================================
+# EXPORT - Esportazione in streaming (solo superuser)
+# ============================================================================
+
+@router.get("/export")
+def export_audit_events(
+    session: SessionDep,
+    request_info: RequestInfo,
+    current_user: Principal = Depends(get_current_active_superuser),
+    format: ExportFormat = Query("ndjson", description="ndjson o csv"),
+    user_id: Optional[UUID] = Query(None),
+    table_name: Optional[str] = Query(None),
+    record_id: Optional[str] = Query(None, description="Richiede table_name"),
+    action: Optional[str] = Query(None),
+    since: Optional[datetime] = Query(None, description="Da (incluso)"),
+    until: Optional[datetime] = Query(None, description="A (escluso)"),
+):
+    """
+    Esporta gli eventi filtrati in ordine cronologico, in streaming
+    (cursore lato server, nessun limite di righe).
+    """
+    stmt = export_statement(
+        user_id=user_id, table_name=table_name, record_id=record_id,
+        action=action, since=since, until=until,
+    )
+
+    # L'esportazione stessa è un accesso in lettura al registro
+    log_read_access(
+        session=session,
+        table_name="audit_log",
+        record_id="export",
+        user=current_user,
+        request_info=request_info
+    )
+    session.commit()
+
+    filename = f"audit_{datetime.now(timezone.utc):%Y%m%dT%H%M%S}.{format}"
+    return StreamingResponse(
+        stream_audit_export(engine, stmt, format),
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
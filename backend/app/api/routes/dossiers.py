@@ -1,17 +1,24 @@
 # app/routers/dossiers.py
 from fastapi import APIRouter, Depends, HTTPException, Query, status
-from sqlmodel import Session, select, func, or_, SQLModel
-from app.api.deps import SessionDep, CurrentUser, RequestInfo
+from sqlmodel import Session, select, SQLModel
+from app.api.deps import SessionDep, CurrentPrincipal, RequestInfo
 from app.models import Dossier, Patient, Structure, ModuleEntry, User
 from app.models import (
     DossierCreate,
     DossierUpdate,
     DossierResponse,
     DossierDetailResponse,
-    DossierListResponse
+    DossierListResponse,
+    EntryResponse
 )
 from app.services.rbac import check_dossier_access, check_structure_access
 from app.services.audit import log_read_access
+from app.services.blind_index import PATIENT_HEALTH_CARD_FIELD, blind_index
+from app.services.pagination import CountStrategy, paginate
+from app.services.dossier_stats import dossier_stats
+from app.services.dossier_summary import summaries_for, summary_for
+from app.services.lifecycle import restore_dossier_entries, soft_delete_dossier_entries
+from app.services.search import contains_all, patient_search
 from datetime import datetime, timezone, date
 from uuid import UUID
 from typing import Optional
@@ -27,7 +34,7 @@ router = APIRouter(prefix="/dossiers", tags=["dossiers"])
 def create_dossier(
     dossier_data: DossierCreate,
     session: SessionDep,
-    current_user: CurrentUser
+    current_user: CurrentPrincipal
 ):
     """
     Crea un nuovo dossier per un paziente.
@@ -87,7 +94,7 @@ def create_dossier(
 def get_dossier(
     dossier_id: UUID,
     session: SessionDep,
-    current_user: CurrentUser,
+    current_user: CurrentPrincipal,
     request_info: RequestInfo,
     include_patient: bool = Query(False, description="Include patient data")
 ):
@@ -98,25 +105,15 @@ def get_dossier(
     - Dati base dossier
     - Count entries
     - Data ultima entry
+    - Entries e ultimo punteggio per modulo
     - Opzionale: dati paziente
     """
     
     # ✅ Verifica accesso
     dossier = check_dossier_access(session, current_user, dossier_id, "READ")
     
-    # ✅ Conta entries
-    entries_stmt = select(func.count(ModuleEntry.id)).where(
-        ModuleEntry.dossier_id == dossier_id,
-        ModuleEntry.deleted_at.is_(None)
-    )
-    entries_count = session.exec(entries_stmt).one()
-    
-    # ✅ Ultima entry
-    last_entry_stmt = select(ModuleEntry.occurred_at).where(
-        ModuleEntry.dossier_id == dossier_id,
-        ModuleEntry.deleted_at.is_(None)
-    ).order_by(ModuleEntry.occurred_at.desc()).limit(1)
-    last_entry_date = session.exec(last_entry_stmt).first()
+    # ✅ Contatori entries (una riga di dossier_summary)
+    summary = summary_for(session, dossier_id)
     
     # ✅ Patient data (se richiesto)
     patient_data = None
@@ -161,8 +158,10 @@ def get_dossier(
         updated_at=dossier.updated_at,
         deleted_at=dossier.deleted_at,
         # Campi aggiuntivi
-        entries_count=entries_count,
-        last_entry_date=last_entry_date,
+        entries_count=summary["entries_count"],
+        last_entry_date=summary["last_entry_at"],
+        module_counts=summary["module_counts"],
+        last_scores=summary["last_scores"],
         patient=patient_data
     )
     # return DossierDetailResponse(
@@ -180,7 +179,7 @@ def get_dossier(
 @router.get("", response_model=DossierListResponse)
 def list_dossiers(
     session: SessionDep,
-    current_user: CurrentUser,
+    current_user: CurrentPrincipal,
     utente: Optional[str] = Query(None, description="Filtra per utente"),
     structure_id: Optional[UUID] = Query(None, description="Filtra per struttura"),
     patient_id: Optional[UUID] = Query(None, description="Filtra per paziente"),
@@ -192,7 +191,10 @@ def list_dossiers(
     include_discharged: bool = Query(True, description="Includi dimessi"),
     include_deleted: bool = Query(False, description="Includi soft-deleted"),
     page: int = Query(1, ge=1),
-    page_size: int = Query(50, ge=1, le=100)
+    page_size: int = Query(50, ge=1, le=100),
+    cursor: Optional[str] = Query(None, description="Cursore opaco (next_cursor); vuoto per la prima pagina in modalità cursore"),
+    with_total: Optional[bool] = Query(None, description="Calcola il totale (default: sì a pagine, no con cursore)"),
+    count: Optional[CountStrategy] = Query(None, description="Totale: exact, cached (TTL breve), estimate (planner) o none")
 ):
     """
     Lista dossiers con filtri multipli.
@@ -202,6 +204,12 @@ def list_dossiers(
     - Paziente
     - Status
     - Range date ammissione/dimissione
+    
+    **Paginazione:**
+    - A pagine: `page` / `page_size` (OFFSET, compatibile con i client esistenti)
+    - Cursore: `cursor` = `next_cursor` della risposta precedente (keyset, costo costante)
+    - `with_total`: il totale è opzionale in modalità cursore
+    - `count`: strategia del totale (exact / cached / estimate / none)
     """
     
     # ✅ Base query
@@ -247,22 +255,31 @@ def list_dossiers(
     if not include_deleted:
         stmt = stmt.where(Dossier.deleted_at.is_(None))
     
-    # Count totale
-    count_stmt = select(func.count()).select_from(stmt.subquery())
-    total = session.exec(count_stmt).one()
-    
-    # Paginazione
-    stmt = stmt.order_by(Dossier.admission_date.desc())
-    stmt = stmt.offset((page - 1) * page_size).limit(page_size)
+    # Paginazione (admission_date, id)
+    result = paginate(
+        session, stmt, [Dossier.admission_date, Dossier.id],
+        page=page, page_size=page_size, cursor=cursor, with_total=with_total, count=count
+    )
     
-    dossiers = session.exec(stmt).all()
+    # Contatori della pagina da dossier_summary (una query IN)
+    summaries = summaries_for(session, [dossier.id for dossier in result.items])
+    items = []
+    for dossier in result.items:
+        summary = summaries.get(dossier.id)
+        item = DossierResponse.model_validate(dossier)
+        if summary is not None:
+            item.entries_count = summary.entries_count
+            item.last_entry_date = summary.last_entry_at
+        items.append(item)
     
     return DossierListResponse(
-        items=dossiers,
-        total=total,
-        page=page,
+        items=items,
+        total=result.total,
+        page=None if cursor is not None else page,
         page_size=page_size,
-        has_next=(page * page_size) < total
+        has_next=result.has_next,
+        next_cursor=result.next_cursor,
+        total_estimated=result.total_estimated
     )
 
 
@@ -275,7 +292,7 @@ def update_dossier(
     dossier_id: UUID,
     dossier_data: DossierUpdate,
     session: SessionDep,
-    current_user: CurrentUser
+    current_user: CurrentPrincipal
 ):
     """
     Aggiorna un dossier esistente.
@@ -332,7 +349,7 @@ def update_dossier(
 def delete_dossier(
     dossier_id: UUID,
     session: SessionDep,
-    current_user: CurrentUser,
+    current_user: CurrentPrincipal,
     hard_delete: bool = Query(False, description="Elimina definitivamente (solo superuser)")
 ):
     """
@@ -366,19 +383,12 @@ def delete_dossier(
         if dossier.deleted_at:
             raise HTTPException(410, "Dossier already deleted")
         
-        dossier.deleted_at = datetime.now(timezone.utc)
+        now = datetime.now(timezone.utc)
+        dossier.deleted_at = now
         dossier.deleted_by_user_id = current_user.id
         
-        # Soft delete anche entries associate
-        entries_stmt = select(ModuleEntry).where(
-            ModuleEntry.dossier_id == dossier_id,
-            ModuleEntry.deleted_at.is_(None)
-        )
-        entries = session.exec(entries_stmt).all()
-        for entry in entries:
-            entry.deleted_at = datetime.now(timezone.utc)
-            entry.deleted_by_user_id = current_user.id
-            session.add(entry)
+        # Soft delete anche entries associate (una UPDATE, audit in blocco)
+        soft_delete_dossier_entries(session, dossier_id, current_user.id, now)
         
         session.add(dossier)
     
@@ -394,7 +404,7 @@ def delete_dossier(
 def restore_dossier(
     dossier_id: UUID,
     session: SessionDep,
-    current_user: CurrentUser,
+    current_user: CurrentPrincipal,
     restore_entries: bool = Query(True, description="Ripristina anche le entries")
 ):
     """
@@ -420,19 +430,9 @@ def restore_dossier(
     dossier.updated_at = datetime.now(timezone.utc)
     dossier.updated_by_user_id = current_user.id
     
-    # Ripristina entries se richiesto
+    # Ripristina entries se richiesto (una UPDATE, audit in blocco)
     if restore_entries:
-        entries_stmt = select(ModuleEntry).where(
-            ModuleEntry.dossier_id == dossier_id,
-            ModuleEntry.deleted_at.is_not(None)
-        )
-        entries = session.exec(entries_stmt).all()
-        for entry in entries:
-            entry.deleted_at = None
-            entry.deleted_by_user_id = None
-            entry.updated_at = datetime.now(timezone.utc)
-            entry.updated_by_user_id = current_user.id
-            session.add(entry)
+        restore_dossier_entries(session, dossier_id)
     
     session.add(dossier)
     session.commit()
@@ -449,7 +449,7 @@ def restore_dossier(
 def discharge_dossier(
     dossier_id: UUID,
     session: SessionDep,
-    current_user: CurrentUser,
+    current_user: CurrentPrincipal,
     discharge_date: datetime = Query(..., description="Data dimissione"),
     discharge_reason: Optional[str] = Query(None, description="Motivo dimissione")
 ):
@@ -504,7 +504,7 @@ def transfer_dossier(
     dossier_id: UUID,
     transfer_data: TransferRequest,
     session: SessionDep,
-    current_user: CurrentUser
+    current_user: CurrentPrincipal
 ):
     """
     Trasferisci un paziente ad altra struttura.
@@ -574,65 +574,40 @@ def transfer_dossier(
 @router.get("/stats/summary")
 def get_dossier_stats(
     session: SessionDep,
-    current_user: CurrentUser,
+    current_user: CurrentPrincipal,
     structure_id: Optional[UUID] = Query(None),
     from_date: Optional[date] = Query(None),
     to_date: Optional[date] = Query(None)
 ):
     """
-    Statistiche aggregate sui dossier.
+    Statistiche aggregate sui dossier, calcolate in una sola query SQL.
     
     **Metriche:**
-    - Totale dossier attivi
-    - Totale dimessi nel periodo
-    - Media giorni degenza
-    - Distribuzione per status
+    - Totale dossier e distribuzione per status
+    - Media e percentili (p50, p90) dei giorni di degenza dei dimessi
+    - Ripartizione per livello assistenziale (R3/R3D)
+    - Bucket mensili per data di ricovero
     """
     
-    # Base query
-    stmt = select(Dossier).where(Dossier.deleted_at.is_(None))
+    conditions = []
     
     # Filtro struttura
     if structure_id:
         check_structure_access(session, current_user, structure_id)
-        stmt = stmt.where(Dossier.structure_id == structure_id)
+        conditions.append(Dossier.structure_id == structure_id)
     elif not current_user.is_superuser:
         if not current_user.structure_id:
             raise HTTPException(403, "User not assigned to any structure")
-        stmt = stmt.where(Dossier.structure_id == current_user.structure_id)
+        conditions.append(Dossier.structure_id == current_user.structure_id)
     
     # Filtro date
     if from_date:
-        stmt = stmt.where(Dossier.admission_date >= datetime.combine(from_date, datetime.min.time()))
+        conditions.append(Dossier.admission_date >= datetime.combine(from_date, datetime.min.time()))
     if to_date:
-        stmt = stmt.where(Dossier.admission_date <= datetime.combine(to_date, datetime.max.time()))
-    
-    dossiers = session.exec(stmt).all()
-    
-    # Calcola statistiche
-    total = len(dossiers)
-    active = sum(1 for d in dossiers if d.status == "active")
-    discharged = sum(1 for d in dossiers if d.status == "discharged")
-    transferred = sum(1 for d in dossiers if d.status == "transferred")
-    
-    # Media giorni degenza per dimessi
-    avg_stay_days = None
-    if discharged > 0:
-        total_days = sum(
-            (d.discharge_date - d.admission_date).days 
-            for d in dossiers 
-            if d.status == "discharged" and d.discharge_date
-        )
-        avg_stay_days = total_days / discharged if discharged > 0 else 0
+        conditions.append(Dossier.admission_date <= datetime.combine(to_date, datetime.max.time()))
     
     return {
-        "total": total,
-        "by_status": {
-            "active": active,
-            "discharged": discharged,
-            "transferred": transferred
-        },
-        "avg_stay_days": round(avg_stay_days, 1) if avg_stay_days else None,
+        **dossier_stats(session, *conditions),
         "filters_applied": {
             "structure_id": str(structure_id) if structure_id else None,
             "from_date": from_date.isoformat() if from_date else None,
@@ -649,12 +624,15 @@ def get_dossier_stats(
 def get_dossier_entries(
     dossier_id: UUID,
     session: SessionDep,
-    current_user: CurrentUser,
+    current_user: CurrentPrincipal,
     module_code: Optional[str] = Query(None, description="Filtra per modulo"),
     from_date: Optional[date] = Query(None),
     to_date: Optional[date] = Query(None),
     page: int = Query(1, ge=1),
-    page_size: int = Query(50, ge=1, le=100)
+    page_size: int = Query(50, ge=1, le=100),
+    cursor: Optional[str] = Query(None, description="Cursore opaco (next_cursor); vuoto per la prima pagina in modalità cursore"),
+    with_total: Optional[bool] = Query(None, description="Calcola il totale (default: sì a pagine, no con cursore)"),
+    count: Optional[CountStrategy] = Query(None, description="Totale: exact, cached (TTL breve), estimate (planner) o none")
 ):
     """
     Lista tutte le entries di un dossier.
@@ -663,6 +641,12 @@ def get_dossier_entries(
     - Timeline clinica del paziente
     - Report completo dossier
     - Export dati
+    
+    **Paginazione:**
+    - A pagine: `page` / `page_size` (OFFSET, compatibile con i client esistenti)
+    - Cursore: `cursor` = `next_cursor` della risposta precedente (keyset, costo costante)
+    - `with_total`: il totale è opzionale in modalità cursore
+    - `count`: strategia del totale (exact / cached / estimate / none)
     """
     
     # ✅ Verifica accesso
@@ -682,23 +666,21 @@ def get_dossier_entries(
     if to_date:
         stmt = stmt.where(ModuleEntry.occurred_at <= datetime.combine(to_date, datetime.max.time()))
     
-    # Count
-    count_stmt = select(func.count()).select_from(stmt.subquery())
-    total = session.exec(count_stmt).one()
-    
-    # Paginazione
-    stmt = stmt.order_by(ModuleEntry.occurred_at.desc())
-    stmt = stmt.offset((page - 1) * page_size).limit(page_size)
-    
-    entries = session.exec(stmt).all()
+    # Paginazione (occurred_at, id)
+    result = paginate(
+        session, stmt, [ModuleEntry.occurred_at, ModuleEntry.id],
+        page=page, page_size=page_size, cursor=cursor, with_total=with_total, count=count
+    )
     
     return {
         "dossier_id": str(dossier_id),
-        "items": entries,
-        "total": total,
-        "page": page,
+        "items": EntryResponse.from_entries(result.items),
+        "total": result.total,
+        "page": None if cursor is not None else page,
         "page_size": page_size,
-        "has_next": (page * page_size) < total
+        "has_next": result.has_next,
+        "next_cursor": result.next_cursor,
+        "total_estimated": result.total_estimated
     }
 
 
@@ -709,13 +691,17 @@ def get_dossier_entries(
 @router.get("/search/advanced")
 def search_dossiers(
     session: SessionDep,
-    current_user: CurrentUser,
+    current_user: CurrentPrincipal,
     q: Optional[str] = Query(None, description="Cerca per nome/cognome paziente o codice fiscale"),
-    diagnosis: Optional[str] = Query(None, description="Cerca per diagnosi"),
+    diagnosis: Optional[str] = Query(None, description="Cerca per diagnosi (nelle note del dossier)"),
+    health_card_number: Optional[str] = Query(None, description="Tessera sanitaria (corrispondenza esatta)"),
     structure_id: Optional[UUID] = Query(None),
     status: Optional[str] = Query(None),
     page: int = Query(1, ge=1),
-    page_size: int = Query(50, ge=1, le=100)
+    page_size: int = Query(50, ge=1, le=100),
+    cursor: Optional[str] = Query(None, description="Cursore opaco (next_cursor); vuoto per la prima pagina in modalità cursore"),
+    with_total: Optional[bool] = Query(None, description="Calcola il totale (default: sì a pagine, no con cursore)"),
+    count: Optional[CountStrategy] = Query(None, description="Totale: exact, cached (TTL breve), estimate (planner) o none")
 ):
     """
     Ricerca avanzata dossier con filtri multipli.
@@ -723,9 +709,16 @@ def search_dossiers(
     **Ricerca per:**
     - Nome/cognome paziente
     - Codice fiscale
-    - Diagnosi
+    - Tessera sanitaria (esatta, tramite indice cieco)
+    - Diagnosi (testo nelle note del dossier)
     - Struttura
     - Status
+    
+    **Paginazione:**
+    - A pagine: `page` / `page_size` (OFFSET, compatibile con i client esistenti)
+    - Cursore: `cursor` = `next_cursor` della risposta precedente (keyset, costo costante)
+    - `with_total`: il totale è opzionale in modalità cursore
+    - `count`: strategia del totale (exact / cached / estimate / none)
     """
     
     # Base query con join Patient
@@ -740,21 +733,24 @@ def search_dossiers(
             raise HTTPException(403, "User not assigned to any structure")
         stmt = stmt.where(Dossier.structure_id == current_user.structure_id)
     
-    # Ricerca testo (nome, cognome, CF)
-    if q:
-        search_term = f"%{q.lower()}%"
+    # Ricerca testo (nome, cognome, CF) sugli indici trigrammi del paziente
+    search = patient_search(q, session.get_bind().dialect.name)
+    if search is not None:
+        stmt = stmt.where(search.condition)
+        # Rank solo a pagine: il cursore codifica le sole colonne di ordinamento
+        if search.rank is not None and cursor is None:
+            stmt = stmt.order_by(search.rank.desc())
+    
+    # Tessera sanitaria: confronto sul token HMAC
+    if health_card_number:
         stmt = stmt.where(
-            or_(
-                func.lower(Patient.first_name).like(search_term),
-                func.lower(Patient.last_name).like(search_term),
-                func.lower(Patient.fiscal_code).like(search_term)
-            )
+            Patient.health_card_number_bidx == blind_index(PATIENT_HEALTH_CARD_FIELD, health_card_number)
         )
     
-    # Ricerca diagnosi
-    if diagnosis:
-        diag_term = f"%{diagnosis.lower()}%"
-        stmt = stmt.where(func.lower(Dossier.primary_diagnosis).like(diag_term))
+    # Ricerca diagnosi: il dossier non ha un campo diagnosi, si cerca nelle note
+    diagnosis_condition = contains_all(Dossier.notes, diagnosis)
+    if diagnosis_condition is not None:
+        stmt = stmt.where(diagnosis_condition)
     
     # Filtro status
     if status:
@@ -766,21 +762,19 @@ def search_dossiers(
         Patient.deleted_at.is_(None)
     )
     
-    # Count
-    count_stmt = select(func.count()).select_from(stmt.subquery())
-    total = session.exec(count_stmt).one()
-    
-    # Paginazione
-    stmt = stmt.order_by(Dossier.admission_date.desc())
-    stmt = stmt.offset((page - 1) * page_size).limit(page_size)
-    
-    dossiers = session.exec(stmt).all()
+    # Paginazione (admission_date, id)
+    result = paginate(
+        session, stmt, [Dossier.admission_date, Dossier.id],
+        page=page, page_size=page_size, cursor=cursor, with_total=with_total, count=count
+    )
     
     return {
-        "items": dossiers,
-        "total": total,
-        "page": page,
+        "items": result.items,
+        "total": result.total,
+        "page": None if cursor is not None else page,
         "page_size": page_size,
-        "has_next": (page * page_size) < total,
+        "has_next": result.has_next,
+        "next_cursor": result.next_cursor,
+        "total_estimated": result.total_estimated,
         "search_query": q
     }
\ No newline at end of file
@@ -2,6 +2,7 @@ from datetime import timedelta
 from typing import Annotated, Any
 
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import HTMLResponse
 from fastapi.security import OAuth2PasswordRequestForm
 
@@ -11,6 +12,7 @@ from app.core import security
 from app.core.config import settings
 from app.core.security import get_password_hash
 from app.models import Message, NewPassword, Token, UserPublic
+from app.services.principal import TOKEN_ROLE_CLAIMS, load_principal, principal_claims
 from app.utils import (
     generate_password_reset_token,
     generate_reset_password_email,
@@ -22,13 +24,14 @@ router = APIRouter(tags=["login"])
 
 
 @router.post("/login/access-token")
-def login_access_token(
+async def login_access_token(
     session: SessionDep, form_data: Annotated[OAuth2PasswordRequestForm, Depends()]
 ) -> Token:
     """
     OAuth2 compatible token login, get an access token for future requests
     """
-    user = crud.authenticate(
+    # async: l'attesa di bcrypt non occupa un thread del limiter AnyIO
+    user = await crud.authenticate_async(
         session=session, email=form_data.username, password=form_data.password
     )
     if not user:
@@ -36,9 +39,14 @@ def login_access_token(
     # elif not user.is_active:
     #     raise HTTPException(status_code=400, detail="Inactive user")
     access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
+    claims = None
+    if TOKEN_ROLE_CLAIMS:
+        # Permessi del ruolo nel token: niente query di autenticazione finché la versione non cambia
+        principal = await run_in_threadpool(load_principal, session, user.id)
+        claims = principal_claims(principal) if principal else None
     return Token(
         access_token=security.create_access_token(
-            user.id, expires_delta=access_token_expires
+            user.id, expires_delta=access_token_expires, claims=claims
         )
     )
 
@@ -1,21 +1,29 @@
 # app/routers/modules_dynamic.py
+import copy
+
 from fastapi import APIRouter, Depends, HTTPException, Query, status
 from sqlmodel import select, func, and_
 from app.api.deps import (
     SessionDep,
-    CurrentUser,
+    AccessDep,
+    CurrentPrincipal,
     RequestInfo,
+    get_current_active_superuser,
 )
-from app.models import ( ModuleEntry, Role, EntryCreate, EntryResponse, EntryListResponse, EntryUpdate, ModuleInfo,
+from app.models import ( ModuleEntry, BlindIndex, Dossier, EntryProjection, EntryCreate, EntryResponse, EntryListResponse, EntryUpdate, ModuleInfo,
     ModuleCatalog, ModuleCatalogCreate, ModuleCatalogUpdate, ModuleCatalogResponse, ModuleCatalogListResponse)
 from app.services.module_service import ModuleService
 from app.module_registry import REGISTRY
 from app.services.audit import log_read_access
 from app.services.rbac import check_module_access, check_dossier_access
+from app.services.encryption import field_encryption
+from app.services.blind_index import parse_field_filters
+from app.services.projection import projected_fields
+from app.services.pagination import CountStrategy, paginate
 from datetime import datetime, timezone, date
 from uuid import UUID
 from pydantic import BaseModel
-from typing import Optional
+from typing import Literal, Optional
 
 router = APIRouter(prefix="/modules", tags=["modules"])
 
@@ -29,7 +37,7 @@ router = APIRouter(prefix="/modules", tags=["modules"])
 def create_module(
     data: ModuleCatalogCreate,
     session: SessionDep,
-    current_user: CurrentUser,
+    current_user: CurrentPrincipal,
 ):
     existing = session.exec(select(ModuleCatalog).where(ModuleCatalog.code == data.code)).first()
     if existing:
@@ -48,7 +56,7 @@ def create_module(
 # GET SINGLE MODULE
 # =========================================================
 @router.get("/catalogs/{module_id}", response_model=ModuleCatalogResponse)
-def get_module(module_id: int, session: SessionDep, current_user: CurrentUser):
+def get_module(module_id: int, session: SessionDep, current_user: CurrentPrincipal):
     obj = session.get(ModuleCatalog, module_id)
     if not obj:
         raise HTTPException(404, "Module not found")
@@ -61,7 +69,7 @@ def get_module(module_id: int, session: SessionDep, current_user: CurrentUser):
 @router.get("/catalogs", response_model=ModuleCatalogListResponse)
 def list_modules(
     session: SessionDep,
-    current_user: CurrentUser,
+    current_user: CurrentPrincipal,
     q: str | None = Query(None, description="Filtro per codice o nome"),
     active_only: bool = Query(False, description="Mostra solo moduli attivi"),
     page: int = Query(1, ge=1),
@@ -100,7 +108,7 @@ def update_module(
     module_id: int,
     data: ModuleCatalogUpdate,
     session: SessionDep,
-    current_user: CurrentUser,
+    current_user: CurrentPrincipal,
 ):
     obj = session.get(ModuleCatalog, module_id)
     if not obj:
@@ -122,7 +130,7 @@ def update_module(
 # DELETE MODULE
 # =========================================================
 @router.delete("/catalogs/{module_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_module(module_id: int, session: SessionDep, current_user: CurrentUser):
+def delete_module(module_id: int, session: SessionDep, current_user: CurrentPrincipal):
     obj = session.get(ModuleCatalog, module_id)
     if not obj:
         raise HTTPException(404, "Module not found")
@@ -139,7 +147,7 @@ def delete_module(module_id: int, session: SessionDep, current_user: CurrentUser
 @router.post("/entries", response_model=EntryResponse, status_code=status.HTTP_201_CREATED)
 def create_entry(
     entry_data: EntryCreate,
-    current_user: CurrentUser,
+    current_user: CurrentPrincipal,
     session: SessionDep
 ):
     """
@@ -194,7 +202,7 @@ def create_entry(
     )
     
     # ✅ USA IL METODO set_data() invece di assegnazione diretta
-    entry.set_data(validated_dict)
+    entry.set_data(validated_dict, session=session)
     
     # print(f"DEBUG data_encrypted: {entry.data_encrypted[:100] if entry.data_encrypted else None}")
     # if entry.data_encrypted is None:
@@ -216,7 +224,7 @@ def create_entry(
 @router.get("/entries/{entry_id}", response_model=EntryResponse)
 def get_entry(
     entry_id: UUID,
-    current_user: CurrentUser,
+    current_user: CurrentPrincipal,
     request_info: RequestInfo,
     session: SessionDep,
     target_version: Optional[int] = Query(None, description="Converti a versione specifica")
@@ -256,7 +264,7 @@ def get_entry(
                 module_code=entry.module_code,
                 from_version=entry.schema_version,
                 to_version=target_version,
-                data=entry.data
+                data=copy.deepcopy(dict(entry.get_data()))
             )
             # Crea entry temporanea con versione convertita
             entry_dict = {
@@ -293,28 +301,39 @@ def get_entry(
 
 @router.get("/entries", response_model=EntryListResponse)
 def list_entries(
-    current_user: CurrentUser,
+    current_user: CurrentPrincipal,
     session: SessionDep,
     dossier_id: Optional[UUID] = Query(None, description="Filtra per dossier"),
     module_code: Optional[str] = Query(None, description="Filtra per modulo"),
     from_date: Optional[date] = Query(None, description="Data minima (occurred_at)"),
     to_date: Optional[date] = Query(None, description="Data massima (occurred_at)"),
+    field: Optional[list[str]] = Query(None, description="Filtro esatto campo=valore sui campi indicizzati (ripetibile)"),
     page: int = Query(1, ge=1, description="Numero pagina"),
     page_size: int = Query(50, ge=1, le=100, description="Elementi per pagina"),
+    cursor: Optional[str] = Query(None, description="Cursore opaco (next_cursor); vuoto per la prima pagina in modalità cursore"),
+    with_total: Optional[bool] = Query(None, description="Calcola il totale (default: sì a pagine, no con cursore)"),
+    count: Optional[CountStrategy] = Query(None, description="Totale: exact, cached (TTL breve), estimate (planner) o none"),
     include_deleted: bool = Query(False, description="Includi entry cancellate")
 ):
     """
     Lista entries con filtri multipli e paginazione.
     
     **Filtri disponibili:**
-    - `dossier_id`: Filtra per dossier specifico
+    - `dossier_id`: Filtra per dossier specifico (senza dossier, i non-superuser
+      vedono solo le entry della propria struttura)
     - `module_code`: Filtra per tipo modulo
     - `from_date` / `to_date`: Range temporale
+    - `field`: Valore esatto di un campo del payload, es. `punteggio_totale=12`
+      (campi in `blind_index_fields` via indice cieco, campi in `projection_fields` sulla proiezione)
     - `include_deleted`: Include entry soft-deleted
     
     **Paginazione:**
     - `page`: Numero pagina (default 1)
     - `page_size`: Elementi per pagina (max 100)
+    - `cursor`: `next_cursor` della risposta precedente (keyset su occurred_at, id);
+      vuoto per iniziare in modalità cursore
+    - `with_total`: totale opzionale in modalità cursore
+    - `count`: strategia del totale (exact / cached con TTL breve / estimate del planner / none)
     """
     
     # ✅ Se specificato module_code, verifica permessi
@@ -331,15 +350,21 @@ def list_entries(
     # Filtro dossier
     if dossier_id:
         stmt = stmt.where(ModuleEntry.dossier_id == dossier_id)
+    elif not current_user.is_superuser:
+        # Senza dossier (anche con filtri per campo) i non-superuser vedono solo la propria struttura
+        if not current_user.structure_id:
+            raise HTTPException(403, "User not assigned to any structure")
+        stmt = stmt.join(Dossier, Dossier.id == ModuleEntry.dossier_id).where(
+            Dossier.structure_id == current_user.structure_id
+        )
     
     # Filtro modulo
     if module_code:
         stmt = stmt.where(ModuleEntry.module_code == module_code)
     else:
         # Mostra solo moduli per cui ha permesso READ
-        role = session.get(Role, current_user.role_id) if current_user.role_id else None
-        if role and role.modules:
-            stmt = stmt.where(ModuleEntry.module_code.in_(role.modules))
+        if current_user.modules:
+            stmt = stmt.where(ModuleEntry.module_code.in_(current_user.modules))
         else:
             # Nessun permesso
             return EntryListResponse(
@@ -360,26 +385,39 @@ def list_entries(
             ModuleEntry.occurred_at <= datetime.combine(to_date, datetime.max.time())
         )
     
+    # Filtri esatti: campi cifrati via indice cieco, campi proiettati sulla proiezione in chiaro
+    for field_filter in parse_field_filters(field, module_code):
+        if field_filter.token is not None:
+            matches = select(BlindIndex.entry_id).where(
+                BlindIndex.field == field_filter.field, BlindIndex.token == field_filter.token
+            )
+        else:
+            matches = select(EntryProjection.entry_id).where(
+                EntryProjection.field == field_filter.field,
+                EntryProjection.num_value == field_filter.num_value
+                if field_filter.num_value is not None
+                else EntryProjection.text_value == field_filter.text_value,
+            )
+        stmt = stmt.where(ModuleEntry.id.in_(matches))
+    
     # Filtro soft delete
     if not include_deleted:
         stmt = stmt.where(ModuleEntry.deleted_at.is_(None))
     
-    # Count totale
-    count_stmt = select(func.count()).select_from(stmt.subquery())
-    total = session.exec(count_stmt).one()
-    
-    # Paginazione e ordinamento
-    stmt = stmt.order_by(ModuleEntry.occurred_at.desc())
-    stmt = stmt.offset((page - 1) * page_size).limit(page_size)
-    
-    entries = session.exec(stmt).all()
+    # Paginazione e ordinamento (occurred_at, id)
+    result = paginate(
+        session, stmt, [ModuleEntry.occurred_at, ModuleEntry.id],
+        page=page, page_size=page_size, cursor=cursor, with_total=with_total, count=count
+    )
     
     return EntryListResponse(
-        items=entries,
-        total=total,
-        page=page,
+        items=EntryResponse.from_entries(result.items),
+        total=result.total,
+        page=None if cursor is not None else page,
         page_size=page_size,
-        has_next=(page * page_size) < total
+        has_next=result.has_next,
+        next_cursor=result.next_cursor,
+        total_estimated=result.total_estimated
     )
 
 
@@ -391,7 +429,7 @@ def list_entries(
 def update_entry(
     entry_id: UUID,
     entry_data: EntryUpdate,
-    current_user: CurrentUser,
+    current_user: CurrentPrincipal,
     session: SessionDep
 ):
     """
@@ -431,7 +469,7 @@ def update_entry(
                 version=entry.schema_version,
                 payload=entry_data.data
             )
-            entry.data = validated_data.model_dump()
+            entry.set_data(validated_data.model_dump(), session=session)
         except ValueError as e:
             raise HTTPException(400, f"Schema validation failed: {str(e)}")
         except Exception as e:
@@ -460,7 +498,7 @@ def update_entry(
 @router.post("/entries/{entry_id}/upgrade-version", response_model=EntryResponse)
 def upgrade_entry_version(
     entry_id: UUID,
-    current_user: CurrentUser,
+    current_user: CurrentPrincipal,
     session: SessionDep,
     target_version: int = Query(..., description="Versione target", ge=1)
 ):
@@ -509,14 +547,14 @@ def upgrade_entry_version(
             module_code=entry.module_code,
             from_version=entry.schema_version,
             to_version=target_version,
-            data=entry.data
+            data=copy.deepcopy(dict(entry.get_data()))
         )
     except ValueError as e:
         raise HTTPException(400, f"Migration failed: {str(e)}")
     
     # Salva permanentemente la nuova versione
     entry.schema_version = target_version
-    entry.data = migrated_data
+    entry.set_data(migrated_data, session=session)
     
     session.add(entry)
     session.commit()
@@ -532,7 +570,7 @@ def upgrade_entry_version(
 @router.delete("/entries/{entry_id}", status_code=status.HTTP_204_NO_CONTENT)
 def delete_entry(
     entry_id: UUID,
-    current_user: CurrentUser,
+    current_user: CurrentPrincipal,
     session: SessionDep,
     hard_delete: bool = Query(
         False, 
@@ -588,7 +626,7 @@ def delete_entry(
 @router.post("/entries/{entry_id}/restore", response_model=EntryResponse)
 def restore_entry(
     entry_id: UUID,
-    current_user: CurrentUser,
+    current_user: CurrentPrincipal,
     session: SessionDep
 ):
     """
@@ -627,7 +665,7 @@ def restore_entry(
 
 @router.get("/available", response_model=list[ModuleInfo])
 def get_available_modules(
-    current_user: CurrentUser,
+    current_user: CurrentPrincipal,
     session: SessionDep,
     include_schema: bool = Query(False, description="Includi schema JSON dei moduli")
 ):
@@ -646,11 +684,10 @@ def get_available_modules(
     """
     
     # Ottieni moduli accessibili dal ruolo
-    role = session.get(Role, current_user.role_id) if current_user.role_id else None
-    if not role or not role.modules:
+    if not current_user.modules:
         return []
     
-    accessible_modules = role.modules
+    accessible_modules = current_user.modules
     
     # Costruisci lista moduli
     modules_dict = {}
@@ -682,7 +719,7 @@ def get_available_modules(
 
 @router.get("/stats/summary")
 def get_entries_stats(
-    current_user: CurrentUser,
+    current_user: CurrentPrincipal,
     session: SessionDep,
     dossier_id: Optional[UUID] = Query(None, description="Filtra per dossier"),
     from_date: Optional[date] = Query(None),
@@ -702,8 +739,7 @@ def get_entries_stats(
     """
     
     # Ottieni moduli accessibili
-    role = session.get(Role, current_user.role_id) if current_user.role_id else None
-    if not role or not role.modules:
+    if not current_user.modules:
         return {"modules": [], "total": 0}
     
     # Query base
@@ -711,7 +747,7 @@ def get_entries_stats(
         ModuleEntry.module_code,
         func.count(ModuleEntry.id).label('count')
     ).where(
-        ModuleEntry.module_code.in_(role.modules),
+        ModuleEntry.module_code.in_(current_user.modules),
         ModuleEntry.deleted_at.is_(None)
     )
     
@@ -739,6 +775,113 @@ def get_entries_stats(
     }
 
 
+@router.get("/stats/fields")
+def get_field_stats(
+    current_user: CurrentPrincipal,
+    session: SessionDep,
+    module_code: str = Query(..., description="Codice modulo"),
+    field: str = Query(..., description="Campo proiettato, es. punteggio_totale"),
+    group_by: list[Literal["structure", "month", "value"]] = Query([], description="Dimensioni di raggruppamento"),
+    structure_id: Optional[UUID] = Query(None, description="Filtra per struttura"),
+    from_date: Optional[date] = Query(None),
+    to_date: Optional[date] = Query(None)
+):
+    """
+    Aggregazioni su un campo del modulo, calcolate interamente in SQL.
+    
+    Legge solo `module_entry_projection` (campi dichiarati in
+    `projection_fields`): nessun payload viene decrittato.
+    
+    **Metriche per gruppo:**
+    - count, avg, min, max (sui valori numerici; i booleani valgono 0/1)
+    
+    **Raggruppamenti:**
+    - `structure`: struttura del dossier
+    - `month`: mese di occurred_at
+    - `value`: valore testuale (enum)
+    """
+    check_module_access(session, current_user, module_code, "READ")
+    
+    allowed = projected_fields(module_code)
+    if field not in allowed:
+        raise HTTPException(400, f"Field '{field}' is not projected. Available fields: {list(allowed)}")
+    
+    # Struttura: i non-superuser vedono solo la propria
+    if not current_user.is_superuser:
+        if not current_user.structure_id:
+            raise HTTPException(403, "User not assigned to any structure")
+        if structure_id and structure_id != current_user.structure_id:
+            raise HTTPException(403, "Access denied to this structure")
+        structure_id = current_user.structure_id
+    
+    dimensions = {
+        "structure": Dossier.structure_id.label("structure_id"),
+        "month": func.date_trunc("month", ModuleEntry.occurred_at).label("month"),
+        "value": EntryProjection.text_value.label("value"),
+    }
+    group_columns = [dimensions[name] for name in dict.fromkeys(group_by)]
+    
+    stmt = (
+        select(
+            *group_columns,
+            func.count().label("count"),
+            func.avg(EntryProjection.num_value).label("avg"),
+            func.min(EntryProjection.num_value).label("min"),
+            func.max(EntryProjection.num_value).label("max"),
+        )
+        .select_from(EntryProjection)
+        .join(ModuleEntry, ModuleEntry.id == EntryProjection.entry_id)
+        .where(
+            EntryProjection.module_code == module_code,
+            EntryProjection.field == field,
+            ModuleEntry.deleted_at.is_(None)
+        )
+    )
+    
+    if structure_id or "structure" in group_by:
+        stmt = stmt.join(Dossier, Dossier.id == ModuleEntry.dossier_id)
+    if structure_id:
+        stmt = stmt.where(Dossier.structure_id == structure_id)
+    if from_date:
+        stmt = stmt.where(
+            ModuleEntry.occurred_at >= datetime.combine(from_date, datetime.min.time())
+        )
+    if to_date:
+        stmt = stmt.where(
+            ModuleEntry.occurred_at <= datetime.combine(to_date, datetime.max.time())
+        )
+    
+    if group_columns:
+        stmt = stmt.group_by(*group_columns).order_by(*group_columns)
+    
+    rows = session.exec(stmt).all()
+    
+    return {
+        "module_code": module_code,
+        "field": field,
+        "group_by": list(dict.fromkeys(group_by)),
+        "groups": [
+            {
+                **row._mapping,
+                "avg": round(float(row.avg), 2) if row.avg is not None else None,
+            }
+            for row in rows
+        ]
+    }
+
+
+@router.get("/stats/compression", dependencies=[Depends(get_current_active_superuser)])
+def get_compression_stats():
+    """
+    Rapporto di compressione dei payload per modulo.
+    
+    **Note:**
+    - Conteggi delle scritture di questo processo dall'avvio
+    - `ratio` = byte salvati / byte JSON (più basso è meglio)
+    """
+    return {"modules": field_encryption.compression_stats()}
+
+
 # ============================================================================
 # BULK OPERATIONS (opzionale)
 # ============================================================================
@@ -750,8 +893,9 @@ class BulkCreateRequest(BaseModel):
 @router.post("/entries/bulk", response_model=list[EntryResponse])
 def bulk_create_entries(
     bulk_data: BulkCreateRequest,
-    current_user: CurrentUser,
-    session: SessionDep
+    current_user: CurrentPrincipal,
+    session: SessionDep,
+    access: AccessDep
 ):
     """
     Crea multiple entries in una singola transazione.
@@ -769,11 +913,15 @@ def bulk_create_entries(
         raise HTTPException(400, "Max 100 entries per bulk request")
     
     created_entries = []
+    payloads = []
+    
+    # Una query per tutti i dossier distinti, poi controlli in memoria
+    access.prefetch_dossiers({entry_data.dossier_id for entry_data in bulk_data.entries})
     
     for entry_data in bulk_data.entries:
-        # Riusa logica del CREATE singolo
-        check_dossier_access(session, current_user, entry_data.dossier_id)
-        check_module_access(session, current_user, entry_data.module_code, "CREATE")
+        # Stessi controlli del CREATE singolo
+        access.dossier(entry_data.dossier_id)
+        access.module(entry_data.module_code, "CREATE")
         
         version = entry_data.schema_version or REGISTRY.get(entry_data.module_code)
         if version is None:
@@ -789,17 +937,20 @@ def bulk_create_entries(
             session.rollback()
             raise HTTPException(422, f"Validation failed for entry: {str(e)}")
         
+        validated_dict = validated_data.model_dump()
+        
         entry = ModuleEntry(
             dossier_id=entry_data.dossier_id,
             module_code=entry_data.module_code,
             schema_version=version,
             occurred_at=entry_data.occurred_at or datetime.now(timezone.utc),
-            data=validated_data.model_dump(),
             created_by_user_id=current_user.id
         )
+        entry.set_data(validated_dict, session=session)
         
         session.add(entry)
         created_entries.append(entry)
+        payloads.append(validated_dict)
     
     # Commit unico per tutte le entries
     session.commit()
@@ -808,4 +959,8 @@ def bulk_create_entries(
     for entry in created_entries:
         session.refresh(entry)
     
-    return created_entries
\ No newline at end of file
+    # I dati in chiaro sono già in memoria: nessun decrypt per costruire la risposta
+    return [
+        EntryResponse.from_entry(entry, payload)
+        for entry, payload in zip(created_entries, payloads)
+    ]
\ No newline at end of file
@@ -1,7 +1,7 @@
 # app/routers/patients.py
 from fastapi import APIRouter, Depends, HTTPException, Query, status
-from sqlmodel import Session, select, func, or_
-from app.api.deps import SessionDep, CurrentUser, RequestInfo
+from sqlmodel import Session, select, func
+from app.api.deps import SessionDep, CurrentPrincipal, RequestInfo
 from app.models import Patient, Dossier, User
 from app.models import (
     PatientCreate,
@@ -11,6 +11,10 @@ from app.models import (
 )
 # from app.services.rbac import check_patient_access
 from app.services.audit import log_read_access
+from app.services.blind_index import PATIENT_HEALTH_CARD_FIELD, blind_index
+from app.services.pagination import CountStrategy, paginate
+from app.services.search import patient_search
+from app.services.lifecycle import soft_delete_patient_dossiers
 from datetime import datetime, timezone, date
 from uuid import UUID
 from typing import Optional
@@ -26,7 +30,7 @@ router = APIRouter(prefix="/patients", tags=["patients"])
 def create_patient(
     patient_data: PatientCreate,
     session: SessionDep,
-    current_user: CurrentUser
+    current_user: CurrentPrincipal
 ):
     """
     Crea un nuovo paziente.
@@ -59,11 +63,12 @@ def create_patient(
     if age < 0 or age > 120:
         raise HTTPException(400, "Invalid date of birth")
     
-    # Crea paziente
+    # Crea paziente (la tessera sanitaria passa dal setter che cifra e indicizza)
     patient = Patient(
-        **patient_data.model_dump(),
+        **patient_data.model_dump(exclude={"health_card_number"}),
         created_by_user_id=current_user.id
     )
+    patient.set_health_card_number(patient_data.health_card_number, session=session)
     
     session.add(patient)
     session.commit()
@@ -80,7 +85,7 @@ def create_patient(
 def get_patient(
     patient_id: UUID,
     session: SessionDep,
-    current_user: CurrentUser,
+    current_user: CurrentPrincipal,
     request_info: RequestInfo
 ):
     """
@@ -115,22 +120,34 @@ def get_patient(
 @router.get("", response_model=PatientListResponse)
 def list_patients(
     session: SessionDep,
-    current_user: CurrentUser,
+    current_user: CurrentPrincipal,
     q: Optional[str] = Query(None, description="Cerca nome/cognome/CF"),
     has_active_dossier: Optional[bool] = Query(None, description="Solo con dossier attivo"),
+    health_card_number: Optional[str] = Query(None, description="Tessera sanitaria (corrispondenza esatta)"),
     page: int = Query(1, ge=1),
-    page_size: int = Query(50, ge=1, le=100)
+    page_size: int = Query(50, ge=1, le=100),
+    cursor: Optional[str] = Query(None, description="Cursore opaco (next_cursor); vuoto per la prima pagina in modalità cursore"),
+    with_total: Optional[bool] = Query(None, description="Calcola il totale (default: sì a pagine, no con cursore)"),
+    count: Optional[CountStrategy] = Query(None, description="Totale: exact, cached (TTL breve), estimate (planner) o none")
 ):
     """
     Lista pazienti accessibili all'utente.
     
     **Filtri:**
-    - Ricerca testuale (nome, cognome, CF)
+    - Ricerca testuale (nome, cognome, CF): ogni parola deve comparire nel nome
+      o nel cognome; a pagine i risultati sono ordinati per rilevanza
     - Solo con dossier attivo
+    - Tessera sanitaria esatta (tramite indice cieco, senza decrittare)
     
     **RBAC:**
     - Non-superuser: solo pazienti con dossier nella propria struttura
     - Superuser: tutti i pazienti
+    
+    **Paginazione:**
+    - A pagine: `page` / `page_size` (OFFSET, compatibile con i client esistenti)
+    - Cursore: `cursor` = `next_cursor` della risposta precedente (keyset, costo costante)
+    - `with_total`: il totale è opzionale in modalità cursore
+    - `count`: strategia del totale (exact / cached / estimate / none)
     """
     
     # Base query
@@ -149,15 +166,18 @@ def list_patients(
         
         stmt = stmt.where(Patient.id.in_(dossier_subq))
     
-    # Ricerca testuale
-    if q:
-        search_term = f"%{q.lower()}%"
+    # Ricerca testuale (indici trigrammi; CF esatto o prefisso sull'indice del codice)
+    search = patient_search(q, session.get_bind().dialect.name)
+    if search is not None:
+        stmt = stmt.where(search.condition)
+        # Rank solo a pagine: il cursore codifica le sole colonne di ordinamento
+        if search.rank is not None and cursor is None:
+            stmt = stmt.order_by(search.rank.desc())
+    
+    # Tessera sanitaria: confronto sul token HMAC
+    if health_card_number:
         stmt = stmt.where(
-            or_(
-                func.lower(Patient.first_name).like(search_term),
-                func.lower(Patient.last_name).like(search_term),
-                func.lower(Patient.fiscal_code).like(search_term)
-            )
+            Patient.health_card_number_bidx == blind_index(PATIENT_HEALTH_CARD_FIELD, health_card_number)
         )
     
     # Filtro dossier attivo
@@ -175,22 +195,20 @@ def list_patients(
             ).distinct()
             stmt = stmt.where(Patient.id.not_in(active_dossier_subq))
     
-    # Count
-    count_stmt = select(func.count()).select_from(stmt.subquery())
-    total = session.exec(count_stmt).one()
-    
-    # Paginazione
-    stmt = stmt.order_by(Patient.last_name, Patient.first_name)
-    stmt = stmt.offset((page - 1) * page_size).limit(page_size)
-    
-    patients = session.exec(stmt).all()
+    # Paginazione (last_name, first_name, id)
+    result = paginate(
+        session, stmt, [Patient.last_name, Patient.first_name, Patient.id],
+        direction="asc", page=page, page_size=page_size, cursor=cursor, with_total=with_total, count=count
+    )
     
     return PatientListResponse(
-        items=patients,
-        total=total,
-        page=page,
+        items=result.items,
+        total=result.total,
+        page=None if cursor is not None else page,
         page_size=page_size,
-        has_next=(page * page_size) < total
+        has_next=result.has_next,
+        next_cursor=result.next_cursor,
+        total_estimated=result.total_estimated
     )
 
 
@@ -203,7 +221,7 @@ def update_patient(
     patient_id: UUID,
     patient_data: PatientUpdate,
     session: SessionDep,
-    current_user: CurrentUser
+    current_user: CurrentPrincipal
 ):
     """
     Aggiorna dati paziente.
@@ -223,6 +241,8 @@ def update_patient(
     
     # Applica modifiche
     update_data = patient_data.model_dump(exclude_unset=True)
+    if "health_card_number" in update_data:
+        patient.set_health_card_number(update_data.pop("health_card_number"), session=session)
     for field, value in update_data.items():
         setattr(patient, field, value)
     
@@ -244,7 +264,7 @@ def update_patient(
 def delete_patient(
     patient_id: UUID,
     session: SessionDep,
-    current_user: CurrentUser,
+    current_user: CurrentPrincipal,
     delete_dossiers: bool = Query(False, description="Elimina anche i dossier associati")
 ):
     """
@@ -267,37 +287,28 @@ def delete_patient(
     
     # ✅ Verifica dossier attivi
     active_dossiers = session.exec(
-        select(Dossier).where(
+        select(func.count()).select_from(Dossier).where(
             Dossier.patient_id == patient_id,
             Dossier.status == "active",
             Dossier.deleted_at.is_(None)
         )
-    ).all()
+    ).one()
     
     if active_dossiers and not current_user.is_superuser:
         raise HTTPException(
             403,
-            f"Cannot delete patient with {len(active_dossiers)} active dossier(s). Requires superuser."
+            f"Cannot delete patient with {active_dossiers} active dossier(s). Requires superuser."
         )
     
     # Soft delete paziente
-    patient.deleted_at = datetime.now(timezone.utc)
+    now = datetime.now(timezone.utc)
+    patient.deleted_at = now
     patient.deleted_by_user_id = current_user.id
     session.add(patient)
     
-    # Elimina dossier se richiesto
+    # Elimina dossier se richiesto (una UPDATE, audit in blocco)
     if delete_dossiers:
-        all_dossiers = session.exec(
-            select(Dossier).where(
-                Dossier.patient_id == patient_id,
-                Dossier.deleted_at.is_(None)
-            )
-        ).all()
-        
-        for dossier in all_dossiers:
-            dossier.deleted_at = datetime.now(timezone.utc)
-            dossier.deleted_by_user_id = current_user.id
-            session.add(dossier)
+        soft_delete_patient_dossiers(session, patient_id, current_user.id, now)
     
     session.commit()
     return None
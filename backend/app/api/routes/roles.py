@@ -4,10 +4,11 @@ from typing import Any
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlmodel import select
 from sqlalchemy.exc import IntegrityError
-from app.api.deps import SessionDep, get_current_active_superuser, get_current_user
+from app.api.deps import SessionDep, get_current_active_superuser, get_current_principal
 from app.models import Role, RoleCreate, RoleUpdate, RolePublic, RolesPublic
+from app.services.principal import invalidate_principals
 
-router = APIRouter(prefix="/roles", tags=["roles"], dependencies=[Depends(get_current_user)])
+router = APIRouter(prefix="/roles", tags=["roles"], dependencies=[Depends(get_current_principal)])
 
 
 # ---- CRUD ----
@@ -29,7 +30,7 @@ def read_role(role_id: uuid.UUID, session: SessionDep) -> Any:
 def create_role(
     role_in: RoleCreate, 
     session: SessionDep, 
-    current_user=Depends(get_current_user)
+    current_user=Depends(get_current_principal)
 ) -> Any:
     # Opzione 1: Controllo preventivo (consigliato)
     existing = session.exec(
@@ -74,6 +75,7 @@ def update_role(role_id: uuid.UUID, role_in: RoleUpdate, session: SessionDep) ->
         role.modules = role_in.modules
 
     session.add(role)
+    invalidate_principals(session, role_id=role_id)
     session.commit()
     session.refresh(role)
     return role
@@ -85,6 +87,7 @@ def delete_role(role_id: uuid.UUID, session: SessionDep) -> Any:
     if not role:
         raise HTTPException(status_code=404, detail="Role not found")
     session.delete(role)
+    invalidate_principals(session, role_id=role_id)
     session.commit()
     return {"message": "Role deleted successfully"}
 
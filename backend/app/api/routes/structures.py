@@ -2,7 +2,7 @@ import uuid
 from typing import Any
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlmodel import select
-from app.api.deps import SessionDep, get_current_active_superuser, get_current_user
+from app.api.deps import SessionDep, get_current_active_superuser, get_current_principal
 from app.models import (
     Structure,
     StructureBase,
@@ -11,7 +11,7 @@ from app.models import (
     StructuresPublic,
 )
 
-router = APIRouter(prefix="/structures", tags=["structures"], dependencies=[Depends(get_current_user)])
+router = APIRouter(prefix="/structures", tags=["structures"], dependencies=[Depends(get_current_principal)])
 
 
 @router.get("/", response_model=StructuresPublic)
@@ -12,6 +12,7 @@ from app.api.deps import (
 from app.core.security import get_password_hash, verify_password
 from app.models import ( User, UserCreate, UserUpdate, UserPublic, Role )
 from app.models import Message, UserUpdateMe, UpdatePassword, UsersPublic, UserRegister, AssignRoleIn
+from app.services.principal import invalidate_principals
 
 router = APIRouter(prefix="/users", tags=["users"])
 
@@ -80,6 +81,7 @@ def update_user_me(
 
     current_user.sqlmodel_update(user_in.model_dump(exclude_unset=True))
     session.add(current_user)
+    invalidate_principals(session, user_id=current_user.id)
     session.commit()
     session.refresh(current_user)
     return current_user
@@ -105,6 +107,7 @@ def delete_user_me(session: SessionDep, current_user: CurrentUser) -> Any:
     if current_user.is_superuser:
         raise HTTPException(status_code=403, detail="Super users are not allowed to delete themselves")
     session.delete(current_user)
+    invalidate_principals(session, user_id=current_user.id)
     session.commit()
     return Message(message="User deleted successfully")
 
@@ -138,6 +141,7 @@ def update_user(
 
     db_user.sqlmodel_update(update_data)
     session.add(db_user)
+    invalidate_principals(session, user_id=user_id)
     session.commit()
     session.refresh(db_user)
     return db_user
@@ -152,6 +156,7 @@ def delete_user(session: SessionDep, current_user: CurrentUser, user_id: uuid.UU
         raise HTTPException(status_code=403, detail="Super users are not allowed to delete themselves")
 
     session.delete(user)
+    invalidate_principals(session, user_id=user_id)
     session.commit()
     return Message(message="User deleted successfully")
 
@@ -170,6 +175,7 @@ def assign_role(
 
     user.role_id = role.id
     session.add(user)
+    invalidate_principals(session, user_id=user_id)
     session.commit()
     session.refresh(user)
     return user
\ No newline at end of file
@@ -0,0 +1,41 @@
+import argparse
+import logging
+
+from app.core.db import engine
+from app.services.audit_partitions import (
+    AUDIT_ARCHIVE_DIR,
+    AUDIT_RETENTION_MONTHS,
+    archive_partitions,
+    ensure_partitions,
+)
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Archivia le partizioni mensili di audit_log oltre il periodo di conservazione"
+    )
+    parser.add_argument("--keep-months", type=int, default=AUDIT_RETENTION_MONTHS,
+                        help="Mesi da mantenere online (oltre al mese corrente)")
+    parser.add_argument("--export-dir", default=AUDIT_ARCHIVE_DIR, help="Cartella dei file CSV gzip")
+    parser.add_argument("--keep-detached", action="store_true",
+                        help="Non eliminare le tabelle staccate dopo l'esportazione")
+    parser.add_argument("--ensure-only", action="store_true",
+                        help="Crea solo le partizioni dei prossimi mesi")
+    args = parser.parse_args()
+
+    created = ensure_partitions(engine)
+    logger.info(f"Partitions created: {created}")
+    if args.ensure_only:
+        return
+
+    report = archive_partitions(
+        engine, keep_months=args.keep_months, export_dir=args.export_dir, drop=not args.keep_detached
+    )
+    logger.info(f"Archive finished: {report}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+import argparse
+import logging
+
+from sqlmodel import Session
+
+from app.core.db import engine
+from app.services.key_store import configure_data_keys
+from app.services.projection import backfill_projections
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Popola module_entry_projection per le entry esistenti")
+    parser.add_argument("--module", help="Codice modulo (default: tutti quelli con projection_fields)")
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+
+    # I payload envelope servono le data key per essere letti
+    configure_data_keys(engine)
+
+    logger.info("Backfilling entry projections")
+    with Session(engine) as session:
+        processed = backfill_projections(session, module_code=args.module, batch_size=args.batch_size)
+    logger.info(f"Backfill finished: {processed} entries")
+
+
+if __name__ == "__main__":
+    main()
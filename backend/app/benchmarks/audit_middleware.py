@@ -0,0 +1,114 @@
+"""
+Benchmark del middleware di audit: BaseHTTPMiddleware con doppia
+decodifica del JWT (implementazione precedente) contro il middleware ASGI
+puro con claims condivisi nello scope.
+
+    python -m app.benchmarks.audit_middleware --requests 5000 --concurrency 50
+"""
+from datetime import timedelta
+from statistics import median, quantiles
+from time import perf_counter
+import argparse
+import asyncio
+
+import httpx
+from jose import JWTError
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+from app.core import security
+from app.middleware.audit_middleware import AuditMiddleware, scope_claims
+from app.services.audit import set_audit_context
+
+
+class LegacyAuditMiddleware(BaseHTTPMiddleware):
+    """Comportamento precedente: decodifica nel middleware, contesto via call_next"""
+
+    async def dispatch(self, request: Request, call_next):
+        auth_header = request.headers.get("Authorization")
+        if auth_header and auth_header.startswith("Bearer "):
+            try:
+                payload = security.decode_access_token(auth_header.split(" ")[1])
+                set_audit_context(
+                    user_id=payload.get("sub"),
+                    username=payload.get("sub"),
+                    ip=request.client.host if request.client else None,
+                    endpoint=f"{request.method} {request.url.path}",
+                )
+            except JWTError:
+                pass
+        return await call_next(request)
+
+
+def _token(request: Request) -> str:
+    return request.headers["authorization"].partition(" ")[2]
+
+
+async def legacy_endpoint(request: Request) -> JSONResponse:
+    # get_current_user precedente: seconda decodifica dello stesso token
+    return JSONResponse({"sub": security.decode_access_token(_token(request))["sub"]})
+
+
+async def shared_endpoint(request: Request) -> JSONResponse:
+    token = _token(request)
+    found, claims = scope_claims(request.scope, token)
+    if not found:
+        claims = security.decode_access_token(token)
+    return JSONResponse({"sub": claims["sub"]})
+
+
+def build_apps() -> dict[str, Starlette]:
+    return {
+        "base_http_double_decode": Starlette(
+            routes=[Route("/me", legacy_endpoint)], middleware=[Middleware(LegacyAuditMiddleware)]
+        ),
+        "asgi_shared_claims": Starlette(
+            routes=[Route("/me", shared_endpoint)], middleware=[Middleware(AuditMiddleware)]
+        ),
+    }
+
+
+async def run(app: Starlette, requests: int, concurrency: int, token: str) -> dict:
+    latencies: list[float] = []
+    semaphore = asyncio.Semaphore(concurrency)
+    headers = {"Authorization": f"Bearer {token}"}
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        async def one() -> None:
+            async with semaphore:
+                start = perf_counter()
+                response = await client.get("/me", headers=headers)
+                latencies.append(perf_counter() - start)
+                response.raise_for_status()
+
+        await asyncio.gather(*(one() for _ in range(min(200, requests))))  # warm-up
+        latencies.clear()
+        start = perf_counter()
+        await asyncio.gather(*(one() for _ in range(requests)))
+        elapsed = perf_counter() - start
+
+    return {
+        "req_s": round(requests / elapsed),
+        "p50_us": round(median(latencies) * 1e6),
+        "p95_us": round(quantiles(latencies, n=20)[-1] * 1e6),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark middleware di audit")
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+
+    token = security.create_access_token("4f1c2a4e-0000-4000-8000-000000000001", timedelta(minutes=30))
+    for name, app in build_apps().items():
+        result = asyncio.run(run(app, args.requests, args.concurrency, token))
+        print(f"{name:<26} {result}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Benchmark dei login concorrenti: bcrypt inline nei thread delle richieste
+(implementazione precedente) contro il pool bcrypt con coda limitata.
+
+Durante il picco di login una sonda interroga una rotta leggera: la sua
+latenza misura quanto il picco affama il threadpool AnyIO.
+
+    python -m app.benchmarks.login_throughput --logins 400 --concurrency 100 --rounds 12
+"""
+from statistics import median, quantiles
+from time import perf_counter
+import argparse
+import asyncio
+
+import httpx
+from fastapi import FastAPI
+
+from app.services.password_hasher import BCRYPT_MAX_PENDING, BCRYPT_WORKERS, PasswordHasher
+
+
+def build_app(hasher: PasswordHasher, hashed: str) -> FastAPI:
+    app = FastAPI()
+
+    # Rotte sync come login_access_token: girano nel threadpool AnyIO
+    @app.post("/login")
+    def login() -> dict:
+        return {"ok": hasher.verify("cambio-turno", hashed)}
+
+    @app.get("/health")
+    def health() -> dict:
+        return {"ok": True}
+
+    return app
+
+
+async def run(app: FastAPI, logins: int, concurrency: int) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    rejected = 0
+    probe_latencies: list[float] = []
+    done = asyncio.Event()
+
+    async with httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=None
+    ) as client:
+        async def one() -> None:
+            nonlocal rejected
+            async with semaphore:
+                response = await client.post("/login")
+                if response.status_code == 503:
+                    rejected += 1
+                else:
+                    response.raise_for_status()
+
+        async def probe() -> None:
+            while not done.is_set():
+                start = perf_counter()
+                (await client.get("/health")).raise_for_status()
+                probe_latencies.append(perf_counter() - start)
+                await asyncio.sleep(0.02)
+
+        probe_task = asyncio.create_task(probe())
+        start = perf_counter()
+        await asyncio.gather(*(one() for _ in range(logins)))
+        elapsed = perf_counter() - start
+        done.set()
+        await probe_task
+
+    return {
+        "logins_s": round((logins - rejected) / elapsed, 1),
+        "rejected_503": rejected,
+        "health_p50_ms": round(median(probe_latencies) * 1000, 1),
+        "health_p95_ms": round(quantiles(probe_latencies, n=20)[-1] * 1000, 1) if len(probe_latencies) > 1 else None,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark throughput dei login (bcrypt)")
+    parser.add_argument("--logins", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--rounds", type=int, default=12)
+    parser.add_argument("--workers", type=int, default=BCRYPT_WORKERS)
+    parser.add_argument("--max-pending", type=int, default=BCRYPT_MAX_PENDING)
+    args = parser.parse_args()
+
+    hashed = PasswordHasher("none", rounds=args.rounds).hash("cambio-turno")
+    hashers = {
+        "inline": PasswordHasher("none", rounds=args.rounds),
+        "process_pool": PasswordHasher("process", workers=args.workers, max_pending=args.max_pending, rounds=args.rounds),
+    }
+    for name, hasher in hashers.items():
+        hasher.warm_up()
+        result = asyncio.run(run(build_app(hasher, hashed), args.logins, args.concurrency))
+        hasher.shutdown()
+        print(f"{name:<14} {result}")
+
+
+if __name__ == "__main__":
+    main()
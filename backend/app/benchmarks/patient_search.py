@@ -0,0 +1,193 @@
+"""
+Benchmark della ricerca pazienti su dati sintetici (PostgreSQL con pg_trgm).
+
+Carica N pazienti in uno schema temporaneo e confronta, per alcune query
+tipiche della casella di ricerca, il filtro precedente (lower(col) LIKE
+'%q%' in OR, senza indici trigrammi) con patient_search sugli indici GIN
+e sul percorso rapido del codice fiscale. Lo schema (in una sola
+transazione) viene annullato alla fine.
+
+    python -m app.benchmarks.patient_search --patients 100000 --repeat 20
+"""
+from datetime import date, datetime, timedelta, timezone
+from statistics import median
+from time import perf_counter
+import argparse
+import json
+import random
+import string
+import uuid
+
+from sqlalchemy import Column, Connection, MetaData, Table, func, or_, select
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+from app.core.db import engine
+from app.models import Patient
+from app.services.search import patient_search
+
+SCHEMA = "bench_patient_search"
+
+FIRST_NAMES = [
+    "Mario", "Giulia", "Luca", "Francesca", "Marco", "Chiara", "Giuseppe", "Anna", "Paolo", "Sara",
+    "Andrea", "Elena", "Roberto", "Laura", "Stefano", "Martina", "Alessandro", "Valentina", "Davide", "Silvia",
+]
+LAST_NAMES = [
+    "Rossi", "Russo", "Ferrari", "Esposito", "Bianchi", "Romano", "Colombo", "Ricci", "Marino", "Greco",
+    "Bruno", "Gallo", "Conti", "De Luca", "Mancini", "Costa", "Giordano", "Rizzo", "Lombardi", "Moretti",
+    "Barbieri", "Fontana", "Santoro", "Mariani", "Rinaldi", "Caruso", "Ferrara", "Galli", "Martini", "Leone",
+]
+SEARCH_INDEXES = (
+    "idx_patient_first_name_trgm", "idx_patient_last_name_trgm",
+    "idx_patient_fiscal_code_trgm", "idx_patient_fiscal_code_prefix",
+)
+
+
+def bench_table() -> Table:
+    """Tabella patient con le sole colonne (gli indici si creano a parte)"""
+    return Table("patient", MetaData(), *(
+        Column(column.name, column.type, primary_key=column.primary_key, nullable=column.nullable)
+        for column in Patient.__table__.c
+    ))
+
+
+def _fiscal_code(rng: random.Random, n: int) -> str:
+    # Forma valida, univoco grazie al progressivo nelle ultime posizioni
+    letters = "".join(rng.choices(string.ascii_uppercase, k=6))
+    return f"{letters}{rng.randint(40, 99)}{rng.choice('ABCDEHLMPRST')}{rng.randint(10, 70)}X{n % 1000:03d}{string.ascii_uppercase[n // 1000 % 26]}"
+
+
+def load(conn: Connection, patients: int, batch_size: int = 5000) -> list[str]:
+    """Pazienti sintetici; ritorna alcuni codici fiscali da cercare"""
+    rng = random.Random(42)
+    created_at = datetime.now(timezone.utc)
+    codes: list[str] = []
+    seen: set[str] = set()
+    rows = []
+    for n in range(patients):
+        code = _fiscal_code(rng, n)
+        while code in seen:
+            code = _fiscal_code(rng, n)
+        seen.add(code)
+        if n % (patients // 10 or 1) == 0:
+            codes.append(code)
+        rows.append({
+            "id": uuid.UUID(int=rng.getrandbits(128)),
+            "first_name": rng.choice(FIRST_NAMES),
+            "last_name": f"{rng.choice(LAST_NAMES)}{rng.choice(['', '', 'i', 'ni', 'tti'])}",
+            "fiscal_code": code,
+            "date_of_birth": date(1930, 1, 1) + timedelta(days=rng.randint(0, 30000)),
+            "place_of_birth": "Pesaro",
+            "gender": rng.choice("MF"),
+            "created_at": created_at,
+        })
+        if len(rows) == batch_size:
+            conn.execute(Patient.__table__.insert(), rows)
+            rows = []
+    if rows:
+        conn.execute(Patient.__table__.insert(), rows)
+    return codes
+
+
+def legacy_condition(q: str):
+    search_term = f"%{q.lower()}%"
+    return or_(
+        func.lower(Patient.first_name).like(search_term),
+        func.lower(Patient.last_name).like(search_term),
+        func.lower(Patient.fiscal_code).like(search_term),
+    )
+
+
+def new_statement(q: str):
+    search = patient_search(q, "postgresql")
+    stmt = select(Patient.id).where(search.condition)
+    if search.rank is not None:
+        stmt = stmt.order_by(search.rank.desc())
+    return stmt.order_by(Patient.last_name, Patient.first_name, Patient.id).limit(50)
+
+
+def legacy_statement(q: str):
+    return select(Patient.id).where(legacy_condition(q)).order_by(
+        Patient.last_name, Patient.first_name, Patient.id
+    ).limit(50)
+
+
+def plan_node(conn: Connection, stmt) -> str:
+    """Primo nodo di accesso alla tabella nel piano"""
+    compiled = stmt.compile(dialect=conn.dialect, compile_kwargs={"render_postcompile": True})
+    plan = conn.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {compiled}", compiled.params).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    nodes = [plan[0]["Plan"]]
+    while nodes:
+        node = nodes.pop(0)
+        if node.get("Relation Name") == "patient":
+            return node["Node Type"]
+        nodes.extend(node.get("Plans", []))
+    return "?"
+
+
+def measure(conn: Connection, stmt, repeat: int) -> dict:
+    timings = []
+    for _ in range(repeat):
+        start = perf_counter()
+        conn.execute(stmt).all()
+        timings.append(perf_counter() - start)
+    return {"p50_ms": round(median(timings) * 1000, 2), "plan": plan_node(conn, stmt)}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark della ricerca pazienti (pg_trgm)")
+    parser.add_argument("--patients", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    if engine.dialect.name != "postgresql":
+        raise SystemExit("Il benchmark richiede PostgreSQL")
+
+    with engine.connect() as conn:
+        # Tutto in una transazione: il rollback finale elimina schema e dati
+        conn.exec_driver_sql("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        conn.exec_driver_sql(f"CREATE SCHEMA {SCHEMA}")
+        conn.exec_driver_sql(f"SET search_path TO {SCHEMA}, public")
+        try:
+            # Copia di patient senza chiavi esterne, con gli indici B-tree del modello
+            conn.execute(CreateTable(bench_table()))
+            for index in Patient.__table__.indexes:
+                if index.name not in SEARCH_INDEXES:
+                    conn.execute(CreateIndex(index))
+            codes = load(conn, args.patients)
+            conn.exec_driver_sql("ANALYZE patient")
+
+            queries = {
+                "prefisso corto": "ro",
+                "cognome": "rossi",
+                "sottostringa": "rizz",
+                "nome e cognome": "mario bianchi",
+                "CF esatto": codes[len(codes) // 2],
+                "CF prefisso": codes[1][:9],
+            }
+
+            results = {}
+            for label, q in queries.items():
+                results[label] = {"legacy": measure(conn, legacy_statement(q), args.repeat)}
+
+            for index in Patient.__table__.indexes:
+                if index.name in SEARCH_INDEXES:
+                    conn.execute(CreateIndex(index))
+            conn.exec_driver_sql("ANALYZE patient")
+            for label, q in queries.items():
+                results[label]["search"] = measure(conn, new_statement(q), args.repeat)
+        finally:
+            conn.rollback()
+
+    print(f"{args.patients} pazienti, mediana su {args.repeat} esecuzioni")
+    for label, result in results.items():
+        legacy, search = result["legacy"], result["search"]
+        print(
+            f"{label:>16}: legacy {legacy['p50_ms']:>8} ms ({legacy['plan']})"
+            f"  search {search['p50_ms']:>8} ms ({search['plan']})"
+        )
+
+
+if __name__ == "__main__":
+    main()
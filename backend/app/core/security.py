@@ -30,31 +30,52 @@
 from datetime import datetime, timedelta, timezone
 from typing import Any
 
-import bcrypt
 from jose import jwt
 
 from app.core.config import settings
+from app.services.password_hasher import password_hasher
 
 ALGORITHM = "HS256"
 
 
-def create_access_token(subject: str | Any, expires_delta: timedelta) -> str:
+def create_access_token(
+    subject: str | Any, expires_delta: timedelta, claims: dict[str, Any] | None = None
+) -> str:
+    """
+    Token firmato per `subject`; `claims` aggiunge claim privati (es. i
+    permessi del ruolo, vedi app.services.principal.principal_claims)
+    """
     expire = datetime.now(timezone.utc) + expires_delta
-    to_encode = {"exp": expire, "sub": str(subject)}
+    to_encode = {**(claims or {}), "exp": expire, "sub": str(subject)}
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
 
+def decode_access_token(token: str) -> dict[str, Any]:
+    """Claims del token firmato (JWTError se non valido o scaduto)"""
+    return jwt.decode(token, settings.SECRET_KEY, algorithms=[ALGORITHM])
+
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Verifica una password in chiaro contro l'hash bcrypt"""
-    return bcrypt.checkpw(
-        plain_password.encode('utf-8'),
-        hashed_password.encode('utf-8')
-    )
+    """Verifica una password in chiaro contro l'hash bcrypt (nel pool bcrypt, 503 se saturo)"""
+    return password_hasher.verify(plain_password, hashed_password)
 
 
 def get_password_hash(password: str) -> str:
-    """Genera hash bcrypt di una password"""
-    salt = bcrypt.gensalt()
-    hashed = bcrypt.hashpw(password.encode('utf-8'), salt)
-    return hashed.decode('utf-8')
\ No newline at end of file
+    """Genera hash bcrypt di una password (costo BCRYPT_ROUNDS, nel pool bcrypt)"""
+    return password_hasher.hash(password)
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """Come verify_password, senza occupare un thread durante l'attesa del pool"""
+    return await password_hasher.averify(plain_password, hashed_password)
+
+
+async def get_password_hash_async(password: str) -> str:
+    """Come get_password_hash, senza occupare un thread durante l'attesa del pool"""
+    return await password_hasher.ahash(password)
+
+
+def password_needs_rehash(hashed_password: str) -> bool:
+    """True se l'hash non usa il costo bcrypt configurato"""
+    return password_hasher.needs_rehash(hashed_password)
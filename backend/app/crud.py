@@ -3,9 +3,16 @@
 import uuid
 from typing import Any
 
+from fastapi.concurrency import run_in_threadpool
 from sqlmodel import Session, select
 
-from app.core.security import get_password_hash, verify_password
+from app.core.security import (
+    get_password_hash,
+    get_password_hash_async,
+    password_needs_rehash,
+    verify_password,
+    verify_password_async,
+)
 from app.models import User, UserCreate, UserUpdate # Item, ItemCreate 
 
 
@@ -45,6 +52,35 @@ def authenticate(*, session: Session, email: str, password: str) -> User | None:
         return None
     if not verify_password(password, db_user.hashed_password):
         return None
+    if password_needs_rehash(db_user.hashed_password):
+        # Costo bcrypt cambiato: l'hash si aggiorna al primo login riuscito
+        db_user.hashed_password = get_password_hash(password)
+        session.add(db_user)
+        session.commit()
+        session.refresh(db_user)
+    return db_user
+
+
+def _store_password_hash(session: Session, db_user: User, hashed_password: str) -> None:
+    db_user.hashed_password = hashed_password
+    session.add(db_user)
+    session.commit()
+    session.refresh(db_user)
+
+
+async def authenticate_async(*, session: Session, email: str, password: str) -> User | None:
+    """
+    Come authenticate, per le rotte async: bcrypt si attende dall'event loop,
+    le query girano nel threadpool
+    """
+    db_user = await run_in_threadpool(get_user_by_email, session=session, email=email)
+    if not db_user:
+        return None
+    if not await verify_password_async(password, db_user.hashed_password):
+        return None
+    if password_needs_rehash(db_user.hashed_password):
+        hashed_password = await get_password_hash_async(password)
+        await run_in_threadpool(_store_password_hash, session, db_user, hashed_password)
     return db_user
 
 
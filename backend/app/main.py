@@ -1,3 +1,8 @@
+from contextlib import asynccontextmanager
+from time import perf_counter
+import logging
+import os
+
 import sentry_sdk
 from fastapi import FastAPI
 from fastapi.routing import APIRoute
@@ -8,9 +13,18 @@ from app.api.main import api_router
 from app.core.config import settings
 
 from app.services.audit import setup_audit_listeners
+from app.services.audit_writer import audit_writer
+from app.services.audit_partitions import AUDIT_PARTITION_CHECK_INTERVAL, ensure_partitions
+from app.services.principal import PRINCIPAL_CACHE_NOTIFY, PrincipalInvalidationListener
+from app.services.password_hasher import password_hasher
 
 from app.middleware.audit_middleware import AuditMiddleware
 
+from app.core.db import engine
+from app.services.encryption import field_encryption, get_key_material, key_material_loaded
+from app.services.payload_compression import PayloadDictionaryStore
+from app.services.key_store import configure_data_keys
+
 import app.models as models  # noqa: F401
 
 #? per DEMO
@@ -21,13 +35,42 @@ def custom_generate_unique_id(route: APIRoute) -> str:
     return f"{route.tags[0]}-{route.name}"
 
 
+logger = logging.getLogger(__name__)
+
 if settings.SENTRY_DSN and settings.ENVIRONMENT != "local":
     sentry_sdk.init(dsn=str(settings.SENTRY_DSN), enable_tracing=True)
 
+# Con gunicorn --preload il master importa l'app prima del fork: caricando qui
+# la chiave, i worker la ereditano già pronta
+if os.getenv("ENCRYPTION_PRELOAD_KEY", "").lower() in ("1", "true"):
+    get_key_material()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    inherited = key_material_loaded()
+    start = perf_counter()
+    timings = field_encryption.warm_up()
+    timings["total_ms"] = round((perf_counter() - start) * 1000, 1)
+    logger.info(f"Startup warm-up (pid {os.getpid()}, key inherited={inherited}): {timings}")
+    # Processi bcrypt avviati prima dei thread in background
+    password_hasher.warm_up()
+    audit_writer.start()
+    if PRINCIPAL_CACHE_NOTIFY:
+        principal_listener.start()
+    yield
+    principal_listener.stop()
+    # Ultimo flush degli eventi di audit in coda prima di chiudere
+    audit_writer.stop()
+    field_encryption.shutdown()
+    password_hasher.shutdown()
+
+
 app = FastAPI(
     title=settings.PROJECT_NAME,
     openapi_url=f"{settings.API_V1_STR}/openapi.json",
     generate_unique_id_function=custom_generate_unique_id,
+    lifespan=lifespan,
 )
 
 if settings.ENVIRONMENT == "local":
@@ -45,6 +88,13 @@ if settings.all_cors_origins:
 
 app.add_middleware(AuditMiddleware)
 setup_audit_listeners([models.ModuleEntry, models.Dossier, models.Patient])
+audit_writer.set_engine(engine)
+# Partizioni mensili di audit_log dei prossimi mesi (prima esecuzione all'avvio del writer)
+audit_writer.add_maintenance(lambda: ensure_partitions(engine), AUDIT_PARTITION_CHECK_INTERVAL)
+# Invalidazioni della cache dei principal dagli altri worker (LISTEN/NOTIFY)
+principal_listener = PrincipalInvalidationListener(engine)
+field_encryption.set_dictionary_source(PayloadDictionaryStore(engine))
+configure_data_keys(engine)
 
 app.include_router(api_router, prefix=settings.API_V1_STR)
 
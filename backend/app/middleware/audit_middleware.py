@@ -1,42 +1,80 @@
 # app/middleware/audit_middleware.py
-from fastapi import Request
-from app.services.audit import set_audit_context
-from starlette.middleware.base import BaseHTTPMiddleware
-from app.core.config import settings
-from app.core import security
-from jose import jwt, JWTError
+"""
+Middleware ASGI puro per il contesto di audit.
+
+Decodifica il bearer token una sola volta per richiesta e salva token e
+claims nello scope (TOKEN_CLAIMS_SCOPE_KEY): get_current_user li riusa
+invece di decodificare di nuovo. A differenza di BaseHTTPMiddleware non
+crea task né stream intermedi, quindi le StreamingResponse passano intatte.
+"""
+from typing import Any
+
+from jose import JWTError
+from starlette.types import ASGIApp, Receive, Scope, Send
 import logging
 
+from app.core import security
+from app.services.audit import current_user_context
+
 logger = logging.getLogger(__name__)
 
-class AuditMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        # Estrai token dall'header Authorization
-        auth_header = request.headers.get("Authorization")
-        
-        if auth_header and auth_header.startswith("Bearer "):
-            token = auth_header.split(" ")[1]
-            try:
-                # Decodifica JWT per estrarre info utente
-                payload = jwt.decode(
-                    token, 
-                    settings.SECRET_KEY, 
-                    algorithms=[security.ALGORITHM]
-                )
-                user_id = payload.get("sub")
-                username = payload.get("username") or payload.get("email") or user_id
-                
-                # Setta contesto audit per questa request
-                set_audit_context(
-                    user_id=user_id,
-                    username=username,
-                    ip=request.client.host if request.client else None,
-                    endpoint=f"{request.method} {request.url.path}"
-                )
-            except JWTError as e:
-                logger.debug(f"JWT decode error in audit middleware: {e}")
-                # Non bloccare la request, continua senza contesto audit
-                pass
-        
-        response = await call_next(request)
-        return response
\ No newline at end of file
+# (token, claims): claims None se il token non è valido
+TOKEN_CLAIMS_SCOPE_KEY = "auth.token_claims"
+
+
+def bearer_token(scope: Scope) -> str | None:
+    for name, value in scope.get("headers", ()):
+        if name == b"authorization":
+            scheme, _, token = value.decode("latin-1").partition(" ")
+            if scheme.lower() == "bearer" and token:
+                return token
+            return None
+    return None
+
+
+def scope_claims(scope: Scope, token: str) -> tuple[bool, dict[str, Any] | None]:
+    """(trovato, claims) del token già decodificato dal middleware per questa richiesta"""
+    cached = scope.get(TOKEN_CLAIMS_SCOPE_KEY)
+    if cached is None or cached[0] != token:
+        return False, None
+    return True, cached[1]
+
+
+class AuditMiddleware:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        token = bearer_token(scope)
+        if token is None:
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            claims = security.decode_access_token(token)
+        except JWTError as e:
+            logger.debug(f"JWT decode error in audit middleware: {e}")
+            # Non bloccare la request: get_current_user risponderà 403
+            claims = None
+        scope[TOKEN_CLAIMS_SCOPE_KEY] = (token, claims)
+
+        if claims is None:
+            await self.app(scope, receive, send)
+            return
+
+        user_id = claims.get("sub")
+        client = scope.get("client")
+        context_token = current_user_context.set({
+            "user_id": user_id,
+            "username": claims.get("username") or claims.get("email") or user_id,
+            "ip_address": client[0] if client else None,
+            "endpoint": f"{scope['method']} {scope['path']}",
+        })
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current_user_context.reset(context_token)
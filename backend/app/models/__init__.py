@@ -1,6 +1,6 @@
 # 1) base comuni
 from .common import Message, Token, TokenPayload, NewPassword
-from .tables import Role, User, Structure, Dossier, Patient, ModuleEntry, ModuleCatalog, AuditLog
+from .tables import Role, User, Structure, Dossier, Patient, ModuleEntry, ModuleCatalog, AuditLog, AuditOutbox, PayloadDictionary, DataKey, BlindIndex, EntryProjection, DossierSummary
 from .role import RoleCreate, RoleUpdate, RolePublic, RolesPublic, AssignRoleIn
 
 # 2) entità senza dipendenze incrociate
@@ -14,6 +14,7 @@ from .user import UserCreate, UserRegister, UserUpdate, UserUpdateMe, UpdatePass
 from .dossier import DossierCreate, DossierBase, DossierUpdate, DossierResponse, DossierDetailResponse, DossierListResponse
 
 # from .audit import AuditLog
+from .audit import AuditLogResponse, AuditLogListResponse
 
 __all__ = [
     # role
@@ -28,10 +29,11 @@ __all__ = [
     # module
     "ModuleEntry", "EntryCreate", "EntryUpdate", "EntryResponse", "EntryListResponse", "ModuleInfo",
     "ModuleCatalog", "ModuleCatalogCreate", "ModuleCatalogUpdate", "ModuleCatalogResponse", "ModuleCatalogListResponse",
+    "PayloadDictionary", "DataKey", "BlindIndex", "EntryProjection",
     # dossier
-    "Dossier", "DossierCreate", "DossierBase", "DossierUpdate", "DossierResponse", "DossierDetailResponse", "DossierListResponse",
+    "Dossier", "DossierSummary", "DossierCreate", "DossierBase", "DossierUpdate", "DossierResponse", "DossierDetailResponse", "DossierListResponse",
     # patient
     "Patient", "PatientCreate", "PatientUpdate", "PatientListResponse", "PatientResponse", "PatientBase",
     # audit
-    "AuditLog"
+    "AuditLog", "AuditOutbox", "AuditLogResponse", "AuditLogListResponse"
 ]
@@ -49,4 +49,42 @@
 #         Index('idx_audit_user_table', 'user_id', 'table_name'),
 #         Index('idx_audit_record', 'table_name', 'record_id'),
 #         Index('idx_audit_ts_action', 'ts', 'action'),
-#     )
\ No newline at end of file
+#     )
+
+
+# ################################
+# Schemi di risposta delle rotte /audit
+# ################################
+
+import uuid
+from datetime import datetime
+from typing import Optional
+
+from sqlmodel import SQLModel
+
+
+class AuditLogResponse(SQLModel):
+    audit_id: int
+    ts: datetime
+    user_id: Optional[uuid.UUID] = None
+    username: Optional[str] = None
+    action: str
+    table_name: str
+    record_id: str
+    before: Optional[dict] = None
+    after: Optional[dict] = None
+    ip_address: Optional[str] = None
+    endpoint: Optional[str] = None
+    hit_count: int = 1  # READ accorpati: accessi tra ts e last_ts
+    last_ts: Optional[datetime] = None
+
+    model_config = {"from_attributes": True}
+
+
+class AuditLogListResponse(SQLModel):
+    items: list[AuditLogResponse]
+    total: Optional[int] = None  # solo con count diverso da none
+    page_size: int
+    has_next: bool
+    next_cursor: Optional[str] = None
+    total_estimated: bool = False
@@ -1,6 +1,6 @@
 import uuid
 from datetime import datetime, timezone
-from typing import Optional, TYPE_CHECKING, List
+from typing import Any, Optional, TYPE_CHECKING, List
 from app.models.patient import PatientResponse
 from pydantic import field_validator
 from uuid import UUID
@@ -104,6 +104,10 @@ class DossierResponse(DossierBase):
     updated_at: Optional[datetime]
     deleted_at: Optional[datetime]
     
+    # Contatori da dossier_summary (None se non richiesti)
+    entries_count: Optional[int] = None
+    last_entry_date: Optional[datetime] = None
+    
     # Nested data (opzionale)
     # patient: Optional[PatientResponse] = None
     
@@ -115,12 +119,16 @@ class DossierDetailResponse(DossierResponse):
     """Response con dati completi inclusi entry count"""
     entries_count: int = 0
     last_entry_date: Optional[datetime] = None
+    module_counts: dict[str, int] = {}
+    last_scores: dict[str, Any] = {}
     patient: Optional[PatientResponse] = None  
 
 
 class DossierListResponse(SQLModel):
     items: list[DossierResponse]
-    total: int
-    page: int
+    total: Optional[int] = None  # None in modalità cursore senza with_total
+    page: Optional[int] = None
     page_size: int
-    has_next: bool
\ No newline at end of file
+    has_next: bool
+    next_cursor: Optional[str] = None
+    total_estimated: bool = False  # True se total è la stima del planner (count=estimate)
\ No newline at end of file
@@ -1,6 +1,6 @@
 from __future__ import annotations
 import uuid
-from typing import TYPE_CHECKING, Optional, Dict, Any
+from typing import TYPE_CHECKING, Optional, Dict, Any, Sequence
 from sqlmodel import SQLModel, Field, Relationship, Column, JSON, Index, Integer, UUID, ForeignKey, String, DateTime, Text
 from datetime import datetime, timezone, date
 from sqlalchemy.ext.hybrid import hybrid_property
@@ -187,15 +187,34 @@ class EntryResponse(BaseModel):
     
     @classmethod
     def from_orm(cls, entry: ModuleEntry):
+        return cls.from_entry(entry, entry.get_data())  # ← Usa il metodo
+
+    @classmethod
+    def from_entry(cls, entry: ModuleEntry, data: Dict[str, Any]) -> "EntryResponse":
+        """Costruisce la risposta con dati già decriptati (nessun accesso a entry.data)"""
         return cls(
             id=entry.id,
             dossier_id=entry.dossier_id,
             module_code=entry.module_code,
             schema_version=entry.schema_version,
-            data=entry.get_data(),  # ← Usa il metodo
+            data=data,
             occurred_at=entry.occurred_at,
-            created_at=entry.created_at
+            created_at=entry.created_at,
+            created_by_user_id=entry.created_by_user_id,
+            deleted_at=entry.deleted_at,
+            deleted_by_user_id=entry.deleted_by_user_id
         )
+
+    @classmethod
+    def from_entries(cls, entries: Sequence[ModuleEntry]) -> list["EntryResponse"]:
+        """Costruisce le risposte di una pagina decriptando tutti i payload in un solo passaggio"""
+        # Decripta solo le entry senza payload già in cache, poi popola la cache
+        pending = [entry for entry in entries if entry._get_cached_data() is None]
+        payloads = field_encryption.decrypt_dicts([entry.data_encrypted for entry in pending])
+        for entry, data in zip(pending, payloads):
+            if data is not None:
+                entry._set_cached_data(data)
+        return [cls.from_entry(entry, entry.get_data()) for entry in entries]
     
     model_config = {"from_attributes": True} 
 
@@ -203,10 +222,12 @@ class EntryResponse(BaseModel):
 class EntryListResponse(BaseModel):
     """Schema risposta lista entries"""
     items: list[EntryResponse]
-    total: int
-    page: int
+    total: Optional[int] = None  # None in modalità cursore senza with_total
+    page: Optional[int] = None
     page_size: int
     has_next: bool
+    next_cursor: Optional[str] = None
+    total_estimated: bool = False  # True se total è la stima del planner (count=estimate)
 
 
 class ModuleInfo(BaseModel):
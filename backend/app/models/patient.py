@@ -154,7 +154,9 @@ class PatientResponse(PatientBase):
 
 class PatientListResponse(SQLModel):
     items: list[PatientResponse]
-    total: int
-    page: int
+    total: Optional[int] = None  # None in modalità cursore senza with_total
+    page: Optional[int] = None
     page_size: int
-    has_next: bool
\ No newline at end of file
+    has_next: bool
+    next_cursor: Optional[str] = None
+    total_estimated: bool = False  # True se total è la stima del planner (count=estimate)
\ No newline at end of file
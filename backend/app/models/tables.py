@@ -1,12 +1,70 @@
+import copy
+import logging
 import uuid
-from typing import Optional, Dict, Any, List
+from types import MappingProxyType
+from typing import Optional, Dict, Any, List, Mapping
 from datetime import datetime, timezone, date
 from sqlmodel import SQLModel, Field, Relationship, Column, JSON, Text, String, Integer, Index
 from enum import Enum
+from sqlalchemy import LargeBinary, UniqueConstraint, func, text
 from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.orm import Session as OrmSession, object_session
 from app.services.encryption import field_encryption
 from sqlalchemy.dialects.postgresql import JSONB
 
+logger = logging.getLogger(__name__)
+
+
+def _data_key_connection(instance: SQLModel, session: Optional[OrmSession]):
+    """Connessione della transazione in cui risolvere le DEK (None: connessione propria dell'archivio)"""
+    session = session or object_session(instance)
+    return session.connection() if session is not None else None
+
+
+class _FrozenDict(dict):
+    """dict in sola lettura (resta un dict per json, pydantic e isinstance); deepcopy dà un dict normale"""
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("Payload in sola lettura: modifica una copy.deepcopy e salvala con set_data()")
+    
+    __setitem__ = __delitem__ = __ior__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+    
+    def __copy__(self) -> dict:
+        return dict(self)
+    
+    def __deepcopy__(self, memo) -> dict:
+        return {key: copy.deepcopy(value, memo) for key, value in self.items()}
+    
+    def __reduce__(self):
+        return dict, (dict(self),)
+
+
+class _FrozenList(list):
+    """list in sola lettura, come _FrozenDict"""
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("Payload in sola lettura: modifica una copy.deepcopy e salvala con set_data()")
+    
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _readonly
+    append = clear = extend = insert = pop = remove = reverse = sort = _readonly
+    
+    def __copy__(self) -> list:
+        return list(self)
+    
+    def __deepcopy__(self, memo) -> list:
+        return [copy.deepcopy(value, memo) for value in self]
+    
+    def __reduce__(self):
+        return list, (list(self),)
+
+
+def _freeze(value: Any) -> Any:
+    """Copia in sola lettura di un payload JSON (dict e liste annidati compresi)"""
+    if isinstance(value, dict):
+        return _FrozenDict((key, _freeze(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return _FrozenList(_freeze(item) for item in value)
+    return value
+
 
 class Role(SQLModel, table=True):
     __tablename__ = "role"
@@ -67,6 +125,9 @@ class User(SQLModel, table=True):
     role_id: Optional[uuid.UUID] = Field(default=None, foreign_key="role.id")
     is_superuser: bool = False
     is_active: bool = True
+    # Incrementata a ogni modifica di utente o ruolo: i token con una
+    # versione precedente non valgono più come fonte dei permessi
+    permissions_version: int = Field(default=0, sa_column_kwargs={"server_default": "0"})
 
     structure: Optional["Structure"] = Relationship(
         back_populates="users",
@@ -124,6 +185,18 @@ class Dossier(SQLModel, table=True):
     deleted_at: Optional[datetime] = Field(default=None, index=True)
     deleted_by_user_id: Optional[uuid.UUID] = Field(default=None, foreign_key="user.id")
     
+    # Indici parziali sulle righe non eliminate, allineati alle query delle route
+    # (ordinamento admission_date, id; sottoquery RBAC per struttura/paziente)
+    __table_args__ = (
+        Index('idx_dossier_live_admission', 'admission_date', 'id', postgresql_where=text("deleted_at IS NULL")),
+        Index('idx_dossier_live_structure_admission', 'structure_id', 'admission_date', 'id', postgresql_where=text("deleted_at IS NULL")),
+        Index('idx_dossier_live_structure_patient', 'structure_id', 'patient_id', postgresql_where=text("deleted_at IS NULL")),
+        Index(
+            'idx_dossier_live_patient', 'patient_id',
+            postgresql_include=['structure_id', 'status'], postgresql_where=text("deleted_at IS NULL"),
+        ),
+    )
+    
     # Relationships
     patient:   Optional["Patient"]   = Relationship(back_populates="dossiers")
     structure: Optional["Structure"] = Relationship(back_populates="dossiers")
@@ -168,6 +241,8 @@ class Patient(SQLModel, table=True):
     # Dati sanitari base
     # health_card_number: Optional[str] = Field(default=None, max_length=50)  # Tessera sanitaria
     health_card_number_encrypted: Optional[str] = Field(default=None, sa_column=Column("health_card_number", Text))
+    # Indice cieco (HMAC) per la ricerca esatta sulla tessera sanitaria
+    health_card_number_bidx: Optional[bytes] = Field(default=None, sa_column=Column(LargeBinary, index=True))
     @hybrid_property
     def health_card_number(self) -> str:
         """Getter: decritta automaticamente"""
@@ -182,7 +257,18 @@ class Patient(SQLModel, table=True):
     @health_card_number.setter
     def health_card_number(self, value: str | None):
         """Setter: critta automaticamente"""            
-        self.health_card_number_encrypted = field_encryption.encrypt_str(value) if value else None
+        self.set_health_card_number(value)
+    
+    # Pydantic non inoltra l'assegnazione alla hybrid property: le route usano questo metodo
+    def set_health_card_number(self, value: str | None, session: Optional[OrmSession] = None) -> None:
+        """Cripta la tessera sanitaria (DEK del paziente nella transazione di `session`) e aggiorna il suo indice cieco"""
+        from app.services.blind_index import PATIENT_HEALTH_CARD_FIELD, blind_index
+        
+        self.health_card_number_encrypted = (
+            field_encryption.encrypt_str(value, "patient", self.id, connection=_data_key_connection(self, session))
+            if value else None
+        )
+        self.health_card_number_bidx = blind_index(PATIENT_HEALTH_CARD_FIELD, value) if value else None
             
     # Contatti emergenza
     emergency_contact_name: Optional[str] = Field(default=None, max_length=200)
@@ -204,8 +290,34 @@ class Patient(SQLModel, table=True):
     deleted_at: Optional[datetime] = Field(default=None, index=True)
     deleted_by_user_id: Optional[uuid.UUID] = Field(default=None, foreign_key="user.id")
     
+    # Lista pazienti: ordinamento (last_name, first_name, id) sulle righe non eliminate
+    __table_args__ = (
+        Index('idx_patient_live_name', 'last_name', 'first_name', 'id', postgresql_where=text("deleted_at IS NULL")),
+    )
+    
     # Relationships
     dossiers: list["Dossier"] = Relationship(back_populates="patient")
+
+
+# Ricerca testuale (app/services/search.py): indici GIN pg_trgm sulle stesse
+# espressioni usate nei filtri; fiscal_code con varchar_pattern_ops per LIKE 'PREFISSO%'
+Index(
+    'idx_patient_first_name_trgm', func.lower(Patient.first_name).label('first_name_lower'),
+    postgresql_using='gin', postgresql_ops={'first_name_lower': 'gin_trgm_ops'},
+)
+Index(
+    'idx_patient_last_name_trgm', func.lower(Patient.last_name).label('last_name_lower'),
+    postgresql_using='gin', postgresql_ops={'last_name_lower': 'gin_trgm_ops'},
+)
+Index(
+    'idx_patient_fiscal_code_trgm', Patient.fiscal_code,
+    postgresql_using='gin', postgresql_ops={'fiscal_code': 'gin_trgm_ops'},
+)
+Index('idx_patient_fiscal_code_prefix', Patient.fiscal_code, postgresql_ops={'fiscal_code': 'varchar_pattern_ops'})
+Index(
+    'idx_dossier_notes_trgm', func.lower(Dossier.notes).label('notes_lower'),
+    postgresql_using='gin', postgresql_ops={'notes_lower': 'gin_trgm_ops'},
+)
     
     
 class ModuleCatalog(SQLModel, table=True):
@@ -238,7 +350,9 @@ class ModuleEntry(SQLModel, table=True):
     schema_version: int
     
     # ✅ Campo che memorizza i dati criptati
-    data_encrypted: str = Field(sa_column=Column("data", Text, nullable=False))
+    # Formato binario versionato (vedi app.services.encryption); le righe
+    # legacy in doppio base64 restano leggibili finché non vengono ricodificate
+    data_encrypted: bytes = Field(sa_column=Column("data", LargeBinary, nullable=False))
     
     occurred_at: datetime
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
@@ -249,40 +363,118 @@ class ModuleEntry(SQLModel, table=True):
     signature_hash: Optional[str] = Field(default=None, max_length=64)
     
     dossier: Optional["Dossier"] = Relationship(back_populates="entries")
+    blind_indexes: list["BlindIndex"] = Relationship(
+        back_populates="entry",
+        sa_relationship_kwargs={"cascade": "all, delete-orphan"}
+    )
+    projections: list["EntryProjection"] = Relationship(
+        back_populates="entry",
+        sa_relationship_kwargs={"cascade": "all, delete-orphan"}
+    )
     
     __table_args__ = (
         Index('idx_module_dossier', 'dossier_id', 'module_code', 'occurred_at'),
+        # Timeline del dossier e lista entry per modulo, ordinate (occurred_at, id)
+        Index('idx_module_entry_live_dossier_occurred', 'dossier_id', 'occurred_at', 'id', postgresql_where=text("deleted_at IS NULL")),
+        Index('idx_module_entry_live_module_occurred', 'module_code', 'occurred_at', 'id', postgresql_where=text("deleted_at IS NULL")),
     )
     
     # ✅ METODO per ottenere i dati decriptati
-    def get_data(self) -> Dict[str, Any]:
-        """Decripta e ritorna i dati come dizionario"""
+    def get_data(self) -> Mapping[str, Any]:
+        """
+        Dati decriptati (al massimo una decrittazione per istanza), come vista
+        in sola lettura sulla cache: nessuna copia per lettura. La cache è
+        congelata anche nei dict e nelle liste annidati (TypeError se
+        modificati): chi deve cambiare il payload lavora su
+        copy.deepcopy(dict(entry.get_data())) e lo salva con set_data().
+        """
         if self.data_encrypted:
+            cached = self._get_cached_data()
+            if cached is not None:
+                return MappingProxyType(cached)
             try:
-                return field_encryption.decrypt_dict(self.data_encrypted)
-            except Exception as e:
-                print(f"Decryption error for entry {self.id}: {e}")
-                return {}
-        return {}
+                data = field_encryption.decrypt_dict(self.data_encrypted)
+            except Exception:
+                logger.exception("Decryption error for entry %s", self.id)
+                return MappingProxyType({})
+            self._set_cached_data(data)
+            return MappingProxyType(self._get_cached_data())
+        return MappingProxyType({})
     
     # ✅ METODO per impostare i dati criptati
-    def set_data(self, value: Dict[str, Any]) -> None:
-        """Cripta e salva i dati"""
-        if value is None or (isinstance(value, dict) and len(value) == 0):
+    def set_data(self, value: Dict[str, Any], session: Optional[OrmSession] = None) -> None:
+        """
+        Cripta e salva i dati. La DEK del dossier è letta/creata nella
+        transazione di `session` (default: la sessione dell'istanza)
+        """
+        connection = _data_key_connection(self, session)
+        if not value:
             # Cripta un dict vuoto invece di None
-            self.data_encrypted = field_encryption.encrypt_dict({})
+            value = {}
+            self.data_encrypted = field_encryption.encrypt_payload({}, dossier_id=self.dossier_id, connection=connection)
         else:
-            encrypted = field_encryption.encrypt_dict(value)
-            if encrypted is None:
-                print(f"WARNING: encrypt_dict returned None for value")
-                self.data_encrypted = field_encryption.encrypt_dict({})
+            # Un errore di cifratura si propaga: mai un payload vuoto al posto dei dati
+            self.data_encrypted = field_encryption.encrypt_payload(
+                value, self.module_code, self.dossier_id, connection=connection
+            )
+        # Il nuovo ciphertext invalida la cache; il chiaro è già noto
+        self._set_cached_data(value)
+        self.sync_blind_indexes(value)
+        self.sync_projections(value)
+    
+    # ✅ Indici ciechi dei campi dichiarati in SchemaInfo.blind_index_fields
+    def sync_blind_indexes(self, value: Dict[str, Any]) -> None:
+        """Allinea le righe blind_index al payload (aggiorna in place, niente delete+insert)"""
+        # Import locale: module_registry importa i modelli dei moduli da app.models
+        from app.services.blind_index import entry_blind_indexes
+        
+        tokens = entry_blind_indexes(self.module_code, self.schema_version, value)
+        existing = {index.field: index for index in self.blind_indexes}
+        for field, index in existing.items():
+            if field not in tokens:
+                self.blind_indexes.remove(index)
+        for field, token in tokens.items():
+            if field in existing:
+                existing[field].token = token
             else:
-                self.data_encrypted = encrypted
+                self.blind_indexes.append(BlindIndex(field=field, token=token))
+    
+    # ✅ Proiezione in chiaro dei campi dichiarati in SchemaInfo.projection_fields
+    def sync_projections(self, value: Dict[str, Any]) -> None:
+        """Allinea le righe module_entry_projection al payload"""
+        from app.services.projection import entry_projections
+        
+        values = entry_projections(self.module_code, self.schema_version, value)
+        existing = {projection.field: projection for projection in self.projections}
+        for field, projection in existing.items():
+            if field not in values:
+                self.projections.remove(projection)
+        for field, (num_value, text_value) in values.items():
+            projection = existing.get(field)
+            if projection is None:
+                projection = EntryProjection(field=field, module_code=self.module_code)
+                self.projections.append(projection)
+            projection.num_value = num_value
+            projection.text_value = text_value
+    
+    # ✅ Cache del payload decriptato
+    # Vive solo nel __dict__ dell'istanza ORM (mai persistita né serializzata):
+    # è legata al valore corrente di data_encrypted, quindi un refresh/expire
+    # o un nuovo ciphertext la rendono automaticamente obsoleta.
+    def _get_cached_data(self) -> Optional[Dict[str, Any]]:
+        cached = self.__dict__.get("_data_cache")
+        if cached is not None and cached[0] == self.data_encrypted:
+            return cached[1]
+        return None
+    
+    def _set_cached_data(self, data: Dict[str, Any]) -> None:
+        # Copia congelata: né il chiamante di set_data né chi legge possono alterarla
+        object.__setattr__(self, "_data_cache", (self.data_encrypted, _freeze(data)))
     
     # ✅ PROPRIETÀ READ-ONLY per compatibilità
     @property
-    def data(self) -> Dict[str, Any]:
-        """Proprietà read-only per leggere i dati decriptati"""
+    def data(self) -> Mapping[str, Any]:
+        """Proprietà read-only per leggere i dati decriptati (vedi get_data)"""
         return self.get_data()
     
     def __repr__(self):
@@ -290,19 +482,107 @@ class ModuleEntry(SQLModel, table=True):
 
     
 
+class BlindIndex(SQLModel, table=True):
+    """Indice cieco (HMAC) di un campo del payload cifrato di una entry"""
+    __tablename__ = "blind_index"
+    
+    entry_id: uuid.UUID = Field(foreign_key="module_entry.id", primary_key=True, ondelete="CASCADE")
+    field: str = Field(max_length=100, primary_key=True)
+    token: bytes = Field(sa_column=Column(LargeBinary, nullable=False))
+    
+    entry: Optional["ModuleEntry"] = Relationship(back_populates="blind_indexes")
+    
+    __table_args__ = (
+        Index('idx_blind_index_lookup', 'field', 'token'),
+    )
+
+
+class EntryProjection(SQLModel, table=True):
+    """Valore in chiaro di un campo non sensibile di una entry (per aggregazioni SQL)"""
+    __tablename__ = "module_entry_projection"
+    
+    entry_id: uuid.UUID = Field(foreign_key="module_entry.id", primary_key=True, ondelete="CASCADE")
+    field: str = Field(max_length=100, primary_key=True)
+    module_code: str = Field(max_length=50)
+    num_value: Optional[float] = Field(default=None)
+    text_value: Optional[str] = Field(default=None, max_length=100)
+    
+    entry: Optional["ModuleEntry"] = Relationship(back_populates="projections")
+    
+    __table_args__ = (
+        Index('idx_projection_module_field', 'module_code', 'field'),
+    )
+
+
+class DossierSummary(SQLModel, table=True):
+    """
+    Contatori delle entry non eliminate di un dossier (read model), aggiornati
+    nella stessa transazione di ogni scrittura di ModuleEntry
+    (vedi app.services.dossier_summary)
+    """
+    __tablename__ = "dossier_summary"
+    
+    dossier_id: uuid.UUID = Field(foreign_key="dossiers.id", primary_key=True, ondelete="CASCADE")
+    entries_count: int = Field(default=0)
+    last_entry_at: Optional[datetime] = Field(default=None)
+    # module_code -> numero di entry
+    module_counts: Dict[str, int] = Field(default_factory=dict, sa_column=Column(JSONB, nullable=False))
+    # module_code -> {"value": punteggio, "occurred_at": ISO} dell'ultima entry con punteggio
+    last_scores: Dict[str, Any] = Field(default_factory=dict, sa_column=Column(JSONB, nullable=False))
+    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+
+class PayloadDictionary(SQLModel, table=True):
+    """Dizionario di compressione (zlib zdict) addestrato per module_code"""
+    __tablename__ = "payload_dictionary"
+    
+    id: Optional[int] = Field(default=None, primary_key=True)
+    module_code: str = Field(max_length=50, index=True)
+    dictionary: bytes = Field(sa_column=Column(LargeBinary, nullable=False))
+    sample_size: int = Field(default=0)
+    # Byte compressi / byte JSON sul campione di addestramento
+    ratio: Optional[float] = Field(default=None)
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+
+class DataKey(SQLModel, table=True):
+    """
+    Chiave dati (DEK) di un dossier o paziente, cifrata con la master key.
+    La rotazione della master key aggiorna solo questa tabella.
+    """
+    __tablename__ = "data_key"
+    
+    id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
+    owner_type: str = Field(max_length=20)  # dossier / patient
+    owner_id: uuid.UUID
+    wrapped_key: bytes = Field(sa_column=Column(LargeBinary, nullable=False))
+    # Impronta della master key che ha cifrato wrapped_key
+    master_key_id: str = Field(max_length=16, index=True)
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    rotated_at: Optional[datetime] = Field(default=None)
+    
+    __table_args__ = (
+        UniqueConstraint('owner_type', 'owner_id', name='uq_data_key_owner'),
+    )
+
+
 class AuditLog(SQLModel, table=True):
+    """
+    Su Postgres la tabella è partizionata per mese su ts (PK audit_id + ts,
+    vedi app/services/audit_partitions.py). Gli indici a colonna singola sono
+    coperti dai composti; ts ha un indice BRIN per le query per intervallo.
+    """
     __tablename__ = "audit_log"
     
     audit_id: Optional[int] = Field(default=None, primary_key=True)
     ts: datetime = Field(
-        default_factory=lambda: datetime.now(timezone.utc),
-        index=True
+        default_factory=lambda: datetime.now(timezone.utc)
     )
-    user_id: Optional[uuid.UUID] = Field(default=None, index=True)
+    user_id: Optional[uuid.UUID] = Field(default=None)
     username: Optional[str] = Field(default=None, max_length=255)
-    action: str = Field(max_length=20, index=True)
-    table_name: str = Field(max_length=100, index=True)
-    record_id: str = Field(max_length=50, index=True)
+    action: str = Field(max_length=20)
+    table_name: str = Field(max_length=100)
+    record_id: str = Field(max_length=50)
     
     before: Optional[dict] = Field(
         default=None,
@@ -314,10 +594,43 @@ class AuditLog(SQLModel, table=True):
     )
     ip_address: Optional[str] = Field(default=None, max_length=45)
     endpoint: Optional[str] = Field(default=None, max_length=255)
+
+    # READ accorpati: numero di accessi tra ts (primo) e last_ts (ultimo)
+    hit_count: int = Field(default=1, sa_column_kwargs={"server_default": "1"})
+    last_ts: Optional[datetime] = Field(default=None)
     
     __table_args__ = (
         Index('idx_audit_user_table', 'user_id', 'table_name'),
         Index('idx_audit_record', 'table_name', 'record_id'),
         Index('idx_audit_ts_action', 'ts', 'action'),
+        Index('idx_audit_ts_brin', 'ts', postgresql_using='brin'),
     )    
+
+
+class AuditOutbox(SQLModel, table=True):
+    """
+    Outbox degli eventi di audit delle scritture: la riga è inserita nella
+    stessa transazione della modifica (nessun indice secondario da aggiornare)
+    e spostata in audit_log a batch dal writer di audit.
+    """
+    __tablename__ = "audit_outbox"
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    ts: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    user_id: Optional[uuid.UUID] = Field(default=None)
+    username: Optional[str] = Field(default=None, max_length=255)
+    action: str = Field(max_length=20)
+    table_name: str = Field(max_length=100)
+    record_id: str = Field(max_length=50)
+
+    before: Optional[dict] = Field(
+        default=None,
+        sa_column=Column(JSONB, nullable=True)
+    )
+    after: Optional[dict] = Field(
+        default=None,
+        sa_column=Column(JSONB, nullable=True)
+    )
+    ip_address: Optional[str] = Field(default=None, max_length=45)
+    endpoint: Optional[str] = Field(default=None, max_length=255)
     
@@ -9,11 +9,28 @@ from app.models.moduli import ValutazioneInfermieristicaV1, ValutazioneLivelliAs
 class SchemaInfo:
     model: Type[BaseModel]
     migrate_from_previous: Callable | None = None
+    # Campi del payload (notazione puntata) ricercabili per valore esatto tramite indice cieco.
+    # Solo campi sensibili e ad alta cardinalità: mai campi già in projection_fields
+    blind_index_fields: Tuple[str, ...] = ()
+    # Campi non sensibili (numeri/enum) copiati in chiaro in module_entry_projection per le statistiche SQL
+    projection_fields: Tuple[str, ...] = ()
+    # Campo proiettato che riassume l'entry (ultimo valore in dossier_summary.last_scores)
+    score_field: Optional[str] = None
 
 
 REGISTRY: Dict[tuple[str,int], SchemaInfo] = {
-    ("ROG26/1.3", 1): SchemaInfo(model=ValutazioneLivelliAssistenzialiV1),
-    ("ROG26/1.4", 1): SchemaInfo(model=ValutazioneInfermieristicaV1),
+    ("ROG26/1.3", 1): SchemaInfo(
+        model=ValutazioneLivelliAssistenzialiV1,
+        # punteggio_totale è proiettato: il filtro esatto usa la proiezione, non l'indice cieco
+        blind_index_fields=("paziente.paziente_nominativo",),
+        projection_fields=("punteggio_totale", "strutt", "compilazione.compilatore"),
+        score_field="punteggio_totale",
+    ),
+    ("ROG26/1.4", 1): SchemaInfo(
+        model=ValutazioneInfermieristicaV1,
+        blind_index_fields=("paziente.paziente_nominativo",),
+        # Nessuna proiezione: peso, altezza, terapie e farmaci sono dati clinici
+    ),
 }
 
 def migrate_presa_in_carico_v1_to_v2(old_data: dict) -> dict:
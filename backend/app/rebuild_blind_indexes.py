@@ -0,0 +1,29 @@
+import argparse
+import logging
+
+from sqlmodel import Session
+
+from app.core.db import engine
+from app.services.blind_index import rebuild_blind_indexes
+from app.services.key_store import configure_data_keys
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Ricostruisce gli indici ciechi di entry e pazienti")
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+
+    # I payload envelope servono le data key per essere letti
+    configure_data_keys(engine)
+
+    logger.info("Rebuilding blind indexes")
+    with Session(engine) as session:
+        report = rebuild_blind_indexes(session, batch_size=args.batch_size)
+    logger.info(f"Rebuild finished: {report}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+import argparse
+import logging
+
+from sqlmodel import Session
+
+from app.core.db import engine
+from app.services.dossier_summary import rebuild_dossier_summaries
+from app.services.key_store import configure_data_keys
+from app.services.projection import backfill_projections
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Ricostruisce dossier_summary dalle entry esistenti")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument(
+        "--skip-projections",
+        action="store_true",
+        help="Non ripopolare module_entry_projection (solo se app/backfill_projections.py è già stato eseguito)",
+    )
+    args = parser.parse_args()
+
+    # last_scores si legge dalle proiezioni: vanno popolate prima del riepilogo
+    with Session(engine) as session:
+        if not args.skip_projections:
+            configure_data_keys(engine)
+            logger.info("Backfilling entry projections")
+            backfill_projections(session, batch_size=args.batch_size)
+        logger.info("Rebuilding dossier summaries")
+        processed = rebuild_dossier_summaries(session, batch_size=args.batch_size)
+    logger.info(f"Rebuild finished: {processed} dossiers")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+import argparse
+import logging
+
+from app.core.db import engine
+from app.services.key_store import configure_data_keys
+from app.services.payload_storage import reencode_payloads, reencode_to_envelope
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Ricodifica i payload module_entry nel formato binario")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--pause", type=float, default=0.0, help="Pausa in secondi tra i batch")
+    parser.add_argument(
+        "--envelope",
+        action="store_true",
+        help="Ricifra payload e tessere sanitarie con la DEK del dossier/paziente (richiede ENCRYPTION_MASTER_KEYS)",
+    )
+    args = parser.parse_args()
+
+    if args.envelope:
+        if not configure_data_keys(engine):
+            parser.error("ENCRYPTION_MASTER_KEYS non configurata: impossibile ricifrare in formato envelope")
+        logger.info("Re-encrypting payloads to envelope format")
+        progress = reencode_to_envelope(engine, batch_size=args.batch_size, pause_s=args.pause)
+    else:
+        logger.info("Re-encoding module payloads")
+        progress = reencode_payloads(engine, batch_size=args.batch_size, pause_s=args.pause)
+    logger.info(f"Re-encoding finished: {progress.as_dict()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,24 @@
+import argparse
+import logging
+
+from app.core.db import engine
+from app.services.key_store import rewrap_data_keys
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Ri-cifra le data key con la master key attiva")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--pause", type=float, default=0.0, help="Pausa in secondi tra i batch")
+    args = parser.parse_args()
+
+    logger.info("Rewrapping data keys")
+    progress = rewrap_data_keys(engine, batch_size=args.batch_size, workers=args.workers, pause_s=args.pause)
+    logger.info(f"Rewrap finished: {progress.as_dict()}")
+
+
+if __name__ == "__main__":
+    main()
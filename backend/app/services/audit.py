@@ -1,9 +1,12 @@
 # app/utils/audit.py
-from sqlalchemy import event, inspect
-from sqlalchemy.orm import Session
-from sqlalchemy.ext.asyncio import AsyncSession
-from app.models import AuditLog
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+from app.models import AuditLog, AuditOutbox
 from app.models import User
+from app.services import audit_writer as writer
+from app.services.audit_serializers import AuditSerializer, register_serializer, serializer_for
+from app.services.audit_writer import audit_row, audit_writer
+from app.services.principal import Principal
 from contextvars import ContextVar
 from datetime import datetime, timezone
 from typing import Optional
@@ -30,128 +33,136 @@ def get_audit_context() -> dict:
     return current_user_context.get({})
 
 def serialize_model(instance) -> dict:
-    """Serializza un modello SQLAlchemy in dict"""
-    result = {}
-    mapper = inspect(instance.__class__)
-    for column in mapper.columns:
-        value = getattr(instance, column.name)
-        
-        # Gestisci tipi non serializzabili
-        if isinstance(value, datetime):
-            value = value.isoformat()
-        elif isinstance(value, bytes):
-            value = "<binary data>"
-        elif hasattr(value, '__str__') and not isinstance(value, (str, int, float, bool, type(None))):
-            value = str(value)
-        
-        # NON loggare dati sensibili crittografati
-        if column.name in ['_data_encrypted', 'password', 'hashed_password']:
-            value = "<encrypted>"
-        
-        result[column.name] = value
-    return result
+    """Serializza un modello SQLAlchemy in dict (serializzatore precompilato della classe)"""
+    return serializer_for(instance.__class__).serialize(instance)
 
-async def log_read_access(
-    session: AsyncSession,
+def log_read_access(
+    session: Session,
     table_name: str,
     record_id: str,
-    user: User,
+    user: User | Principal,
     request_info: dict
 ):
-    """Log manuale per accessi in lettura"""
-    audit = AuditLog(
-        user_id=str(user.id),
-        username=user.username,  # adatta al tuo User model
-        action='READ',
-        table_name=table_name,
-        record_id=str(record_id),
-        before=None,
-        after=None,
-        ip_address=request_info.get('ip'),
-        endpoint=request_info.get('endpoint')
+    """
+    Log manuale per accessi in lettura. Il primo accesso è sempre una riga
+    nella sessione; con AUDIT_READ_DELIVERY=batched le ripetizioni entro la
+    finestra sono solo contate dal writer di audit.
+    """
+    row = audit_row(
+        'READ',
+        table_name,
+        record_id,
+        {
+            "user_id": user.id,
+            "username": user.username,  # adatta al tuo User model
+            "ip_address": request_info.get('ip'),
+            "endpoint": request_info.get('endpoint'),
+        },
     )
-    session.add(audit)
+    if writer.AUDIT_READ_DELIVERY == "batched" and audit_writer.enabled and not audit_writer.record_read(row):
+        return
+    session.add(AuditLog(**row))
     # Non fare commit, sarà fatto dal chiamante
 
+
+AUDIT_PENDING_KEY = "audit_pending"
+
+
+def _write_table():
+    return AuditOutbox.__table__ if writer.AUDIT_WRITE_DELIVERY == "outbox" else AuditLog.__table__
+
+
+def _queue_write_event(connection, target, row: dict) -> None:
+    """
+    Accoda la riga nella sessione: viene scritta in after_flush con un solo
+    INSERT per tutte le istanze del flush (stessa transazione della modifica).
+    """
+    session = object_session(target)
+    if session is None:
+        connection.execute(_write_table().insert().values(**row))
+        return
+    session.info.setdefault(AUDIT_PENDING_KEY, []).append(row)
+
+
+@event.listens_for(Session, 'before_flush')
+def _reset_pending(session, flush_context, instances):
+    # Righe rimaste da un flush fallito (rollback): non vanno scritte
+    session.info.pop(AUDIT_PENDING_KEY, None)
+
+
+@event.listens_for(Session, 'after_flush')
+def _write_pending(session, flush_context):
+    rows = session.info.pop(AUDIT_PENDING_KEY, None)
+    if rows:
+        session.connection().execute(_write_table().insert(), rows)
+
+
+def write_audit_events(session: Session, rows: list[dict]) -> None:
+    """
+    Scrive subito, nella transazione della sessione, eventi prodotti fuori
+    dai listener (es. UPDATE in blocco): un solo INSERT per tutte le righe
+    """
+    if rows:
+        session.connection().execute(_write_table().insert(), rows)
+
+
 def setup_audit_listeners(models_to_audit: list):
-    """Registra listener per tutti i modelli specificati"""
+    """Registra listener (con serializzatore precompilato) per tutti i modelli specificati"""
     
     for model in models_to_audit:
-        
-        @event.listens_for(model, 'after_insert')
-        def audit_insert(mapper, connection, target):
-            context = get_audit_context()
-            if not context:  # Se non c'è contesto (es. script batch), skippa
-                return
-                
-            connection.execute(
-                AuditLog.__table__.insert().values(
-                    ts=datetime.now(timezone.utc),
-                    user_id=context.get('user_id'),
-                    username=context.get('username'),
-                    action='CREATE',
-                    table_name=target.__tablename__,
-                    record_id=str(getattr(target, 'id', 'unknown')),
-                    before=None,
-                    after=serialize_model(target),
-                    ip_address=context.get('ip_address'),
-                    endpoint=context.get('endpoint')
-                )
-            )
-        
-        @event.listens_for(model, 'after_update')
-        def audit_update(mapper, connection, target):
-            context = get_audit_context()
-            if not context:
-                return
-                
-            state = inspect(target)
-            before_data = {}
+        _register_listeners(model, register_serializer(model))
+
+
+def _register_listeners(model, serializer: AuditSerializer):
+    table_name = model.__tablename__
+
+    @event.listens_for(model, 'after_insert')
+    def audit_insert(mapper, connection, target):
+        context = get_audit_context()
+        if not context:  # Se non c'è contesto (es. script batch), skippa
+            return
             
-            for attr in state.attrs:
-                hist = attr.load_history()
-                if hist.has_changes():
-                    old_val = hist.deleted[0] if hist.deleted else None
-                    # Serializza il valore precedente
-                    if isinstance(old_val, datetime):
-                        old_val = old_val.isoformat()
-                    before_data[attr.key] = old_val
+        _queue_write_event(connection, target, audit_row(
+            'CREATE',
+            table_name,
+            getattr(target, 'id', 'unknown'),
+            context,
+            before=None,
+            after=serializer.serialize(target),
+        ))
+    
+    @event.listens_for(model, 'after_update')
+    def audit_update(mapper, connection, target):
+        context = get_audit_context()
+        if not context:
+            return
             
-            connection.execute(
-                AuditLog.__table__.insert().values(
-                    ts=datetime.now(timezone.utc),
-                    user_id=context.get('user_id'),
-                    username=context.get('username'),
-                    action='UPDATE',
-                    table_name=target.__tablename__,
-                    record_id=str(getattr(target, 'id', 'unknown')),
-                    before=before_data if before_data else None,
-                    after=serialize_model(target),
-                    ip_address=context.get('ip_address'),
-                    endpoint=context.get('endpoint')
-                )
-            )
+        # Solo gli attributi modificati (committed_state), senza load_history
+        before_data = serializer.changes(target)
         
-        @event.listens_for(model, 'after_delete')
-        def audit_delete(mapper, connection, target):
-            context = get_audit_context()
-            if not context:
-                return
-                
-            connection.execute(
-                AuditLog.__table__.insert().values(
-                    ts=datetime.now(timezone.utc),
-                    user_id=context.get('user_id'),
-                    username=context.get('username'),
-                    action='DELETE',
-                    table_name=target.__tablename__,
-                    record_id=str(getattr(target, 'id', 'unknown')),
-                    before=serialize_model(target),
-                    after=None,
-                    ip_address=context.get('ip_address'),
-                    endpoint=context.get('endpoint')
-                )
-            )
+        _queue_write_event(connection, target, audit_row(
+            'UPDATE',
+            table_name,
+            getattr(target, 'id', 'unknown'),
+            context,
+            before=before_data if before_data else None,
+            after=serializer.serialize(target),
+        ))
+    
+    @event.listens_for(model, 'after_delete')
+    def audit_delete(mapper, connection, target):
+        context = get_audit_context()
+        if not context:
+            return
+            
+        _queue_write_event(connection, target, audit_row(
+            'DELETE',
+            table_name,
+            getattr(target, 'id', 'unknown'),
+            context,
+            before=serializer.serialize(target),
+            after=None,
+        ))
             
             
 # Esempio di utilizzo:
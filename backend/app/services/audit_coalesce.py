@@ -0,0 +1,85 @@
+# app/services/audit_coalesce.py
+"""
+Accorpamento degli eventi READ ripetuti (polling del frontend, riaperture
+dello stesso dossier): gli accessi identici dello stesso utente allo stesso
+record dallo stesso endpoint e indirizzo, entro AUDIT_READ_COALESCE_WINDOW
+secondi dal primo, diventano una sola riga di audit_log con hit_count e
+primo/ultimo accesso (ts / last_ts). Ogni accesso resta contato.
+
+Il primo accesso della finestra è scritto subito, nella transazione della
+richiesta: in memoria restano solo i contatori degli accessi successivi,
+applicati poi con UPDATE ... SET hit_count = hit_count + n. Un crash perde
+al più quei contatori, mai la traccia dell'accesso.
+"""
+from datetime import datetime, timedelta, timezone
+import os
+import threading
+
+AUDIT_READ_COALESCE_WINDOW = float(os.getenv("AUDIT_READ_COALESCE_WINDOW", "60"))
+
+CoalesceKey = tuple
+
+
+def coalesce_key(row: dict) -> CoalesceKey:
+    return (row["user_id"], row["table_name"], row["record_id"], row["endpoint"], row["ip_address"])
+
+
+class ReadCoalescer:
+    """
+    Finestre READ aperte per chiave, in ordine di primo accesso. Ogni voce è
+    la riga del primo accesso con `extra_hits` (accessi successivi non ancora
+    applicati) e `last_ts`.
+    """
+
+    def __init__(self, window_s: float = AUDIT_READ_COALESCE_WINDOW, max_keys: int = 10000):
+        self._window = timedelta(seconds=window_s)
+        self._max_keys = max_keys
+        self._rows: dict[CoalesceKey, dict] = {}
+        # Finestre chiuse (scadute o sfrattate) con accessi da applicare
+        self._closed: list[dict] = []
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self._window > timedelta(0)
+
+    def __len__(self) -> int:
+        return len(self._rows) + len(self._closed)
+
+    def _close(self, entry: dict) -> None:
+        if entry["extra_hits"]:
+            self._closed.append(entry)
+
+    def add(self, row: dict) -> bool:
+        """Registra l'accesso; True se apre una finestra (la riga va scritta dal chiamante)"""
+        key = coalesce_key(row)
+        with self._lock:
+            current = self._rows.get(key)
+            if current is not None and row["ts"] - current["ts"] <= self._window:
+                current["extra_hits"] += 1
+                current["last_ts"] = max(current["last_ts"], row["ts"])
+                return False
+            if current is not None:
+                self._close(self._rows.pop(key))
+            self._rows[key] = dict(row, extra_hits=0, last_ts=row["ts"])
+            while len(self._rows) > self._max_keys:
+                self._close(self._rows.pop(next(iter(self._rows))))
+            return True
+
+    def pop_ready(self, now: datetime | None = None, everything: bool = False) -> list[dict]:
+        """Finestre chiuse con accessi da applicare (tutte con `everything`, es. allo shutdown)"""
+        with self._lock:
+            ready, self._closed = self._closed, []
+            if everything:
+                ready.extend(self._rows.values())
+                self._rows = {}
+            else:
+                cutoff = (now or datetime.now(timezone.utc)) - self._window
+                expired = []
+                # Ordine di inserimento = ordine del primo accesso: ci si ferma alla prima finestra aperta
+                for key, entry in self._rows.items():
+                    if entry["ts"] > cutoff:
+                        break
+                    expired.append(key)
+                ready.extend(self._rows.pop(key) for key in expired)
+            return [entry for entry in ready if entry["extra_hits"]]
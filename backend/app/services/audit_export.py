@@ -0,0 +1,122 @@
+# app/services/audit_export.py
+"""
+Interrogazione ed esportazione di audit_log.
+
+I filtri ricalcano gli indici della tabella: (table_name, record_id) per
+"chi ha toccato il record X" (idx_audit_record), (user_id, table_name) per
+"cosa ha fatto l'utente Y" (idx_audit_user_table), (ts, action) per gli
+intervalli temporali (idx_audit_ts_action, BRIN su ts).
+
+L'esportazione legge con un cursore lato server (stream_results) a blocchi
+di EXPORT_BATCH_SIZE righe e produce NDJSON o CSV in streaming: un anno di
+eventi non viene mai caricato in memoria.
+"""
+from datetime import datetime
+from typing import Iterable, Iterator, Literal
+import csv
+import io
+import json
+import uuid
+
+from fastapi import HTTPException
+from sqlalchemy import Engine, select
+
+from app.models import AuditLog
+
+ExportFormat = Literal["ndjson", "csv"]
+
+EXPORT_BATCH_SIZE = 2000
+EXPORT_COLUMNS = (
+    "audit_id", "ts", "user_id", "username", "action", "table_name", "record_id",
+    "before", "after", "ip_address", "endpoint", "hit_count", "last_ts",
+)
+EXPORT_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+def filter_audit(
+    stmt,
+    *,
+    user_id: uuid.UUID | None = None,
+    table_name: str | None = None,
+    record_id: str | None = None,
+    action: str | None = None,
+    since: datetime | None = None,
+    until: datetime | None = None,
+):
+    """Applica i filtri a una select su AuditLog (o sulle sue colonne)"""
+    if record_id is not None and table_name is None:
+        # Senza tabella il filtro non può usare idx_audit_record
+        raise HTTPException(400, "record_id requires table_name")
+    if user_id is not None:
+        stmt = stmt.where(AuditLog.user_id == user_id)
+    if table_name is not None:
+        stmt = stmt.where(AuditLog.table_name == table_name)
+    if record_id is not None:
+        stmt = stmt.where(AuditLog.record_id == record_id)
+    if action is not None:
+        stmt = stmt.where(AuditLog.action == action.upper())
+    if since is not None:
+        stmt = stmt.where(AuditLog.ts >= since)
+    if until is not None:
+        stmt = stmt.where(AuditLog.ts < until)
+    return stmt
+
+
+def export_statement(**filters):
+    """Colonne di esportazione in ordine cronologico"""
+    columns = [AuditLog.__table__.c[name] for name in EXPORT_COLUMNS]
+    return filter_audit(select(*columns), **filters).order_by(AuditLog.ts, AuditLog.audit_id)
+
+
+def _plain(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    return value
+
+
+def ndjson_lines(rows: Iterable) -> Iterator[str]:
+    for row in rows:
+        yield json.dumps(
+            {name: _plain(value) for name, value in zip(EXPORT_COLUMNS, row)},
+            separators=(",", ":"),
+            default=str,
+        ) + "\n"
+
+
+def _csv_line(values: Iterable) -> str:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(values)
+    return buffer.getvalue()
+
+
+def csv_lines(rows: Iterable, header: bool = True) -> Iterator[str]:
+    if header:
+        yield _csv_line(EXPORT_COLUMNS)
+    for row in rows:
+        yield _csv_line(
+            json.dumps(value, default=str) if isinstance(value, (dict, list)) else _plain(value)
+            for value in row
+        )
+
+
+def stream_audit_export(
+    engine: Engine, stmt, export_format: ExportFormat, batch_size: int = EXPORT_BATCH_SIZE
+) -> Iterator[str]:
+    """
+    Righe esportate a blocchi; la connessione è propria dello stream (la
+    sessione della richiesta è già chiusa quando la risposta viene inviata).
+    """
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=batch_size).execute(stmt)
+        first = True
+        for partition in result.partitions():
+            if export_format == "csv":
+                chunk = "".join(csv_lines(partition, header=first))
+            else:
+                chunk = "".join(ndjson_lines(partition))
+            first = False
+            yield chunk
+        if first and export_format == "csv":
+            yield "".join(csv_lines([], header=True))
@@ -0,0 +1,218 @@
+# app/services/audit_partitions.py
+"""
+Partizionamento mensile di audit_log (RANGE su ts) e archiviazione delle
+partizioni oltre il periodo di conservazione.
+
+Livelli di conservazione:
+- online: partizioni attaccate ad audit_log, interrogabili dall'API
+- archivio: partizioni staccate ed esportate in CSV gzip su disco locale
+
+Le partizioni dei mesi futuri (AUDIT_PARTITIONS_AHEAD) sono create
+all'avvio e periodicamente dal writer di audit; la partizione DEFAULT
+raccoglie le righe fuori intervallo, che vengono spostate quando la
+partizione del loro mese viene creata. La creazione è serializzata da un
+advisory lock di transazione: ogni worker la esegue all'avvio.
+
+Con drop=False (--keep-detached) la tabella esportata resta nel database
+con un COMMENT "archiviata: <file>": le esecuzioni successive la saltano
+invece di esportarla di nuovo sopra lo stesso file.
+"""
+from datetime import date, datetime
+from pathlib import Path
+import gzip
+import logging
+import os
+import re
+
+from sqlalchemy import Connection, Engine, text
+
+logger = logging.getLogger(__name__)
+
+AUDIT_PARTITIONS_AHEAD = int(os.getenv("AUDIT_PARTITIONS_AHEAD", "3"))
+AUDIT_RETENTION_MONTHS = int(os.getenv("AUDIT_RETENTION_MONTHS", "12"))
+AUDIT_ARCHIVE_DIR = os.getenv("AUDIT_ARCHIVE_DIR", "audit_archive")
+AUDIT_PARTITION_CHECK_INTERVAL = float(os.getenv("AUDIT_PARTITION_CHECK_INTERVAL", str(6 * 3600)))
+
+PARENT_TABLE = "audit_log"
+DEFAULT_PARTITION = "audit_log_default"
+_PARTITION_NAME = re.compile(r"^audit_log_y(\d{4})m(\d{2})$")
+# Chiave dell'advisory lock di ensure_partitions (hashtext del nome)
+PARTITION_LOCK_NAME = "audit_log_partitions"
+ARCHIVED_COMMENT_PREFIX = "archiviata: "
+
+
+def month_start(value: date | datetime) -> date:
+    return date(value.year, value.month, 1)
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"{PARENT_TABLE}_y{month.year}m{month.month:02d}"
+
+
+def partition_month(name: str) -> date | None:
+    """Mese di una partizione dal nome (None per la DEFAULT o nomi estranei)"""
+    match = _PARTITION_NAME.match(name)
+    return date(int(match.group(1)), int(match.group(2)), 1) if match else None
+
+
+def partitions_to_archive(names: list[str], cutoff: date) -> list[str]:
+    """Partizioni interamente precedenti al mese `cutoff`, dalla più vecchia"""
+    months = {name: partition_month(name) for name in names}
+    return sorted((name for name, month in months.items() if month and month < cutoff), key=months.get)
+
+
+def is_partitioned(conn: Connection) -> bool:
+    if conn.dialect.name != "postgresql":
+        return False
+    return conn.execute(
+        text("SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:table))"),
+        {"table": PARENT_TABLE},
+    ).scalar_one()
+
+
+def list_partitions(conn: Connection) -> list[str]:
+    return list(conn.execute(
+        text(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = to_regclass(:table)"
+        ),
+        {"table": PARENT_TABLE},
+    ).scalars())
+
+
+def archived_comment(path: Path) -> str:
+    return f"{ARCHIVED_COMMENT_PREFIX}{path}"
+
+
+def list_detached_partitions(conn: Connection) -> list[str]:
+    """
+    Partizioni mensili staccate ma non ancora esportate (archiviazione
+    interrotta); quelle già esportate e tenute con drop=False sono escluse
+    """
+    return list(conn.execute(
+        text(
+            "SELECT relname FROM pg_class "
+            "WHERE relkind = 'r' AND NOT relispartition AND relname ~ '^audit_log_y[0-9]{4}m[0-9]{2}$' "
+            "AND coalesce(obj_description(oid, 'pg_class'), '') NOT LIKE :archived"
+        ),
+        {"archived": f"{ARCHIVED_COMMENT_PREFIX}%"},
+    ).scalars())
+
+
+def _create_partition(conn: Connection, month: date) -> None:
+    name = partition_name(month)
+    bounds = {"lo": datetime.combine(month, datetime.min.time()),
+              "hi": datetime.combine(add_months(month, 1), datetime.min.time())}
+    create = (
+        f"CREATE TABLE {name} PARTITION OF {PARENT_TABLE} "
+        f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+    )
+    misplaced = conn.execute(
+        text(f"SELECT EXISTS (SELECT 1 FROM {DEFAULT_PARTITION} WHERE ts >= :lo AND ts < :hi)"), bounds
+    ).scalar_one()
+    if not misplaced:
+        conn.execute(text(create))
+        return
+
+    # Righe del mese già finite nella DEFAULT: Postgres rifiuta la nuova
+    # partizione finché non vengono spostate
+    conn.execute(text(f"ALTER TABLE {PARENT_TABLE} DETACH PARTITION {DEFAULT_PARTITION}"))
+    conn.execute(text(create))
+    moved = conn.execute(
+        text(
+            f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} WHERE ts >= :lo AND ts < :hi RETURNING *) "
+            f"INSERT INTO {PARENT_TABLE} SELECT * FROM moved"
+        ),
+        bounds,
+    ).rowcount
+    conn.execute(text(f"ALTER TABLE {PARENT_TABLE} ATTACH PARTITION {DEFAULT_PARTITION} DEFAULT"))
+    logger.warning(f"Spostate {moved} righe di audit dalla partizione DEFAULT a {name}")
+
+
+def ensure_partitions(
+    engine: Engine, months_ahead: int = AUDIT_PARTITIONS_AHEAD, today: date | None = None
+) -> list[str]:
+    """Crea le partizioni mancanti dal mese corrente a `months_ahead` mesi avanti"""
+    created = []
+    with engine.begin() as conn:
+        if not is_partitioned(conn):
+            return created
+        # Worker avviati insieme: uno crea, gli altri trovano le partizioni già fatte
+        conn.execute(text("SELECT pg_advisory_xact_lock(hashtext(:name))"), {"name": PARTITION_LOCK_NAME})
+        existing = set(list_partitions(conn))
+        current = month_start(today or date.today())
+        for offset in range(months_ahead + 1):
+            month = add_months(current, offset)
+            if partition_name(month) not in existing:
+                _create_partition(conn, month)
+                created.append(partition_name(month))
+    if created:
+        logger.info(f"Partizioni di audit create: {created}")
+    return created
+
+
+def _export_partition(engine: Engine, name: str, export_dir: Path) -> tuple[Path, int]:
+    """COPY della tabella in CSV gzip (scritto su file temporaneo e rinominato)"""
+    target = export_dir / f"{name}.csv.gz"
+    partial = target.with_suffix(".gz.partial")
+    with engine.connect() as conn:
+        rows = conn.execute(text(f"SELECT count(*) FROM {name}")).scalar_one()
+        driver_connection = conn.connection.driver_connection
+        with driver_connection.cursor() as cursor, gzip.open(partial, "wb") as out:
+            with cursor.copy(f"COPY {name} TO STDOUT (FORMAT csv, HEADER)") as copy:
+                for chunk in copy:
+                    out.write(chunk)
+    os.replace(partial, target)
+    return target, rows
+
+
+def archive_partitions(
+    engine: Engine,
+    keep_months: int = AUDIT_RETENTION_MONTHS,
+    export_dir: str | Path = AUDIT_ARCHIVE_DIR,
+    drop: bool = True,
+    today: date | None = None,
+) -> list[dict]:
+    """
+    Stacca le partizioni più vecchie di `keep_months` mesi, le esporta in
+    `export_dir` e (con `drop`) elimina la tabella, altrimenti la marca come
+    archiviata. Un'esportazione fallita lascia la tabella staccata e non
+    marcata: viene ripresa al lancio successivo.
+    """
+    export_dir = Path(export_dir)
+    export_dir.mkdir(parents=True, exist_ok=True)
+    cutoff = add_months(month_start(today or date.today()), -keep_months)
+
+    with engine.connect() as conn:
+        if not is_partitioned(conn):
+            logger.warning(f"{PARENT_TABLE} non è partizionata: nulla da archiviare")
+            return []
+        attached = partitions_to_archive(list_partitions(conn), cutoff)
+        detached = partitions_to_archive(list_detached_partitions(conn), cutoff)
+
+    report = []
+    for name in sorted(set(attached) | set(detached), key=partition_month):
+        if name in attached:
+            with engine.begin() as conn:
+                conn.execute(text(f"ALTER TABLE {PARENT_TABLE} DETACH PARTITION {name}"))
+        try:
+            path, rows = _export_partition(engine, name, export_dir)
+        except Exception as e:
+            logger.error(f"Esportazione di {name} fallita, tabella lasciata staccata: {e}")
+            report.append({"partition": name, "error": str(e)})
+            continue
+        with engine.begin() as conn:
+            if drop:
+                conn.execute(text(f"DROP TABLE {name}"))
+            else:
+                # COMMENT non accetta parametri: letterale con gli apici raddoppiati
+                comment = archived_comment(path).replace("'", "''")
+                conn.exec_driver_sql(f"COMMENT ON TABLE {name} IS '{comment}'")
+        logger.info(f"Partizione {name} archiviata in {path} ({rows} righe)")
+        report.append({"partition": name, "file": str(path), "rows": rows, "dropped": drop})
+    return report
@@ -0,0 +1,151 @@
+# app/services/audit_serializers.py
+"""
+Serializzatori di audit precompilati per classe mappata.
+
+Colonne, convertitori per tipo e redazione sono calcolati una volta (a
+setup_audit_listeners); per riga resta solo la lettura dei valori dallo
+stato dell'istanza. Le modifiche di un UPDATE si leggono da
+committed_state (solo gli attributi effettivamente toccati), senza
+load_history su ogni attributo né caricamenti delle relazioni.
+
+Le colonne redatte non vengono mai lette dall'istanza: `data` e
+`health_card_number` sono esposte da proprietà che decifrano.
+"""
+from datetime import date, datetime, time
+from typing import Any, Callable
+import uuid
+
+from sqlalchemy import Date, DateTime, LargeBinary, Time, Uuid, inspect
+from sqlalchemy.orm import ColumnProperty
+from sqlalchemy.orm.base import NO_VALUE
+
+REDACTED = "<encrypted>"
+BINARY = "<binary data>"
+REDACTED_COLUMNS = frozenset({"data", "hashed_password", "password", "health_card_number"})
+
+Converter = Callable[[Any], Any]
+
+
+def _redact(value: Any) -> Any:
+    return REDACTED
+
+
+def _identity(value: Any) -> Any:
+    return value
+
+
+def _isoformat(value: Any) -> Any:
+    return value.isoformat() if isinstance(value, (datetime, date, time)) else value
+
+
+def _binary(value: Any) -> Any:
+    return BINARY if isinstance(value, (bytes, bytearray, memoryview)) else value
+
+
+def _uuid(value: Any) -> Any:
+    return str(value) if isinstance(value, uuid.UUID) else value
+
+
+def _generic(value: Any) -> Any:
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    if isinstance(value, bytes):
+        return BINARY
+    if not isinstance(value, (str, int, float, bool, type(None), dict, list)):
+        return str(value)
+    return value
+
+
+def _converter_for(column) -> Converter:
+    if column.name in REDACTED_COLUMNS:
+        return _redact
+    column_type = column.type
+    if isinstance(column_type, (DateTime, Date, Time)):
+        return _isoformat
+    if isinstance(column_type, LargeBinary):
+        return _binary
+    if isinstance(column_type, Uuid):
+        return _uuid
+    try:
+        python_type = column_type.python_type
+    except NotImplementedError:
+        return _generic
+    if python_type in (str, int, float, bool, dict, list):
+        return _identity
+    return _generic
+
+
+class AuditSerializer:
+    """Campi (chiave attributo, nome colonna, convertitore) di una classe mappata"""
+
+    __slots__ = ("model", "fields", "_by_key")
+
+    def __init__(self, model: type):
+        mapper = inspect(model)
+        fields = []
+        for prop in mapper.column_attrs:
+            if not isinstance(prop, ColumnProperty) or len(prop.columns) != 1:
+                continue
+            column = prop.columns[0]
+            fields.append((prop.key, column.name, _converter_for(column)))
+        self.model = model
+        self.fields: tuple[tuple[str, str, Converter], ...] = tuple(fields)
+        self._by_key = {key: (name, convert) for key, name, convert in self.fields}
+
+    def serialize(self, instance) -> dict:
+        """Valori correnti di tutte le colonne, per nome di colonna"""
+        values = inspect(instance).dict
+        result = {}
+        for key, name, convert in self.fields:
+            if convert is _redact:
+                result[name] = REDACTED
+                continue
+            value = values.get(key, NO_VALUE)
+            if value is NO_VALUE:
+                value = getattr(instance, key)
+            result[name] = convert(value)
+        return result
+
+    def serialize_row(self, row) -> dict:
+        """Come serialize, da una riga per nome di colonna (es. RETURNING di un UPDATE in blocco)"""
+        return {
+            name: REDACTED if convert is _redact else convert(row[name])
+            for _, name, convert in self.fields
+        }
+
+    def changes(self, instance) -> dict:
+        """Valori precedenti delle sole colonne modificate (None se non caricati)"""
+        state = inspect(instance)
+        committed = state.committed_state
+        if not committed:
+            return {}
+        current = state.dict
+        before = {}
+        for key, old in committed.items():
+            field = self._by_key.get(key)
+            if field is None:
+                continue  # relazioni e attributi non di colonna
+            name, convert = field
+            if old is NO_VALUE:
+                before[name] = None
+                continue
+            if current.get(key, NO_VALUE) == old:
+                continue
+            before[name] = convert(old)
+        return before
+
+
+_serializers: dict[type, AuditSerializer] = {}
+
+
+def register_serializer(model: type) -> AuditSerializer:
+    serializer = _serializers[model] = AuditSerializer(model)
+    return serializer
+
+
+def serializer_for(model: type) -> AuditSerializer:
+    """Serializzatore della classe (costruito alla prima richiesta se non registrato)"""
+    serializer = _serializers.get(model)
+    if serializer is None:
+        serializer = register_serializer(model)
+    return serializer
@@ -0,0 +1,285 @@
+# app/services/audit_writer.py
+"""
+Scrittura degli eventi di audit fuori dal percorso della richiesta.
+
+Garanzie di consegna configurabili:
+- scritture (CREATE/UPDATE/DELETE), AUDIT_WRITE_DELIVERY:
+    direct: riga in audit_log nella stessa transazione della modifica
+    outbox: riga in audit_outbox nella stessa transazione (tabella senza
+            indici secondari); il writer la sposta in audit_log a batch
+- letture (READ), AUDIT_READ_DELIVERY:
+    sync: ogni accesso è una riga aggiunta alla sessione della richiesta
+    batched: il primo accesso di ogni finestra è una riga nella sessione
+             della richiesta (durabile con il suo commit); gli accessi
+             ripetuti sono accorpati in memoria (app/services/audit_coalesce.py)
+             e applicati dal thread del writer ogni AUDIT_FLUSH_INTERVAL
+             secondi come UPDATE di hit_count/last_ts
+
+Nessun READ vive solo in memoria: un crash perde al più i contatori degli
+accessi ripetuti. I batch (outbox, archivi) sono scritti con COPY su
+Postgres (psycopg) e con INSERT multi-riga sugli altri dialetti.
+"""
+from datetime import datetime, timezone
+from time import monotonic
+from typing import Any, Callable, Literal
+import json
+import logging
+import os
+import threading
+import uuid
+
+from sqlalchemy import Connection, Engine, and_, delete, insert, select, update
+
+from app.models import AuditLog, AuditOutbox
+from app.services.audit_coalesce import AUDIT_READ_COALESCE_WINDOW, ReadCoalescer
+
+logger = logging.getLogger(__name__)
+
+WriteDelivery = Literal["direct", "outbox"]
+ReadDelivery = Literal["sync", "batched"]
+
+AUDIT_WRITE_DELIVERY: WriteDelivery = os.getenv("AUDIT_WRITE_DELIVERY", "outbox")  # type: ignore[assignment]
+AUDIT_READ_DELIVERY: ReadDelivery = os.getenv("AUDIT_READ_DELIVERY", "batched")  # type: ignore[assignment]
+AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", "500"))
+AUDIT_FLUSH_INTERVAL = float(os.getenv("AUDIT_FLUSH_INTERVAL", "1.0"))
+# Finestre READ aperte al massimo (oltre, le più vecchie vengono chiuse e applicate)
+AUDIT_COALESCE_MAX_KEYS = int(os.getenv("AUDIT_COALESCE_MAX_KEYS", "10000"))
+AUDIT_USE_COPY = os.getenv("AUDIT_USE_COPY", "true").lower() in ("1", "true")
+
+# Colonne comuni a audit_log e audit_outbox
+EVENT_COLUMNS = (
+    "ts", "user_id", "username", "action", "table_name", "record_id",
+    "before", "after", "ip_address", "endpoint",
+)
+# hit_count/last_ts valorizzati solo per i READ accorpati
+AUDIT_COLUMNS = EVENT_COLUMNS + ("hit_count", "last_ts")
+_COLUMN_DEFAULTS = {"hit_count": 1}
+_JSON_COLUMNS = ("before", "after")
+
+_audit_table = AuditLog.__table__
+_outbox_table = AuditOutbox.__table__
+
+
+def audit_row(
+    action: str,
+    table_name: str,
+    record_id: Any,
+    context: dict,
+    before: dict | None = None,
+    after: dict | None = None,
+    ts=None,
+) -> dict:
+    """Riga di audit_log (colonne AUDIT_COLUMNS) a partire dal contesto della richiesta"""
+    user_id = context.get("user_id")
+    if user_id is not None and not isinstance(user_id, uuid.UUID):
+        try:
+            user_id = uuid.UUID(str(user_id))
+        except ValueError:
+            user_id = None
+    return {
+        "ts": ts or datetime.now(timezone.utc),
+        "user_id": user_id,
+        "username": context.get("username"),
+        "action": action,
+        "table_name": table_name,
+        "record_id": str(record_id),
+        "before": before,
+        "after": after,
+        "ip_address": context.get("ip_address"),
+        "endpoint": context.get("endpoint"),
+    }
+
+
+def _values(row: dict) -> list:
+    return [row.get(name, _COLUMN_DEFAULTS.get(name)) for name in AUDIT_COLUMNS]
+
+
+def _copy_rows(conn: Connection, rows: list[dict]) -> bool:
+    """COPY ... FROM STDIN sulla connessione psycopg della transazione; False se non disponibile"""
+    if not AUDIT_USE_COPY or conn.dialect.name != "postgresql" or conn.dialect.driver != "psycopg":
+        return False
+    driver_connection = conn.connection.driver_connection
+    columns = ", ".join(AUDIT_COLUMNS)
+    with driver_connection.cursor() as cursor:
+        with cursor.copy(f"COPY {_audit_table.name} ({columns}) FROM STDIN") as copy:
+            for row in rows:
+                copy.write_row([
+                    json.dumps(value) if name in _JSON_COLUMNS and value is not None else value
+                    for name, value in zip(AUDIT_COLUMNS, _values(row))
+                ])
+    return True
+
+
+def write_audit_rows(conn: Connection, rows: list[dict]) -> int:
+    """Scrive le righe in audit_log nella transazione di `conn` (COPY o INSERT multi-riga)"""
+    if not rows:
+        return 0
+    if not _copy_rows(conn, rows):
+        conn.execute(insert(_audit_table).values([dict(zip(AUDIT_COLUMNS, _values(row))) for row in rows]))
+    return len(rows)
+
+
+class AuditWriter:
+    """
+    Contatori dei READ ripetuti e drenaggio dell'outbox, con un thread di
+    scrittura avviato al primo evento (o da start()).
+    """
+
+    def __init__(
+        self,
+        engine: Engine | None = None,
+        batch_size: int = AUDIT_BATCH_SIZE,
+        flush_interval: float = AUDIT_FLUSH_INTERVAL,
+        max_keys: int = AUDIT_COALESCE_MAX_KEYS,
+        coalesce_window: float = AUDIT_READ_COALESCE_WINDOW,
+    ):
+        self._engine = engine
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._coalescer = ReadCoalescer(coalesce_window, max_keys=max_keys)
+        # Finestre estratte dal coalescer non ancora applicate
+        self._staged: list[dict] = []
+        self._write_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._thread_lock = threading.Lock()
+        # Attività periodiche eseguite dal thread del writer: [task, intervallo, prossima esecuzione]
+        self._maintenance: list[list] = []
+
+    def set_engine(self, engine: Engine) -> None:
+        self._engine = engine
+
+    @property
+    def enabled(self) -> bool:
+        return self._engine is not None
+
+    @property
+    def pending(self) -> int:
+        return len(self._staged) + len(self._coalescer)
+
+    def record_read(self, row: dict) -> bool:
+        """
+        Registra un READ; True se è il primo accesso della finestra e il
+        chiamante deve scrivere la riga nella propria transazione.
+        """
+        if not self._coalescer.enabled:
+            return True
+        first = self._coalescer.add(row)
+        self._ensure_started()
+        return first
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._thread_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+                self._thread.start()
+
+    def start(self) -> None:
+        if self.enabled:
+            self._ensure_started()
+
+    def add_maintenance(self, task: Callable[[], Any], interval_s: float) -> None:
+        """Esegue `task` dal thread del writer al più ogni `interval_s` secondi"""
+        self._maintenance.append([task, interval_s, 0.0])
+
+    def _run_maintenance(self) -> None:
+        now = monotonic()
+        for item in self._maintenance:
+            task, interval_s, due_at = item
+            if due_at > now:
+                continue
+            item[2] = now + interval_s
+            try:
+                task()
+            except Exception as e:
+                logger.error(f"Manutenzione di audit {getattr(task, '__name__', task)} fallita: {e}")
+
+    def _apply_hits(self, conn: Connection, entry: dict) -> None:
+        """hit_count/last_ts sulla riga del primo accesso; la riga intera se manca (rollback del chiamante)"""
+        c = _audit_table.c
+        # ts seleziona anche la partizione di audit_log
+        match = [c.action == "READ", c.ts == entry["ts"]]
+        for name in ("user_id", "table_name", "record_id", "endpoint", "ip_address"):
+            value = entry[name]
+            match.append(c[name].is_(None) if value is None else c[name] == value)
+        result = conn.execute(
+            update(_audit_table)
+            .where(and_(*match))
+            .values(hit_count=c.hit_count + entry["extra_hits"], last_ts=entry["last_ts"])
+        )
+        if result.rowcount == 0:
+            write_audit_rows(conn, [dict(entry, hit_count=1 + entry["extra_hits"])])
+
+    def flush(self, everything: bool = False) -> int:
+        """
+        Applica gli accessi ripetuti delle finestre chiuse (tutte con
+        `everything`); restituisce il numero di righe aggiornate.
+        """
+        written = 0
+        with self._write_lock:
+            self._staged.extend(self._coalescer.pop_ready(everything=everything))
+            while self._staged:
+                batch = self._staged[:self._batch_size]
+                with self._engine.begin() as conn:
+                    for entry in batch:
+                        self._apply_hits(conn, entry)
+                self._staged = self._staged[len(batch):]
+                written += len(batch)
+        return written
+
+    def drain_outbox(self) -> int:
+        """Sposta in audit_log le righe dell'outbox, un batch per transazione"""
+        moved = 0
+        c = _outbox_table.c
+        while True:
+            with self._engine.begin() as conn:
+                ids = (
+                    select(c.id)
+                    .order_by(c.id)
+                    .limit(self._batch_size)
+                    .with_for_update(skip_locked=True)
+                    .scalar_subquery()
+                )
+                rows = conn.execute(
+                    delete(_outbox_table).where(c.id.in_(ids)).returning(c.id, *(c[name] for name in EVENT_COLUMNS))
+                ).mappings().all()
+                if not rows:
+                    break
+                # audit_id segue l'ordine di inserimento nell'outbox
+                write_audit_rows(conn, [dict(row) for row in sorted(rows, key=lambda row: row["id"])])
+            moved += len(rows)
+            if len(rows) < self._batch_size:
+                break
+        return moved
+
+    def _run(self) -> None:
+        while not self._stop.wait(self._flush_interval):
+            self._flush_once()
+            self._run_maintenance()
+        self._flush_once(everything=True)
+
+    def _flush_once(self, everything: bool = False) -> None:
+        try:
+            self.flush(everything)
+        except Exception as e:
+            logger.error(f"Scrittura batch di audit fallita ({self.pending} eventi in attesa): {e}")
+        if AUDIT_WRITE_DELIVERY == "outbox":
+            try:
+                self.drain_outbox()
+            except Exception as e:
+                logger.error(f"Drenaggio outbox di audit fallito: {e}")
+
+    def stop(self, timeout: float = 10.0) -> None:
+        """Ferma il thread dopo l'ultimo flush (shutdown dell'applicazione)"""
+        thread = self._thread
+        if thread is None:
+            return
+        self._stop.set()
+        thread.join(timeout)
+        self._thread = None
+
+
+audit_writer = AuditWriter()
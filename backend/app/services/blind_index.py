@@ -0,0 +1,188 @@
+# app/services/blind_index.py
+"""
+Indici ciechi (keyed HMAC) per la ricerca a corrispondenza esatta su campi
+cifrati: tessera sanitaria del paziente e campi dei payload ModuleEntry
+dichiarati in SchemaInfo.blind_index_fields.
+
+Campi a dominio piccolo già proiettati in chiaro (punteggi, enum) non vanno
+indicizzati: il token diventerebbe un oracolo per l'HMAC. I filtri su quei
+campi leggono module_entry_projection.
+
+Il token è HMAC-SHA256(chiave, campo || 0x00 || valore normalizzato),
+troncato a 16 byte: lo stesso valore in campi diversi produce token diversi.
+Cambiare BLIND_INDEX_KEY richiede di ricostruire gli indici
+(app/rebuild_blind_indexes.py).
+"""
+from typing import Any, Iterable, NamedTuple
+import hashlib
+import hmac
+import logging
+import os
+import threading
+
+from fastapi import HTTPException
+from sqlmodel import Session, select
+
+from app.module_registry import REGISTRY
+from app.services.encryption import get_key_material
+
+logger = logging.getLogger(__name__)
+
+TOKEN_SIZE = 16
+
+# Campo indicizzato della tabella patient
+PATIENT_HEALTH_CARD_FIELD = "patient.health_card_number"
+
+_index_key: bytes | None = None
+_index_key_lock = threading.Lock()
+
+
+def _get_index_key() -> bytes:
+    """Chiave HMAC del processo: BLIND_INDEX_KEY o derivata dalla chiave di cifratura"""
+    global _index_key
+    if _index_key is None:
+        with _index_key_lock:
+            if _index_key is None:
+                configured = os.getenv("BLIND_INDEX_KEY")
+                if configured:
+                    _index_key = configured.encode()
+                else:
+                    _index_key = hmac.new(get_key_material(), b"blind-index", hashlib.sha256).digest()
+    return _index_key
+
+
+def normalize_value(value: Any) -> bytes:
+    """Forma canonica del valore: case-insensitive, spazi compattati, numeri come testo"""
+    if isinstance(value, bool):
+        value = "true" if value else "false"
+    return " ".join(str(value).split()).casefold().encode("utf-8")
+
+
+def blind_index(field: str, value: Any) -> bytes:
+    return hmac.new(
+        _get_index_key(),
+        field.encode("utf-8") + b"\x00" + normalize_value(value),
+        hashlib.sha256,
+    ).digest()[:TOKEN_SIZE]
+
+
+def extract_field(data: dict, path: str) -> Any:
+    """Valore di un campo del payload in notazione puntata (es. paziente.paziente_nominativo)"""
+    value: Any = data
+    for part in path.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+
+def indexed_fields(module_code: str, schema_version: int) -> tuple[str, ...]:
+    schema_info = REGISTRY.get((module_code, schema_version))
+    return schema_info.blind_index_fields if schema_info else ()
+
+
+def entry_blind_indexes(module_code: str, schema_version: int, data: dict) -> dict[str, bytes]:
+    """Token dei campi indicizzati presenti (e non vuoti) nel payload"""
+    tokens = {}
+    for path in indexed_fields(module_code, schema_version):
+        value = extract_field(data, path)
+        if value is None or value == "" or isinstance(value, (dict, list)):
+            continue
+        tokens[path] = blind_index(path, value)
+    return tokens
+
+
+class FieldFilter(NamedTuple):
+    """Filtro `campo=valore`: via indice cieco (token) o via proiezione in chiaro"""
+    field: str
+    token: bytes | None = None
+    num_value: float | None = None
+    text_value: str | None = None
+
+
+def _projected_filter(path: str, value: str) -> FieldFilter:
+    # Stessa forma di projection.project_value: numeri in num_value, il resto in text_value
+    value = value.strip()
+    try:
+        return FieldFilter(path, num_value=float(value))
+    except ValueError:
+        return FieldFilter(path, text_value=value)
+
+
+def parse_field_filters(filters: Iterable[str] | None, module_code: str | None) -> list[FieldFilter]:
+    """
+    Converte i filtri `campo=valore` della query in FieldFilter.
+    Il campo deve essere indicizzato o proiettato dal modulo richiesto (o da almeno un modulo).
+    """
+    if not filters:
+        return []
+    schemas = [info for (code, _), info in REGISTRY.items() if module_code is None or code == module_code]
+    indexed = {path for info in schemas for path in info.blind_index_fields}
+    projected = {path for info in schemas for path in info.projection_fields}
+    parsed = []
+    for item in filters:
+        path, sep, value = item.partition("=")
+        path = path.strip()
+        if not sep or not value.strip():
+            raise HTTPException(400, f"Invalid field filter '{item}': expected field=value")
+        if path in indexed:
+            parsed.append(FieldFilter(path, token=blind_index(path, value)))
+        elif path in projected:
+            parsed.append(_projected_filter(path, value))
+        else:
+            raise HTTPException(
+                400, f"Field '{path}' is not searchable. Searchable fields: {sorted(indexed | projected)}"
+            )
+    return parsed
+
+
+def rebuild_blind_indexes(session: Session, batch_size: int = 500) -> dict:
+    """
+    Ricalcola gli indici di tutte le entry e della tessera sanitaria dei
+    pazienti (dopo un cambio di chiave o di campi dichiarati nel REGISTRY).
+    """
+    from app.models import ModuleEntry, Patient
+
+    report = {"entries": 0, "patients": 0}
+
+    last_id = None
+    while True:
+        stmt = select(ModuleEntry).order_by(ModuleEntry.id).limit(batch_size)
+        if last_id is not None:
+            stmt = stmt.where(ModuleEntry.id > last_id)
+        entries = session.exec(stmt).all()
+        if not entries:
+            break
+        for entry in entries:
+            entry.sync_blind_indexes(entry.get_data())
+            session.add(entry)
+        session.commit()
+        report["entries"] += len(entries)
+        last_id = entries[-1].id
+        session.expunge_all()
+        logger.info(f"Indici ciechi ricostruiti: {report}")
+
+    last_id = None
+    while True:
+        stmt = (
+            select(Patient)
+            .where(Patient.health_card_number_encrypted.is_not(None))
+            .order_by(Patient.id)
+            .limit(batch_size)
+        )
+        if last_id is not None:
+            stmt = stmt.where(Patient.id > last_id)
+        patients = session.exec(stmt).all()
+        if not patients:
+            break
+        for patient in patients:
+            card = patient.health_card_number
+            patient.health_card_number_bidx = blind_index(PATIENT_HEALTH_CARD_FIELD, card) if card else None
+            session.add(patient)
+        session.commit()
+        report["patients"] += len(patients)
+        last_id = patients[-1].id
+        session.expunge_all()
+
+    logger.info(f"Indici ciechi ricostruiti: {report}")
+    return report
@@ -0,0 +1,83 @@
+# app/services/dossier_stats.py
+"""
+Statistiche dei dossier calcolate in SQL con una sola query.
+
+GROUPING SETS ((), (care_level), (mese di ricovero)) produce in un unico
+passaggio il totale, la ripartizione per livello assistenziale e i bucket
+mensili; i conteggi per stato usano count(*) FILTER, la degenza (in giorni,
+solo dimessi con data di dimissione) avg e percentile_cont. Al server
+arrivano poche righe qualunque sia lo storico della struttura.
+"""
+from typing import Any, Iterable
+
+from sqlalchemy import and_, func, literal_column, select, tuple_
+from sqlmodel import Session
+
+from app.models import Dossier
+
+STATUSES = ("active", "discharged", "transferred")
+STAY_PERCENTILES = {"p50": 0.5, "p90": 0.9}
+
+
+def dossier_stats_statement(*conditions):
+    month = func.date_trunc(literal_column("'month'"), Dossier.admission_date)
+    with_stay = and_(Dossier.status == "discharged", Dossier.discharge_date.is_not(None))
+    stay_days = func.extract("epoch", Dossier.discharge_date - Dossier.admission_date) / 86400
+
+    columns = [
+        func.grouping(Dossier.care_level).label("all_levels"),
+        func.grouping(month).label("all_months"),
+        Dossier.care_level,
+        month.label("month"),
+        func.count().label("total"),
+        *(func.count().filter(Dossier.status == status).label(status) for status in STATUSES),
+        func.avg(stay_days).filter(with_stay).label("avg_stay_days"),
+        *(
+            func.percentile_cont(fraction).within_group(stay_days).filter(with_stay).label(name)
+            for name, fraction in STAY_PERCENTILES.items()
+        ),
+    ]
+    return (
+        select(*columns)
+        .where(Dossier.deleted_at.is_(None), *conditions)
+        .group_by(func.grouping_sets(tuple_(), tuple_(Dossier.care_level), tuple_(month)))
+    )
+
+
+def _days(value) -> float | None:
+    return round(float(value), 1) if value is not None else None
+
+
+def _metrics(row) -> dict[str, Any]:
+    return {
+        "total": row.total,
+        "by_status": {status: getattr(row, status) for status in STATUSES},
+        "avg_stay_days": _days(row.avg_stay_days),
+        "stay_days_percentiles": {name: _days(getattr(row, name)) for name in STAY_PERCENTILES},
+    }
+
+
+def summarize_stats(rows: Iterable) -> dict[str, Any]:
+    """Righe dei grouping set -> totale, per livello assistenziale, per mese"""
+    summary = {
+        "total": 0,
+        "by_status": dict.fromkeys(STATUSES, 0),
+        "avg_stay_days": None,
+        "stay_days_percentiles": dict.fromkeys(STAY_PERCENTILES),
+    }
+    by_care_level: dict[str, dict] = {}
+    by_month: list[dict] = []
+    for row in rows:
+        if row.all_levels and row.all_months:
+            summary.update(_metrics(row))
+        elif not row.all_levels:
+            level = getattr(row.care_level, "value", row.care_level)
+            by_care_level[level] = _metrics(row)
+        else:
+            by_month.append({"month": row.month.strftime("%Y-%m"), **_metrics(row)})
+    by_month.sort(key=lambda bucket: bucket["month"])
+    return {**summary, "by_care_level": by_care_level, "by_month": by_month}
+
+
+def dossier_stats(session: Session, *conditions) -> dict[str, Any]:
+    return summarize_stats(session.exec(dossier_stats_statement(*conditions)).all())
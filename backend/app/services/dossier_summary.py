@@ -0,0 +1,309 @@
+# app/services/dossier_summary.py
+"""
+Read model dossier_summary: per dossier numero di entry non eliminate,
+data dell'ultima entry, conteggi per modulo e ultimo punteggio per modulo
+(SchemaInfo.score_field, letto da module_entry_projection).
+
+Ogni flush di ModuleEntry (creazione, modifica, soft delete, ripristino)
+aggiorna il riepilogo in after_flush, nella stessa transazione della
+scrittura, applicando delta: ±1 su entries_count e module_counts[code],
+massimo su last_entry_at e last_scores. Solo quando cambia o sparisce l'entry
+più recente del dossier (o del punteggio) il dossier viene ricalcolato dalle
+entry. La riga del riepilogo è bloccata (FOR UPDATE) durante il delta, quindi
+due scritture concorrenti sullo stesso dossier si serializzano senza perdere
+incrementi.
+
+Le UPDATE in blocco fuori dall'ORM devono chiamare refresh_dossier_summaries;
+rebuild_dossier_summaries ricostruisce tutto. La migrazione b9e1a3c5d7f0 crea
+le righe dei dossier esistenti con i soli conteggi: last_scores dipende da
+module_entry_projection e va riempito con app/rebuild_dossier_summaries.py,
+che esegue prima il backfill delle proiezioni. Un dossier ancora senza riga
+(nessuna entry scritta) ha il riepilogo calcolato in lettura da
+summary_for/summaries_for.
+"""
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Iterable
+import logging
+import uuid
+
+from sqlalchemy import Connection, and_, event, func, inspect, or_, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from app.models import Dossier, DossierSummary, EntryProjection, ModuleEntry
+from app.module_registry import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_COLUMNS = ("entries_count", "last_entry_at", "module_counts", "last_scores", "updated_at")
+
+
+def score_fields() -> list[tuple[str, str]]:
+    """(module_code, campo) dei punteggi dichiarati nel registro"""
+    return sorted({(code, info.score_field) for (code, _), info in REGISTRY.items() if info.score_field})
+
+
+def _isoformat(value: datetime | None) -> str | None:
+    return value.isoformat() if value is not None else None
+
+
+def _as_utc(value: datetime | str | None) -> datetime | None:
+    """Date confrontabili tra DB, JSON e istanze: sempre aware in UTC (naive = UTC)"""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value is None:
+        return None
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+
+
+def compute_summaries(conn: Connection, dossier_ids: Iterable[uuid.UUID]) -> list[dict[str, Any]]:
+    """Righe di dossier_summary calcolate dalle entry (due query per tutti i dossier)"""
+    ids = list(dossier_ids)
+    now = datetime.now(timezone.utc)
+    summaries = {
+        dossier_id: {
+            "dossier_id": dossier_id, "entries_count": 0, "last_entry_at": None,
+            "module_counts": {}, "last_scores": {}, "updated_at": now,
+        }
+        for dossier_id in ids
+    }
+    if not ids:
+        return []
+
+    live = and_(ModuleEntry.dossier_id.in_(ids), ModuleEntry.deleted_at.is_(None))
+    counts = conn.execute(
+        select(
+            ModuleEntry.dossier_id, ModuleEntry.module_code,
+            func.count().label("entries"), func.max(ModuleEntry.occurred_at).label("last_at"),
+        ).where(live).group_by(ModuleEntry.dossier_id, ModuleEntry.module_code)
+    )
+    for row in counts:
+        summary = summaries[row.dossier_id]
+        summary["entries_count"] += row.entries
+        summary["module_counts"][row.module_code] = row.entries
+        if summary["last_entry_at"] is None or row.last_at > summary["last_entry_at"]:
+            summary["last_entry_at"] = row.last_at
+
+    fields = score_fields()
+    if fields:
+        ranked = (
+            select(
+                ModuleEntry.dossier_id, ModuleEntry.module_code, ModuleEntry.occurred_at,
+                EntryProjection.num_value,
+                func.row_number().over(
+                    partition_by=(ModuleEntry.dossier_id, ModuleEntry.module_code),
+                    order_by=(ModuleEntry.occurred_at.desc(), ModuleEntry.created_at.desc()),
+                ).label("position"),
+            )
+            .join(EntryProjection, EntryProjection.entry_id == ModuleEntry.id)
+            .where(
+                live,
+                EntryProjection.num_value.is_not(None),
+                or_(*(and_(EntryProjection.module_code == code, EntryProjection.field == field) for code, field in fields)),
+            )
+            .subquery()
+        )
+        for row in conn.execute(select(ranked).where(ranked.c.position == 1)):
+            summaries[row.dossier_id]["last_scores"][row.module_code] = {
+                "value": row.num_value, "occurred_at": _isoformat(row.occurred_at),
+            }
+
+    return list(summaries.values())
+
+
+def _upsert(conn: Connection, rows: list[dict[str, Any]]) -> None:
+    insert = pg_insert if conn.dialect.name == "postgresql" else sqlite_insert
+    stmt = insert(DossierSummary.__table__)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[DossierSummary.__table__.c.dossier_id],
+        set_={name: stmt.excluded[name] for name in SUMMARY_COLUMNS},
+    )
+    conn.execute(stmt, rows)
+
+
+def refresh_dossier_summaries(conn: Connection, dossier_ids: Iterable[uuid.UUID]) -> int:
+    """Ricalcola e scrive il riepilogo dei dossier (nella transazione della connessione)"""
+    ids = sorted(set(dossier_ids))
+    if not ids:
+        return 0
+    # Ordine fisso dei lock: niente deadlock tra flush concorrenti
+    existing = conn.execute(
+        select(Dossier.id).where(Dossier.id.in_(ids)).order_by(Dossier.id).with_for_update()
+    ).scalars().all()
+    rows = compute_summaries(conn, existing)
+    if rows:
+        _upsert(conn, rows)
+    return len(rows)
+
+
+@dataclass
+class EntryChange:
+    """Effetto di un flush su una entry: delta sul conteggio e date prima/dopo"""
+    entry_id: uuid.UUID
+    module_code: str
+    delta: int
+    occurred_at: datetime | None
+    previous_at: datetime | None
+    recompute: bool = False
+
+
+def _entry_change(instance: ModuleEntry, is_new: bool, is_deleted: bool) -> EntryChange | None:
+    # In after_flush la history degli attributi riflette ancora lo stato precedente
+    state = inspect(instance)
+    histories = {name: state.attrs[name].history for name in ("deleted_at", "occurred_at", "data_encrypted", "module_code")}
+    if not (is_new or is_deleted) and not any(history.has_changes() for history in histories.values()):
+        return None
+
+    def before(name: str):
+        history = histories[name]
+        return history.deleted[0] if history.deleted else getattr(instance, name)
+
+    # Attributo scaduto prima della modifica: il valore precedente non è noto
+    unknown = not is_new and any(history.added and not history.deleted for history in histories.values())
+    was_live = not is_new and before("deleted_at") is None
+    is_live = not is_deleted and instance.deleted_at is None
+    if not (was_live or is_live or unknown):
+        return None
+    return EntryChange(
+        entry_id=instance.id,
+        module_code=instance.module_code,
+        delta=int(is_live) - int(was_live),
+        occurred_at=_as_utc(instance.occurred_at) if is_live else None,
+        previous_at=_as_utc(before("occurred_at")) if was_live else None,
+        recompute=unknown,
+    )
+
+
+def _entry_score(conn: Connection, change: EntryChange) -> float | None:
+    field = dict(score_fields()).get(change.module_code)
+    if field is None:
+        return None
+    return conn.execute(
+        select(EntryProjection.num_value).where(
+            EntryProjection.entry_id == change.entry_id, EntryProjection.field == field
+        )
+    ).scalar()
+
+
+def _apply_changes(conn: Connection, summary: dict[str, Any], changes: list[EntryChange]) -> bool:
+    """Applica i delta alla riga; False se serve il ricalcolo completo"""
+    for change in changes:
+        last_at = _as_utc(summary["last_entry_at"])
+        score = summary["last_scores"].get(change.module_code)
+        score_at = _as_utc(score["occurred_at"]) if score else None
+        # Cambia o sparisce l'entry più recente: il nuovo massimo va cercato nelle entry
+        if change.recompute or change.previous_at is not None and any(
+            latest is not None and change.previous_at >= latest for latest in (last_at, score_at)
+        ):
+            return False
+
+        summary["entries_count"] += change.delta
+        count = summary["module_counts"].get(change.module_code, 0) + change.delta
+        if count > 0:
+            summary["module_counts"][change.module_code] = count
+        else:
+            summary["module_counts"].pop(change.module_code, None)
+
+        if change.occurred_at is None:
+            continue
+        if last_at is None or change.occurred_at > last_at:
+            summary["last_entry_at"] = change.occurred_at
+        if score_at is None or change.occurred_at >= score_at:
+            value = _entry_score(conn, change)
+            if value is not None:
+                summary["last_scores"][change.module_code] = {
+                    "value": value, "occurred_at": _isoformat(change.occurred_at),
+                }
+    return True
+
+
+def apply_entry_changes(conn: Connection, changes: dict[uuid.UUID, list[EntryChange]]) -> None:
+    """Aggiorna il riepilogo dei dossier con i delta di un flush (nella transazione della connessione)"""
+    table = DossierSummary.__table__
+    recompute = []
+    rows = []
+    # Ordine fisso dei lock: niente deadlock tra flush concorrenti
+    for dossier_id in sorted(changes):
+        current = conn.execute(
+            select(table).where(table.c.dossier_id == dossier_id).with_for_update()
+        ).mappings().first()
+        if current is None:
+            recompute.append(dossier_id)
+            continue
+        summary = {
+            **current,
+            "module_counts": dict(current["module_counts"]),
+            "last_scores": dict(current["last_scores"]),
+            "updated_at": datetime.now(timezone.utc),
+        }
+        if _apply_changes(conn, summary, changes[dossier_id]):
+            rows.append(summary)
+        else:
+            recompute.append(dossier_id)
+    if rows:
+        _upsert(conn, rows)
+    # Dossier senza riga o con l'entry più recente toccata: ricalcolo dalle entry
+    refresh_dossier_summaries(conn, recompute)
+
+
+@event.listens_for(Session, "after_flush")
+def _refresh_after_flush(session, flush_context):
+    changes: dict[uuid.UUID, list[EntryChange]] = {}
+    for instances, is_new, is_deleted in (
+        (session.new, True, False), (session.dirty, False, False), (session.deleted, False, True),
+    ):
+        for instance in instances:
+            if not isinstance(instance, ModuleEntry) or instance.dossier_id is None:
+                continue
+            change = _entry_change(instance, is_new, is_deleted)
+            if change is not None:
+                changes.setdefault(instance.dossier_id, []).append(change)
+    if changes:
+        apply_entry_changes(session.connection(), changes)
+
+
+def summary_for(session: Session, dossier_id: uuid.UUID) -> dict[str, Any]:
+    """Riepilogo di un dossier; calcolato al volo se la riga non esiste ancora"""
+    summary = session.get(DossierSummary, dossier_id)
+    if summary is not None:
+        return summary.model_dump()
+    (computed,) = compute_summaries(session.connection(), [dossier_id])
+    return computed
+
+
+def summaries_for(session: Session, dossier_ids: Iterable[uuid.UUID]) -> dict[uuid.UUID, DossierSummary]:
+    """
+    Riepiloghi di una pagina di dossier con una query IN sulla chiave
+    primaria; quelli senza riga (dossier senza entry) sono calcolati al volo
+    senza scriverli
+    """
+    ids = list(dossier_ids)
+    if not ids:
+        return {}
+    rows = session.execute(select(DossierSummary).where(DossierSummary.dossier_id.in_(ids))).scalars()
+    summaries = {summary.dossier_id: summary for summary in rows}
+    missing = [dossier_id for dossier_id in ids if dossier_id not in summaries]
+    for computed in compute_summaries(session.connection(), missing):
+        summaries[computed["dossier_id"]] = DossierSummary(**computed)
+    return summaries
+
+
+def rebuild_dossier_summaries(session: Session, batch_size: int = 500) -> int:
+    """Ricostruisce dossier_summary per tutti i dossier (keyset sull'id, un commit per batch)"""
+    processed = 0
+    last_id = None
+    while True:
+        stmt = select(Dossier.id).order_by(Dossier.id).limit(batch_size)
+        if last_id is not None:
+            stmt = stmt.where(Dossier.id > last_id)
+        ids = session.execute(stmt).scalars().all()
+        if not ids:
+            break
+        refresh_dossier_summaries(session.connection(), ids)
+        session.commit()
+        processed += len(ids)
+        last_id = ids[-1]
+        logger.info(f"Riepiloghi dossier ricostruiti: {processed}")
+    return processed
@@ -1,58 +1,723 @@
 # app/utils/encryption.py
-from cryptography.fernet import Fernet
+from cryptography.fernet import Fernet, MultiFernet
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from collections import OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from time import perf_counter
+from typing import Any, Literal, Mapping, Protocol, Sequence
 import base64
+import hashlib
 import json
+import logging
 import os
+import threading
+import uuid
+import zlib
+
+logger = logging.getLogger(__name__)
+
+BatchExecutorKind = Literal["none", "thread", "process"]
+
+CompressionKind = Literal["none", "zlib"]
+
+# Fernet e dizionari del processo worker (usati solo dal process pool)
+_worker_fernet: Fernet | None = None
+_worker_dictionaries: Mapping[int, bytes] = {}
+
+
+# ---------------------------------------------------------------------------
+# Materiale di chiave (process-wide, caricato alla prima necessità)
+# ---------------------------------------------------------------------------
+# La derivazione PBKDF2 (solo dev, senza ENCRYPTION_KEY) costa ~100ms: non va
+# pagata all'import da alembic, pytest o backend_pre_start. Se l'app viene
+# precaricata nel master (gunicorn --preload) e la chiave è già caricata, i
+# worker forkati la ereditano senza ricalcolarla.
+_key_material: bytes | None = None
+_key_lock = threading.Lock()
+
+PBKDF2_ITERATIONS = 100000
+
+
+def _derive_key() -> bytes:
+    """Ottieni chiave da env o genera (NON fare in prod, usa un vault!)"""
+    key_str = os.getenv("ENCRYPTION_KEY")
+    if key_str:
+        return key_str.encode()
+
+    # SOLO PER DEV - In produzione usa un key management service
+    password = os.getenv("MASTER_PASSWORD", "change-me-in-production").encode()
+    salt = os.getenv("ENCRYPTION_SALT", "fixed-salt-change-me").encode()
+
+    kdf = PBKDF2HMAC(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=salt,
+        iterations=PBKDF2_ITERATIONS,
+    )
+    return base64.urlsafe_b64encode(kdf.derive(password))
+
+
+def get_key_material() -> bytes:
+    """Chiave Fernet del processo, derivata una sola volta"""
+    global _key_material
+    if _key_material is None:
+        with _key_lock:
+            if _key_material is None:
+                _key_material = _derive_key()
+    return _key_material
+
+
+def key_material_loaded() -> bool:
+    return _key_material is not None
+
+
+def _reset_key_lock_after_fork() -> None:
+    # Un lock preso da un altro thread al momento del fork resterebbe bloccato nel figlio
+    global _key_lock
+    _key_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_key_lock_after_fork)
+
+
+def _init_worker(key: bytes, dictionaries: Mapping[int, bytes]) -> None:
+    """Initializer dei processi worker: costruisce il Fernet una volta sola"""
+    global _worker_fernet, _worker_dictionaries
+    _worker_fernet = Fernet(key)
+    _worker_dictionaries = dictionaries
+
+
+# ---------------------------------------------------------------------------
+# Formato di storage dei payload
+# ---------------------------------------------------------------------------
+# Legacy (testo): base64(token Fernet), cioè un doppio base64 in colonna Text.
+# Binario (bytea): 1 byte di versione + token Fernet grezzo (base64url decodificato).
+# Envelope (bytea): 0x02 + id della chiave dati (16 byte) + token Fernet grezzo
+# cifrato con la chiave dati del dossier/paziente (vedi DataKeySource).
+# Il primo byte del legacy è sempre un carattere ASCII base64, quindi non
+# collide mai con i byte di versione (< 0x20).
+PAYLOAD_FORMAT_FERNET_RAW = 0x01
+PAYLOAD_FORMAT_ENVELOPE = 0x02
+PAYLOAD_FORMAT_CURRENT = PAYLOAD_FORMAT_FERNET_RAW
+_DATA_KEY_ID_SIZE = 16
+
+
+def is_binary_payload(value: bytes | str) -> bool:
+    """True se il valore è già nel formato binario versionato"""
+    return isinstance(value, (bytes, bytearray, memoryview)) and len(value) > 0 and value[0] < 0x20
+
+
+def legacy_to_binary(value: bytes | str) -> bytes:
+    """Converte un payload legacy (doppio base64) nel formato binario, senza decrittare"""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        value = bytes(value).decode('ascii')
+    token = base64.b64decode(value)
+    return bytes([PAYLOAD_FORMAT_FERNET_RAW]) + base64.urlsafe_b64decode(token)
+
+
+def _split_frame(value: bytes | str) -> tuple[bytes | None, bytes]:
+    """Estrae (id chiave dati o None, token Fernet base64url) da un payload binario o legacy"""
+    if is_binary_payload(value):
+        frame = bytes(value)
+        if frame[0] == PAYLOAD_FORMAT_FERNET_RAW:
+            return None, base64.urlsafe_b64encode(frame[1:])
+        if frame[0] == PAYLOAD_FORMAT_ENVELOPE:
+            key_end = 1 + _DATA_KEY_ID_SIZE
+            return frame[1:key_end], base64.urlsafe_b64encode(frame[key_end:])
+        raise ValueError(f"Unsupported payload format: {frame[0]}")
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return None, base64.b64decode(bytes(value))
+    return None, base64.b64decode(value.encode('utf-8'))
+
+
+def data_key_id_of(value: bytes | str | None) -> uuid.UUID | None:
+    """Id della chiave dati di un payload envelope (None per chiave globale/legacy)"""
+    if value and is_binary_payload(value) and value[0] == PAYLOAD_FORMAT_ENVELOPE:
+        return uuid.UUID(bytes=bytes(value[1:1 + _DATA_KEY_ID_SIZE]))
+    return None
+
+
+def _envelope_frame(key_id: bytes, token: bytes) -> bytes:
+    return bytes([PAYLOAD_FORMAT_ENVELOPE]) + key_id + base64.urlsafe_b64decode(token)
+
+
+# ---------------------------------------------------------------------------
+# Compressione (dentro il plaintext cifrato, quindi autenticata da Fernet)
+# ---------------------------------------------------------------------------
+# Plaintext non compresso: JSON, inizia sempre con '{' (0x7B).
+# Plaintext compresso: [codec 1 byte][dict_id 2 byte big-endian][deflate raw].
+# dict_id = 0 significa "nessun dizionario".
+CODEC_ZLIB = 0x01
+_COMPRESSION_HEADER_SIZE = 3
+
+
+class DictionarySource(Protocol):
+    """Sorgente dei dizionari di compressione (es. tabella payload_dictionary)"""
+
+    def all(self) -> list[tuple[int, str, bytes]]: ...
+
+    def get(self, dict_id: int) -> tuple[str, bytes] | None: ...
+
+
+def deflate_payload(raw: bytes, zdict: bytes | None, level: int) -> bytes:
+    if zdict:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15, zdict=zdict)
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return compressor.compress(raw) + compressor.flush()
+
+
+def inflate_payload(body: bytes, zdict: bytes | None) -> bytes:
+    if zdict:
+        decompressor = zlib.decompressobj(-15, zdict=zdict)
+    else:
+        decompressor = zlib.decompressobj(-15)
+    return decompressor.decompress(body) + decompressor.flush()
+
+
+def _parse_plaintext(plaintext: bytes, dictionaries: Mapping[int, bytes]) -> dict:
+    """Interpreta il plaintext decifrato: JSON diretto o frame compresso"""
+    if plaintext and plaintext[0] < 0x20:
+        codec = plaintext[0]
+        if codec != CODEC_ZLIB:
+            raise ValueError(f"Unsupported compression codec: {codec}")
+        dict_id = int.from_bytes(plaintext[1:_COMPRESSION_HEADER_SIZE], "big")
+        zdict = None
+        if dict_id:
+            zdict = dictionaries.get(dict_id)
+            if zdict is None:
+                raise LookupError(f"Compression dictionary {dict_id} not available")
+        plaintext = inflate_payload(plaintext[_COMPRESSION_HEADER_SIZE:], zdict)
+    return json.loads(plaintext.decode('utf-8'))
+
+
+def _decode_token(
+    fernet: Fernet,
+    value: bytes | str,
+    dictionaries: Mapping[int, bytes] | None = None,
+    data_keys: Mapping[bytes, Fernet] | None = None,
+) -> dict:
+    """Decodifica (formato binario o legacy) + Fernet + JSON di un singolo payload"""
+    key_id, token = _split_frame(value)
+    if key_id is not None:
+        fernet = (data_keys or {}).get(key_id)
+        if fernet is None:
+            raise LookupError(f"Data key {uuid.UUID(bytes=key_id)} not available")
+    decrypted = fernet.decrypt(token)
+    return _parse_plaintext(decrypted, dictionaries or {})
+
+
+def _decode_chunk(
+    fernet: Fernet | None,
+    chunk: Sequence[bytes | str],
+    dictionaries: Mapping[int, bytes] | None = None,
+    data_keys: Mapping[bytes, Fernet] | None = None,
+) -> list[dict | None]:
+    """Decodifica un blocco di payload; None per quelli non decifrabili"""
+    fernet = fernet or _worker_fernet
+    dictionaries = _worker_dictionaries if dictionaries is None else dictionaries
+    results: list[dict | None] = []
+    for encrypted_str in chunk:
+        try:
+            results.append(_decode_token(fernet, encrypted_str, dictionaries, data_keys))
+        except Exception:
+            results.append(None)
+    return results
+
+
+# ---------------------------------------------------------------------------
+# Envelope encryption
+# ---------------------------------------------------------------------------
+# Ogni dossier (e ogni paziente, per la tessera sanitaria) ha una propria
+# chiave dati (DEK) salvata cifrata ("wrapped") con la master key. Ruotare la
+# master key significa solo ri-cifrare le DEK nella tabella data_key
+# (MultiFernet.rotate), senza toccare i payload.
+# ENCRYPTION_MASTER_KEYS: chiavi Fernet separate da virgola, la prima è
+# quella attiva; le successive servono solo a leggere le DEK non ancora ruotate.
+# È obbligatoria per l'envelope e non può contenere la chiave globale
+# (ENCRYPTION_KEY), che cifra ancora i payload 0x01/legacy: con una chiave
+# sola per DEK e dati la rotazione non proteggerebbe nulla.
+DataKeyOwner = Literal["dossier", "patient"]
+
+# DEK in chiaro tenute in memoria (LRU): oltre, si rilegge e si ri-decifra
+ENCRYPTION_DATA_KEY_CACHE_SIZE = int(os.getenv("ENCRYPTION_DATA_KEY_CACHE_SIZE", "10000"))
+
+
+class DataKeySource(Protocol):
+    """
+    Archivio delle chiavi dati cifrate (es. tabella data_key). `connection`
+    è la connessione della transazione del chiamante; None = connessione propria.
+    """
+
+    def find(
+        self, owner_type: str, owner_id: uuid.UUID, connection: Any = None
+    ) -> tuple[uuid.UUID, bytes] | None: ...
+
+    def get_many(self, key_ids: Sequence[uuid.UUID], connection: Any = None) -> dict[uuid.UUID, bytes]: ...
+
+    def create(
+        self, owner_type: str, owner_id: uuid.UUID, wrapped_key: bytes, master_key_id: str, connection: Any = None
+    ) -> tuple[uuid.UUID, bytes]: ...
+
+
+class _LRUCache:
+    """Mappa limitata a `max_size` voci, scarta la meno usata di recente"""
+
+    def __init__(self, max_size: int):
+        self._max_size = max_size
+        self._items: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self, key):
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+            return value
+
+    def put(self, key, value) -> None:
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self._max_size:
+                self._items.popitem(last=False)
+
+
+def master_key_id(key: bytes) -> str:
+    """Impronta (non segreta) di una master key, salvata accanto a ogni DEK"""
+    return hashlib.sha256(key).hexdigest()[:16]
+
+
+def master_keys_configured() -> bool:
+    return bool(os.getenv("ENCRYPTION_MASTER_KEYS", "").strip(" ,"))
+
+
+def _load_master_keys() -> list[bytes]:
+    """Master key da ENCRYPTION_MASTER_KEYS (RuntimeError se assenti o uguali alla chiave globale)"""
+    configured = os.getenv("ENCRYPTION_MASTER_KEYS", "")
+    keys = [key.strip().encode() for key in configured.split(",") if key.strip()]
+    if not keys:
+        raise RuntimeError("ENCRYPTION_MASTER_KEYS non configurata: l'envelope encryption richiede master key proprie")
+    if get_key_material() in keys:
+        raise RuntimeError("ENCRYPTION_MASTER_KEYS non può contenere la chiave globale dei payload (ENCRYPTION_KEY)")
+    return keys
+
 
 class FieldEncryption:
-    def __init__(self):
-        # In produzione, carica da variabile d'ambiente o vault (es. HashiCorp Vault)
-        self._key = self._get_or_create_key()
-        self._fernet = Fernet(self._key)
-    
-    def _get_or_create_key(self) -> bytes:
-        """Ottieni chiave da env o genera (NON fare in prod, usa un vault!)"""
-        key_str = os.getenv("ENCRYPTION_KEY")
-        if key_str:
-            return key_str.encode()
-        
-        # SOLO PER DEV - In produzione usa un key management service
-        password = os.getenv("MASTER_PASSWORD", "change-me-in-production").encode()
-        salt = os.getenv("ENCRYPTION_SALT", "fixed-salt-change-me").encode()
-        
-        kdf = PBKDF2HMAC(
-            algorithm=hashes.SHA256(),
-            length=32,
-            salt=salt,
-            iterations=100000,
-        )
-        key = base64.urlsafe_b64encode(kdf.derive(password))
-        return key
-    
+    def __init__(
+        self,
+        batch_executor: BatchExecutorKind | None = None,
+        batch_threshold: int | None = None,
+        batch_workers: int | None = None,
+        compression: CompressionKind | None = None,
+    ):
+        # In produzione, carica da variabile d'ambiente o vault (es. HashiCorp Vault).
+        # La chiave viene caricata al primo uso (o da warm_up), non all'import
+        self._fernet_instance: Fernet | None = None
+
+        # Fan-out del decrypt batch: sotto la soglia si decodifica inline
+        self._batch_executor_kind: BatchExecutorKind = batch_executor or os.getenv("ENCRYPTION_BATCH_EXECUTOR", "none")  # type: ignore[assignment]
+        self._batch_threshold = batch_threshold or int(os.getenv("ENCRYPTION_BATCH_THRESHOLD", "64"))
+        self._batch_workers = batch_workers or int(os.getenv("ENCRYPTION_BATCH_WORKERS", str(min(4, os.cpu_count() or 1))))
+        self._executor: Executor | None = None
+        self._executor_lock = threading.Lock()
+
+        # Compressione prima della cifratura (opt-in), con dizionario per module_code
+        self._compression: CompressionKind = compression or os.getenv("ENCRYPTION_COMPRESSION", "none")  # type: ignore[assignment]
+        self._compression_level = int(os.getenv("ENCRYPTION_COMPRESSION_LEVEL", "6"))
+        self._compression_min_size = int(os.getenv("ENCRYPTION_COMPRESSION_MIN_SIZE", "128"))
+        self._dictionaries: dict[int, bytes] = {}
+        self._module_dictionaries: dict[str, int] = {}
+        self._dictionary_source: DictionarySource | None = None
+        self._dictionaries_loaded = False
+        self._dictionary_lock = threading.Lock()
+        # module_code -> [payload, byte JSON, byte compressi]
+        self._compression_stats: dict[str, list[int]] = {}
+        self._stats_lock = threading.Lock()
+
+        # Envelope encryption: attiva quando è collegato un archivio di DEK
+        self._master: MultiFernet | None = None
+        self._primary_master_key_id: str | None = None
+        self._data_key_source: DataKeySource | None = None
+        # id chiave (16 byte) -> DEK in chiaro; (owner_type, owner_id) -> id chiave
+        self._data_keys = _LRUCache(ENCRYPTION_DATA_KEY_CACHE_SIZE)
+        self._owner_keys = _LRUCache(ENCRYPTION_DATA_KEY_CACHE_SIZE)
+        self._data_key_lock = threading.Lock()
+
+    @property
+    def _key(self) -> bytes:
+        return get_key_material()
+
+    @property
+    def _fernet(self) -> Fernet:
+        if self._fernet_instance is None:
+            self._fernet_instance = Fernet(self._key)
+        return self._fernet_instance
+
+    def warm_up(self) -> dict[str, float]:
+        """
+        Carica chiave e dizionari prima della prima richiesta.
+        Ritorna la durata di ogni fase in millisecondi.
+        """
+        timings: dict[str, float] = {}
+        start = perf_counter()
+        self._fernet
+        timings["key_material_ms"] = round((perf_counter() - start) * 1000, 1)
+        if self._data_key_source is not None:
+            start = perf_counter()
+            self._master_fernet
+            timings["master_keys_ms"] = round((perf_counter() - start) * 1000, 1)
+        if self._compression != "none":
+            start = perf_counter()
+            self._ensure_dictionaries_loaded()
+            timings["dictionaries_ms"] = round((perf_counter() - start) * 1000, 1)
+        return timings
+
+    # ------------------------------------------------------------------
+    # Envelope encryption
+    # ------------------------------------------------------------------
+    @property
+    def _master_fernet(self) -> MultiFernet:
+        if self._master is None:
+            keys = _load_master_keys()
+            self._primary_master_key_id = master_key_id(keys[0])
+            self._master = MultiFernet([Fernet(key) for key in keys])
+        return self._master
+
+    @property
+    def primary_master_key_id(self) -> str:
+        self._master_fernet
+        return self._primary_master_key_id  # type: ignore[return-value]
+
+    def set_data_key_source(self, source: DataKeySource | None) -> None:
+        """
+        Collega l'archivio delle DEK: da qui in poi le scritture usano
+        l'envelope. Carica subito le master key, così una configurazione
+        mancante fa fallire l'avvio e non la prima scrittura.
+        """
+        if source is not None:
+            self._master_fernet
+        with self._data_key_lock:
+            self._data_key_source = source
+
+    @property
+    def envelope_enabled(self) -> bool:
+        return self._data_key_source is not None
+
+    def rewrap_key(self, wrapped_key: bytes) -> bytes:
+        """Ri-cifra una DEK con la master key attiva (la DEK in chiaro non cambia)"""
+        return self._master_fernet.rotate(wrapped_key)
+
+    def _unwrap(self, key_id: uuid.UUID, wrapped_key: bytes) -> Fernet:
+        fernet = Fernet(self._master_fernet.decrypt(wrapped_key))
+        self._data_keys.put(key_id.bytes, fernet)
+        return fernet
+
+    def _owner_data_key(
+        self, owner_type: DataKeyOwner, owner_id: uuid.UUID, connection: Any = None
+    ) -> tuple[bytes, Fernet]:
+        """
+        DEK del proprietario, creata alla prima scrittura nella transazione
+        del chiamante (`connection`): se questa fa rollback sparisce insieme
+        ai payload che cifrava
+        """
+        key_id = self._owner_keys.get((owner_type, owner_id))
+        fernet = self._data_keys.get(key_id) if key_id is not None else None
+        if fernet is not None:
+            return key_id, fernet
+
+        source = self._data_key_source
+        found = source.find(owner_type, owner_id, connection=connection)
+        created = found is None
+        if created:
+            wrapped = self._master_fernet.encrypt(Fernet.generate_key())
+            # In caso di corsa vince la DEK già salvata: create ritorna quella
+            found = source.create(
+                owner_type, owner_id, wrapped, self.primary_master_key_id, connection=connection
+            )
+        key_uuid, wrapped = found
+        fernet = self._unwrap(key_uuid, wrapped)
+        # Una DEK appena creata in una transazione non ancora confermata non
+        # va associata al proprietario: la richiesta successiva la ritrova con find
+        if not (created and connection is not None):
+            self._owner_keys.put((owner_type, owner_id), key_uuid.bytes)
+        return key_uuid.bytes, fernet
+
+    def _load_data_keys(self, key_ids: set[bytes], connection: Any = None) -> dict[bytes, Fernet]:
+        """DEK in chiaro per gli id richiesti (una sola query per quelli non in cache)"""
+        found = {key_id: self._data_keys.get(key_id) for key_id in key_ids}
+        missing = [uuid.UUID(bytes=key_id) for key_id, fernet in found.items() if fernet is None]
+        if missing and self._data_key_source is not None:
+            for key_uuid, wrapped in self._data_key_source.get_many(missing, connection=connection).items():
+                try:
+                    found[key_uuid.bytes] = self._unwrap(key_uuid, wrapped)
+                except Exception as e:
+                    logger.error(f"Data key {key_uuid} non decifrabile: {e}")
+        return {key_id: fernet for key_id, fernet in found.items() if fernet is not None}
+
+    def _fernet_for(self, key_id: bytes | None) -> Fernet:
+        if key_id is None:
+            return self._fernet
+        fernet = self._load_data_keys({key_id}).get(key_id)
+        if fernet is None:
+            raise LookupError(f"Data key {uuid.UUID(bytes=key_id)} not available")
+        return fernet
+
+    def _encrypt_for_owner(
+        self, plaintext: bytes, owner_type: DataKeyOwner, owner_id: uuid.UUID | None, connection: Any = None
+    ) -> bytes:
+        """Frame binario: envelope se c'è un proprietario e un archivio DEK, altrimenti chiave globale"""
+        if owner_id is not None and self._data_key_source is not None:
+            key_id, fernet = self._owner_data_key(owner_type, owner_id, connection)
+            return _envelope_frame(key_id, fernet.encrypt(plaintext))
+        token = self._fernet.encrypt(plaintext)
+        return bytes([PAYLOAD_FORMAT_CURRENT]) + base64.urlsafe_b64decode(token)
+
+    def to_envelope(
+        self, value: bytes | str, owner_type: DataKeyOwner, owner_id: uuid.UUID, connection: Any = None
+    ) -> bytes:
+        """
+        Ricifra un payload 0x01/legacy con la DEK del proprietario. Il
+        plaintext (compressione inclusa) non cambia; ValueError se è già envelope.
+        """
+        if not self.envelope_enabled:
+            raise RuntimeError("Nessun archivio DEK collegato: envelope non disponibile")
+        key_id, token = _split_frame(value)
+        if key_id is not None:
+            raise ValueError("Payload già in formato envelope")
+        return self._encrypt_for_owner(self._fernet.decrypt(token), owner_type, owner_id, connection)
+
+    def str_to_envelope(
+        self, encrypted_str: str, owner_type: DataKeyOwner, owner_id: uuid.UUID, connection: Any = None
+    ) -> str:
+        """Come to_envelope per le stringhe di encrypt_str (base64 di token Fernet o frame)"""
+        encrypted = base64.b64decode(encrypted_str.encode('utf-8'))
+        if is_binary_payload(encrypted):
+            raise ValueError("Valore già in formato envelope")
+        if not self.envelope_enabled:
+            raise RuntimeError("Nessun archivio DEK collegato: envelope non disponibile")
+        frame = self._encrypt_for_owner(self._fernet.decrypt(encrypted), owner_type, owner_id, connection)
+        return base64.b64encode(frame).decode('utf-8')
+
     def encrypt_dict(self, data: dict) -> str:
         """Critta un dizionario e ritorna base64 string"""
         json_str = json.dumps(data, ensure_ascii=False, default=str)
         encrypted = self._fernet.encrypt(json_str.encode('utf-8'))
         return base64.b64encode(encrypted).decode('utf-8')
-    
-    def decrypt_dict(self, encrypted_str: str) -> dict:
-        """Decritta una stringa base64 e ritorna dizionario"""
-        encrypted = base64.b64decode(encrypted_str.encode('utf-8'))
-        decrypted = self._fernet.decrypt(encrypted)
-        return json.loads(decrypted.decode('utf-8'))
-    
-    def encrypt_str(self, data: str) -> str:
-        """Critta una stringa e ritorna base64 string"""
-        encrypted = self._fernet.encrypt(data.encode('utf-8'))
+
+    def decrypt_dict(self, encrypted_str: bytes | str) -> dict:
+        """Decritta un payload (binario, envelope o stringa base64 legacy) e ritorna dizionario"""
+        key_id, token = _split_frame(encrypted_str)
+        decrypted = self._fernet_for(key_id).decrypt(token)
+        return self._parse_plaintext(decrypted)
+
+    def encrypt_payload(
+        self,
+        data: dict,
+        module_code: str | None = None,
+        dossier_id: uuid.UUID | None = None,
+        connection: Any = None,
+    ) -> bytes:
+        """
+        Critta un dizionario nel formato binario versionato (colonna bytea).
+        `connection`: transazione del chiamante in cui leggere/creare la DEK.
+        """
+        json_str = json.dumps(data, ensure_ascii=False, default=str)
+        plaintext = self._build_plaintext(json_str.encode('utf-8'), module_code)
+        return self._encrypt_for_owner(plaintext, "dossier", dossier_id, connection)
+
+    # ------------------------------------------------------------------
+    # Compressione
+    # ------------------------------------------------------------------
+    def _build_plaintext(self, raw: bytes, module_code: str | None) -> bytes:
+        if self._compression == "none" or len(raw) < self._compression_min_size:
+            return raw
+        dict_id = self._dictionary_for_module(module_code)
+        body = deflate_payload(raw, self._dictionaries.get(dict_id), self._compression_level)
+        plaintext = bytes([CODEC_ZLIB]) + dict_id.to_bytes(2, "big") + body
+        if len(plaintext) >= len(raw):
+            plaintext = raw
+        self._record_compression(module_code or "-", len(raw), len(plaintext))
+        return plaintext
+
+    def _parse_plaintext(self, plaintext: bytes) -> dict:
+        try:
+            return _parse_plaintext(plaintext, self._dictionaries)
+        except LookupError:
+            # Dizionario creato da un altro processo dopo il nostro caricamento
+            dict_id = int.from_bytes(plaintext[1:_COMPRESSION_HEADER_SIZE], "big")
+            self._load_dictionary(dict_id)
+            return _parse_plaintext(plaintext, self._dictionaries)
+
+    def set_dictionary_source(self, source: DictionarySource | None) -> None:
+        """Collega la sorgente persistente dei dizionari (caricata alla prima necessità)"""
+        with self._dictionary_lock:
+            self._dictionary_source = source
+            self._dictionaries_loaded = False
+
+    def register_dictionary(self, dict_id: int, module_code: str, dictionary: bytes) -> None:
+        """Registra un dizionario; il più recente (id più alto) è usato per le nuove scritture"""
+        if not 0 < dict_id < 2 ** 16:
+            raise ValueError("dict_id must fit in 2 bytes and be > 0")
+        self._dictionaries[dict_id] = dictionary
+        if dict_id > self._module_dictionaries.get(module_code, 0):
+            self._module_dictionaries[module_code] = dict_id
+
+    def _dictionary_for_module(self, module_code: str | None) -> int:
+        self._ensure_dictionaries_loaded()
+        return self._module_dictionaries.get(module_code, 0) if module_code else 0
+
+    def _ensure_dictionaries_loaded(self) -> None:
+        if self._dictionaries_loaded or self._dictionary_source is None:
+            return
+        with self._dictionary_lock:
+            if self._dictionaries_loaded:
+                return
+            try:
+                for dict_id, module_code, dictionary in self._dictionary_source.all():
+                    self.register_dictionary(dict_id, module_code, dictionary)
+            except Exception as e:
+                logger.warning(f"Compression dictionaries not loaded: {e}")
+            self._dictionaries_loaded = True
+
+    def _load_dictionary(self, dict_id: int) -> None:
+        if self._dictionary_source is None:
+            return
+        found = self._dictionary_source.get(dict_id)
+        if found:
+            self.register_dictionary(dict_id, *found)
+
+    def _record_compression(self, module_code: str, raw_size: int, stored_size: int) -> None:
+        with self._stats_lock:
+            stats = self._compression_stats.setdefault(module_code, [0, 0, 0])
+            stats[0] += 1
+            stats[1] += raw_size
+            stats[2] += stored_size
+
+    def compression_stats(self) -> list[dict]:
+        """Rapporto di compressione per modulo (scritture di questo processo)"""
+        with self._stats_lock:
+            return [
+                {
+                    "module_code": module_code,
+                    "payloads": count,
+                    "raw_bytes": raw_size,
+                    "stored_bytes": stored_size,
+                    "ratio": round(stored_size / raw_size, 3) if raw_size else None,
+                    "dictionary_id": self._module_dictionaries.get(module_code),
+                }
+                for module_code, (count, raw_size, stored_size) in sorted(self._compression_stats.items())
+            ]
+
+    def decrypt_dicts(self, encrypted_strs: Sequence[bytes | str | None]) -> list[dict | None]:
+        """
+        Decritta in un solo passaggio una pagina di payload.
+
+        Ritorna una lista allineata all'input: None per i valori vuoti o
+        non decifrabili (il chiamante decide il fallback). Ogni token
+        distinto viene decodificato una sola volta; sopra la soglia
+        configurata il lavoro viene distribuito sul pool di worker.
+        """
+        unique: dict[bytes | str, int] = {}
+        for encrypted_str in encrypted_strs:
+            if encrypted_str and encrypted_str not in unique:
+                unique[encrypted_str] = len(unique)
+        tokens = list(unique)
+
+        # Le DEK necessarie alla pagina vengono caricate insieme, prima del fan-out
+        key_ids = {key_id.bytes for key_id in map(data_key_id_of, tokens) if key_id is not None}
+        data_keys = self._load_data_keys(key_ids) if key_ids else {}
+
+        decoded = self._decode_many(tokens, data_keys)
+
+        # Ritenta inline gli errori (es. dizionario non ancora noto al worker)
+        for index, value in enumerate(decoded):
+            if value is None:
+                try:
+                    decoded[index] = self.decrypt_dict(tokens[index])
+                except Exception:
+                    pass
+
+        failed = sum(1 for value in decoded if value is None)
+        if failed:
+            logger.warning(f"Batch decryption: {failed}/{len(tokens)} payload non decifrabili")
+
+        return [
+            decoded[unique[encrypted_str]] if encrypted_str else None
+            for encrypted_str in encrypted_strs
+        ]
+
+    def _decode_many(self, tokens: list[bytes | str], data_keys: Mapping[bytes, Fernet]) -> list[dict | None]:
+        executor = self._get_executor() if len(tokens) >= self._batch_threshold else None
+        if executor is None:
+            return _decode_chunk(self._fernet, tokens, self._dictionaries, data_keys)
+
+        # Un blocco per worker: limita l'overhead di serializzazione verso i processi
+        size = -(-len(tokens) // self._batch_workers)
+        chunks = [tokens[i:i + size] for i in range(0, len(tokens), size)]
+        # Il process pool usa il Fernet creato dall'initializer del worker
+        if self._batch_executor_kind == "process":
+            fernet, dictionaries = None, None
+        else:
+            fernet, dictionaries = self._fernet, self._dictionaries
+        results: list[dict | None] = []
+        repeat = len(chunks)
+        for part in executor.map(_decode_chunk, [fernet] * repeat, chunks, [dictionaries] * repeat, [data_keys] * repeat):
+            results.extend(part)
+        return results
+
+    def _get_executor(self) -> Executor | None:
+        if self._batch_executor_kind == "none":
+            return None
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    if self._batch_executor_kind == "process":
+                        self._executor = ProcessPoolExecutor(
+                            max_workers=self._batch_workers,
+                            initializer=_init_worker,
+                            initargs=(self._key, dict(self._dictionaries)),
+                        )
+                    else:
+                        self._executor = ThreadPoolExecutor(
+                            max_workers=self._batch_workers,
+                            thread_name_prefix="decrypt",
+                        )
+        return self._executor
+
+    def shutdown(self) -> None:
+        """Chiude il pool di worker del decrypt batch (se creato)"""
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+
+    def encrypt_str(
+        self,
+        data: str,
+        owner_type: DataKeyOwner = "patient",
+        owner_id: uuid.UUID | None = None,
+        connection: Any = None,
+    ) -> str:
+        """Critta una stringa e ritorna base64 string (envelope se è indicato il proprietario)"""
+        if owner_id is not None and self._data_key_source is not None:
+            encrypted = self._encrypt_for_owner(data.encode('utf-8'), owner_type, owner_id, connection)
+        else:
+            encrypted = self._fernet.encrypt(data.encode('utf-8'))
         return base64.b64encode(encrypted).decode('utf-8')
-    
+
     def decrypt_str(self, encrypted_str: str) -> str:
         """Decritta una stringa base64 e ritorna dizionario"""
         encrypted = base64.b64decode(encrypted_str.encode('utf-8'))
-        decrypted = self._fernet.decrypt(encrypted)
+        # Un token Fernet inizia con 'g' (base64url), un frame envelope con 0x02
+        key_id, token = _split_frame(encrypted) if is_binary_payload(encrypted) else (None, encrypted)
+        decrypted = self._fernet_for(key_id).decrypt(token)
         return decrypted.decode('utf-8')
 
 # Singleton
-field_encryption = FieldEncryption()
\ No newline at end of file
+field_encryption = FieldEncryption()
@@ -0,0 +1,240 @@
+# app/services/key_store.py
+"""
+Archivio delle chiavi dati (envelope encryption) e job di rotazione della
+master key.
+
+La rotazione ri-cifra solo le DEK nella tabella data_key: i payload di
+module_entry restano invariati perché le DEK in chiaro non cambiano.
+Il job è riprendibile (seleziona le righe con master_key_id diverso da
+quello attivo) e può girare con più worker in parallelo: ogni batch blocca
+le proprie righe con FOR UPDATE SKIP LOCKED.
+"""
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from time import monotonic, sleep
+from typing import Callable, Iterator, Sequence
+import logging
+import threading
+import uuid
+
+from sqlalchemy import Connection, Engine, and_, func, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from app.core.config import settings
+from app.models import DataKey
+from app.services.encryption import field_encryption, master_keys_configured
+
+logger = logging.getLogger(__name__)
+
+_table = DataKey.__table__
+_c = _table.c
+
+
+class DataKeyStore:
+    """
+    Sorgente delle DEK su tabella data_key (usata da FieldEncryption).
+
+    Con `connection` lettura e creazione avvengono nella transazione del
+    chiamante: una DEK creata da una richiesta che fa rollback sparisce con
+    i payload che cifrava. Due creazioni concorrenti per lo stesso
+    proprietario si serializzano sul vincolo univoco e ritornano la stessa DEK.
+    """
+
+    def __init__(self, engine: Engine):
+        self._engine = engine
+
+    @contextmanager
+    def _connect(self, connection: Connection | None, write: bool = False) -> Iterator[Connection]:
+        if connection is not None:
+            yield connection
+        else:
+            with (self._engine.begin() if write else self._engine.connect()) as conn:
+                yield conn
+
+    def find(
+        self, owner_type: str, owner_id: uuid.UUID, connection: Connection | None = None
+    ) -> tuple[uuid.UUID, bytes] | None:
+        with self._connect(connection) as conn:
+            row = conn.execute(
+                select(_c.id, _c.wrapped_key)
+                .where(_c.owner_type == owner_type, _c.owner_id == owner_id)
+            ).first()
+            return (row.id, bytes(row.wrapped_key)) if row else None
+
+    def get_many(
+        self, key_ids: Sequence[uuid.UUID], connection: Connection | None = None
+    ) -> dict[uuid.UUID, bytes]:
+        with self._connect(connection) as conn:
+            rows = conn.execute(select(_c.id, _c.wrapped_key).where(_c.id.in_(key_ids))).all()
+            return {row.id: bytes(row.wrapped_key) for row in rows}
+
+    def create(
+        self,
+        owner_type: str,
+        owner_id: uuid.UUID,
+        wrapped_key: bytes,
+        master_key_id: str,
+        connection: Connection | None = None,
+    ) -> tuple[uuid.UUID, bytes]:
+        with self._connect(connection, write=True) as conn:
+            insert = pg_insert if conn.dialect.name == "postgresql" else sqlite_insert
+            conn.execute(
+                insert(_table)
+                .values(
+                    id=uuid.uuid4(),
+                    owner_type=owner_type,
+                    owner_id=owner_id,
+                    wrapped_key=wrapped_key,
+                    master_key_id=master_key_id,
+                    created_at=datetime.now(timezone.utc),
+                )
+                .on_conflict_do_nothing(index_elements=[_c.owner_type, _c.owner_id])
+            )
+            row = conn.execute(
+                select(_c.id, _c.wrapped_key)
+                .where(_c.owner_type == owner_type, _c.owner_id == owner_id)
+            ).one()
+            return row.id, bytes(row.wrapped_key)
+
+
+def configure_data_keys(engine: Engine) -> bool:
+    """
+    Collega DataKeyStore a field_encryption. Fuori da local l'envelope è
+    obbligatorio (senza ENCRYPTION_MASTER_KEYS l'avvio fallisce); in local,
+    senza master key, le scritture restano sulla chiave globale.
+    """
+    if settings.ENVIRONMENT == "local" and not master_keys_configured():
+        logger.warning("ENCRYPTION_MASTER_KEYS non configurata: envelope encryption disattivata")
+        return False
+    field_encryption.set_data_key_source(DataKeyStore(engine))
+    return True
+
+
+@dataclass
+class RewrapProgress:
+    total: int
+    rewrapped: int = 0
+    failed: int = 0
+    started_at: float = field(default_factory=monotonic)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    @property
+    def processed(self) -> int:
+        return self.rewrapped + self.failed
+
+    @property
+    def percent(self) -> float:
+        return 100.0 if not self.total else min(100.0, self.processed * 100 / self.total)
+
+    def add(self, rewrapped: int, failed: int) -> None:
+        with self._lock:
+            self.rewrapped += rewrapped
+            self.failed += failed
+
+    def as_dict(self) -> dict:
+        return {
+            "total": self.total,
+            "rewrapped": self.rewrapped,
+            "failed": self.failed,
+            "percent": round(self.percent, 1),
+            "elapsed_s": round(monotonic() - self.started_at, 1),
+        }
+
+
+def count_pending_data_keys(engine: Engine, primary_key_id: str) -> int:
+    with engine.connect() as conn:
+        return conn.execute(
+            select(func.count()).select_from(_table).where(_c.master_key_id != primary_key_id)
+        ).scalar_one()
+
+
+def _rewrap_worker(
+    engine: Engine,
+    primary_key_id: str,
+    batch_size: int,
+    pause_s: float,
+    progress: RewrapProgress,
+    on_progress: Callable[[RewrapProgress], None] | None,
+) -> None:
+    last_id: uuid.UUID | None = None
+    while True:
+        stmt = (
+            select(_c.id, _c.wrapped_key)
+            .where(_c.master_key_id != primary_key_id)
+            .order_by(_c.id)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+        )
+        if last_id is not None:
+            stmt = stmt.where(_c.id > last_id)
+
+        rewrapped = failed = 0
+        with engine.begin() as conn:
+            rows = conn.execute(stmt).all()
+            if not rows:
+                break
+
+            now = datetime.now(timezone.utc)
+            for key_id, wrapped_key in rows:
+                try:
+                    new_wrapped = field_encryption.rewrap_key(bytes(wrapped_key))
+                except Exception as e:
+                    # Nessuna master key configurata la decifra: resta da ruotare
+                    failed += 1
+                    logger.error(f"Data key {key_id} non ruotabile: {e}")
+                    continue
+                conn.execute(
+                    update(_table)
+                    .where(and_(_c.id == key_id, _c.master_key_id != primary_key_id))
+                    .values(wrapped_key=new_wrapped, master_key_id=primary_key_id, rotated_at=now)
+                )
+                rewrapped += 1
+
+        last_id = rows[-1][0]
+        progress.add(rewrapped, failed)
+        logger.info(f"Rotazione data key: {progress.as_dict()}")
+        if on_progress:
+            on_progress(progress)
+        if pause_s:
+            sleep(pause_s)
+
+
+def rewrap_data_keys(
+    engine: Engine,
+    batch_size: int = 500,
+    workers: int = 1,
+    pause_s: float = 0.0,
+    on_progress: Callable[[RewrapProgress], None] | None = None,
+) -> RewrapProgress:
+    """
+    Ri-cifra con la master key attiva tutte le DEK cifrate con una master key
+    precedente (ENCRYPTION_MASTER_KEYS deve contenere anche le vecchie chiavi).
+
+    Ogni worker scorre la tabella in keyset sull'id, un batch per transazione;
+    le righe già bloccate da un altro worker vengono saltate. Interrotto e
+    rilanciato, riprende dalle DEK non ancora ruotate.
+    """
+    primary_key_id = field_encryption.primary_master_key_id
+    progress = RewrapProgress(total=count_pending_data_keys(engine, primary_key_id))
+    logger.info(f"Data key da ruotare verso {primary_key_id}: {progress.total}")
+
+    errors: list[BaseException] = []
+
+    def run() -> None:
+        try:
+            _rewrap_worker(engine, primary_key_id, batch_size, pause_s, progress, on_progress)
+        except BaseException as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, name=f"rewrap-{i}") for i in range(max(1, workers))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # I batch già confermati restano ruotati: rilanciando si riprende da lì
+    if errors:
+        raise errors[0]
+
+    return progress
@@ -0,0 +1,124 @@
+# app/services/lifecycle.py
+"""
+Cascate di soft delete e ripristino eseguite in SQL, una UPDATE ... RETURNING
+per cascata, invece di caricare e modificare un oggetto ORM per riga.
+
+Gli eventi di audit delle righe toccate (UPDATE, con i valori precedenti
+delle colonne modificate e la riga aggiornata) sono scritti con un solo
+INSERT; dossier_summary è ricalcolato per i dossier le cui entry cambiano.
+Le istanze già presenti nella sessione non vengono sincronizzate: le rotte
+caricano solo il dossier o il paziente padre.
+
+Su PostgreSQL i valori precedenti arrivano dalla stessa UPDATE (auto-join
+con la sotto-select in FROM); sugli altri dialetti da una select preliminare.
+"""
+from datetime import datetime, timezone
+from typing import Any
+import uuid
+
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+
+from app.models import Dossier, ModuleEntry
+from app.services.audit import get_audit_context, write_audit_events
+from app.services.audit_serializers import REDACTED_COLUMNS, serializer_for
+from app.services.audit_writer import audit_row
+from app.services.dossier_summary import refresh_dossier_summaries
+
+
+def _bulk_update(session: Session, model: type, conditions: list, values: dict[str, Any]) -> list:
+    """UPDATE in blocco; righe aggiornate (senza colonne redatte) con i valori precedenti in old_<colonna>"""
+    table = model.__table__
+    conn = session.connection()
+    returned = [column for column in table.c if column.name not in REDACTED_COLUMNS]
+    old = select(table.c.id, *(table.c[name] for name in values)).where(*conditions)
+
+    if conn.dialect.name == "postgresql":
+        previous = old.with_for_update().subquery("previous")
+        stmt = (
+            update(table)
+            .where(table.c.id == previous.c.id)
+            .values(**values)
+            .returning(*returned, *(previous.c[name].label(f"old_{name}") for name in values))
+        )
+        return conn.execute(stmt).all()
+
+    previous = {row.id: row for row in conn.execute(old.with_for_update())}
+    if not previous:
+        return []
+    rows = conn.execute(
+        update(table).where(table.c.id.in_(previous)).values(**values).returning(*returned)
+    ).all()
+    return [
+        {**row._mapping, **{f"old_{name}": previous[row.id]._mapping[name] for name in values}}
+        for row in rows
+    ]
+
+
+def _audit_updates(session: Session, model: type, rows: list, columns) -> None:
+    context = get_audit_context()
+    if not context or not rows:
+        return
+    serializer = serializer_for(model)
+    converters = {name: convert for _, name, convert in serializer.fields}
+    events = []
+    for row in rows:
+        mapping = row if isinstance(row, dict) else row._mapping
+        before = {
+            name: converters[name](mapping[f"old_{name}"])
+            for name in columns
+            if mapping[f"old_{name}"] != mapping[name]
+        }
+        events.append(audit_row(
+            "UPDATE", model.__tablename__, mapping["id"], context,
+            before=before or None, after=serializer.serialize_row(mapping),
+        ))
+    write_audit_events(session, events)
+
+
+def _ids(rows: list) -> list[uuid.UUID]:
+    return [row["id"] if isinstance(row, dict) else row.id for row in rows]
+
+
+def soft_delete_dossier_entries(
+    session: Session, dossier_id: uuid.UUID, user_id: uuid.UUID, now: datetime | None = None
+) -> list[uuid.UUID]:
+    """Soft delete delle entry non eliminate del dossier; ritorna gli id toccati"""
+    values = {"deleted_at": now or datetime.now(timezone.utc), "deleted_by_user_id": user_id}
+    rows = _bulk_update(
+        session, ModuleEntry,
+        [ModuleEntry.dossier_id == dossier_id, ModuleEntry.deleted_at.is_(None)],
+        values,
+    )
+    _audit_updates(session, ModuleEntry, rows, values)
+    if rows:
+        refresh_dossier_summaries(session.connection(), [dossier_id])
+    return _ids(rows)
+
+
+def restore_dossier_entries(session: Session, dossier_id: uuid.UUID) -> list[uuid.UUID]:
+    """Ripristino delle entry soft-deleted del dossier; ritorna gli id toccati"""
+    values = {"deleted_at": None, "deleted_by_user_id": None}
+    rows = _bulk_update(
+        session, ModuleEntry,
+        [ModuleEntry.dossier_id == dossier_id, ModuleEntry.deleted_at.is_not(None)],
+        values,
+    )
+    _audit_updates(session, ModuleEntry, rows, values)
+    if rows:
+        refresh_dossier_summaries(session.connection(), [dossier_id])
+    return _ids(rows)
+
+
+def soft_delete_patient_dossiers(
+    session: Session, patient_id: uuid.UUID, user_id: uuid.UUID, now: datetime | None = None
+) -> list[uuid.UUID]:
+    """Soft delete dei dossier non eliminati del paziente; ritorna gli id toccati"""
+    values = {"deleted_at": now or datetime.now(timezone.utc), "deleted_by_user_id": user_id}
+    rows = _bulk_update(
+        session, Dossier,
+        [Dossier.patient_id == patient_id, Dossier.deleted_at.is_(None)],
+        values,
+    )
+    _audit_updates(session, Dossier, rows, values)
+    return _ids(rows)
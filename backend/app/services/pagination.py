@@ -0,0 +1,244 @@
+# app/services/pagination.py
+"""
+Paginazione delle liste: modalità a pagine (OFFSET, per i client esistenti)
+e modalità keyset con cursore opaco.
+
+Il cursore codifica i valori delle colonne di ordinamento dell'ultima riga
+restituita; la pagina successiva riparte con un confronto di tupla
+(occurred_at, id) < (:v1, :v2), che usa l'indice invece di scorrere e
+scartare le righe precedenti come fa OFFSET.
+
+Il totale ha una strategia esplicita (CountStrategy): esatto, esatto in
+cache per pochi secondi, stima del planner oppure nessun totale.
+"""
+from dataclasses import dataclass
+from datetime import date, datetime
+from time import monotonic
+from typing import Any, Literal, Sequence
+import base64
+import json
+import logging
+import os
+import threading
+import uuid
+
+from fastapi import HTTPException
+from sqlalchemy import Date, DateTime, Uuid, func, tuple_
+from sqlalchemy.orm import InstrumentedAttribute
+from sqlmodel import Session, select
+
+logger = logging.getLogger(__name__)
+
+Direction = Literal["asc", "desc"]
+
+# exact: count(*) sulla query filtrata
+# cached: come exact, riusato per COUNT_CACHE_TTL secondi a parità di filtri
+# estimate: righe stimate dal planner (EXPLAIN), nessuna scansione
+# none: nessun totale (has_next basta per lo scroll)
+CountStrategy = Literal["exact", "cached", "estimate", "none"]
+
+COUNT_CACHE_TTL = float(os.getenv("COUNT_CACHE_TTL", "30"))
+COUNT_CACHE_MAX_SIZE = 1024
+
+
+@dataclass
+class Page:
+    items: list
+    total: int | None
+    has_next: bool
+    next_cursor: str | None
+    total_estimated: bool = False
+
+
+def _encode_value(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    return value
+
+
+def _decode_value(column: InstrumentedAttribute, raw: Any) -> Any:
+    column_type = column.type
+    if isinstance(column_type, DateTime):
+        return datetime.fromisoformat(raw)
+    if isinstance(column_type, Date):
+        return date.fromisoformat(raw)
+    if isinstance(column_type, Uuid):
+        return uuid.UUID(raw)
+    return raw
+
+
+def encode_cursor(columns: Sequence[InstrumentedAttribute], item: Any) -> str:
+    payload = {
+        "k": [column.key for column in columns],
+        "v": [_encode_value(getattr(item, column.key)) for column in columns],
+    }
+    raw = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(columns: Sequence[InstrumentedAttribute], cursor: str) -> tuple:
+    """Valori dell'ultima riga vista; 400 se il cursore è malformato o di un'altra lista"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        if payload["k"] != [column.key for column in columns]:
+            raise ValueError("cursor ordering mismatch")
+        return tuple(_decode_value(column, raw) for column, raw in zip(columns, payload["v"], strict=True))
+    except Exception:
+        raise HTTPException(400, "Invalid cursor")
+
+
+def count_total(session: Session, stmt) -> int:
+    """Conteggio esatto delle righe della query filtrata"""
+    return session.exec(select(func.count()).select_from(stmt.order_by(None).subquery())).one()
+
+
+class CountCache:
+    """Cache TTL dei conteggi esatti, con chiave sulla query compilata (SQL + parametri)"""
+
+    def __init__(self, ttl: float = COUNT_CACHE_TTL, max_size: int = COUNT_CACHE_MAX_SIZE):
+        self._ttl = ttl
+        self._max_size = max_size
+        self._entries: dict[str, tuple[float, int]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(session: Session, stmt) -> str:
+        # I filtri (struttura dell'utente compresa) sono tutti nella WHERE:
+        # SQL + parametri ordinati identificano il conteggio
+        compiled = stmt.order_by(None).compile(dialect=session.get_bind().dialect)
+        params = sorted((name, repr(value)) for name, value in compiled.params.items())
+        return f"{compiled}|{params}"
+
+    def get(self, key: str) -> int | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, total = entry
+            if expires_at < monotonic():
+                del self._entries[key]
+                return None
+            return total
+
+    def set(self, key: str, total: int) -> None:
+        with self._lock:
+            if len(self._entries) >= self._max_size:
+                now = monotonic()
+                self._entries = {k: v for k, v in self._entries.items() if v[0] >= now}
+                if len(self._entries) >= self._max_size:
+                    self._entries.pop(next(iter(self._entries)))
+            self._entries[key] = (monotonic() + self._ttl, total)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+count_cache = CountCache()
+
+
+def count_cached(session: Session, stmt) -> int:
+    key = CountCache.key(session, stmt)
+    total = count_cache.get(key)
+    if total is None:
+        total = count_total(session, stmt)
+        count_cache.set(key, total)
+    return total
+
+
+def count_estimate(session: Session, stmt) -> int | None:
+    """Righe stimate dal planner Postgres per la query filtrata (None se non disponibile)"""
+    bind = session.get_bind()
+    if bind.dialect.name != "postgresql":
+        return None
+    compiled = stmt.order_by(None).compile(dialect=bind.dialect, compile_kwargs={"render_postcompile": True})
+    try:
+        plan = session.connection().exec_driver_sql(f"EXPLAIN (FORMAT JSON) {compiled}", compiled.params).scalar()
+    except Exception as e:
+        logger.warning(f"Stima del conteggio non disponibile: {e}")
+        return None
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+def resolve_total(session: Session, stmt, strategy: CountStrategy) -> tuple[int | None, bool]:
+    """(totale, stimato) secondo la strategia; la stima ricade sul conteggio esatto se non disponibile"""
+    if strategy == "none":
+        return None, False
+    if strategy == "estimate":
+        estimate = count_estimate(session, stmt)
+        if estimate is not None:
+            return estimate, True
+        return count_total(session, stmt), False
+    if strategy == "cached":
+        return count_cached(session, stmt), False
+    return count_total(session, stmt), False
+
+
+def paginate(
+    session: Session,
+    stmt,
+    order_by: Sequence[InstrumentedAttribute],
+    *,
+    direction: Direction = "desc",
+    page: int = 1,
+    page_size: int = 50,
+    cursor: str | None = None,
+    with_total: bool | None = None,
+    count: CountStrategy | None = None,
+) -> Page:
+    """
+    Esegue una pagina della query.
+
+    - `cursor` presente (anche vuoto, per la prima pagina): modalità keyset,
+      `page` viene ignorato e il totale è calcolato solo se `with_total`.
+    - altrimenti modalità a pagine con OFFSET; il totale è calcolato salvo
+      `with_total=False`.
+    - `count` sceglie come calcolare il totale (vedi CountStrategy) e ha
+      precedenza su `with_total`.
+
+    `order_by` deve terminare con una colonna univoca (id) perché il cursore
+    identifichi una posizione stabile. `has_next` si ottiene leggendo una
+    riga in più, senza bisogno del totale.
+    """
+    keyset = cursor is not None
+    if count is None:
+        if with_total is None:
+            with_total = not keyset
+        count = "exact" if with_total else "none"
+    total, total_estimated = resolve_total(session, stmt, count)
+
+    if direction == "desc":
+        ordered = stmt.order_by(*(column.desc() for column in order_by))
+    else:
+        ordered = stmt.order_by(*(column.asc() for column in order_by))
+
+    if keyset:
+        if cursor:
+            last_values = decode_cursor(order_by, cursor)
+            row = tuple_(*order_by)
+            ordered = ordered.where(row < tuple_(*last_values) if direction == "desc" else row > tuple_(*last_values))
+    else:
+        ordered = ordered.offset((page - 1) * page_size)
+
+    rows = list(session.exec(ordered.limit(page_size + 1)).all())
+    has_next = len(rows) > page_size
+    items = rows[:page_size]
+    next_cursor = encode_cursor(order_by, items[-1]) if has_next and items else None
+
+    # Stima del planner non coerente con la pagina letta: correggi il minimo noto
+    if total_estimated and not keyset:
+        seen = (page - 1) * page_size + len(items) + (1 if has_next else 0)
+        total = max(total, seen)
+
+    return Page(
+        items=items,
+        total=total,
+        has_next=has_next,
+        next_cursor=next_cursor,
+        total_estimated=total_estimated,
+    )
@@ -0,0 +1,167 @@
+# app/services/password_hasher.py
+"""
+Hash e verifica bcrypt fuori dai thread delle richieste.
+
+Il lavoro bcrypt (~250 ms a costo 12) gira in un pool dedicato (processi
+per default, BCRYPT_EXECUTOR). Le operazioni in corso o in coda nel pool
+sono al massimo BCRYPT_MAX_PENDING: oltre, la richiesta è respinta subito
+con 503. Lo slot si libera quando il lavoro nel pool finisce davvero, non
+quando il chiamante smette di aspettare: dopo un timeout il task continua
+a occupare il pool e resta contato.
+
+averify()/ahash() attendono il pool dall'event loop (il login è una rotta
+async). verify()/hash() restano per i percorsi sync e bloccano un thread
+del limiter AnyIO (ANYIO_THREAD_TOKENS, 40 per default) per tutta
+l'attesa: per questo BCRYPT_MAX_PENDING è limitato a metà dei token, così
+un picco di operazioni bcrypt lascia thread liberi alle altre rotte.
+
+needs_rehash() confronta il costo di un hash con BCRYPT_ROUNDS: il login
+riscrive l'hash quando il costo configurato cambia.
+"""
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Literal
+import asyncio
+import os
+import threading
+
+import bcrypt
+from fastapi import HTTPException, status
+from fastapi.concurrency import run_in_threadpool
+
+HasherExecutorKind = Literal["none", "thread", "process"]
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+BCRYPT_EXECUTOR: HasherExecutorKind = os.getenv("BCRYPT_EXECUTOR", "process")  # type: ignore[assignment]
+BCRYPT_WORKERS = int(os.getenv("BCRYPT_WORKERS", str(os.cpu_count() or 1)))
+# Token del CapacityLimiter di default di AnyIO (threadpool delle rotte sync)
+ANYIO_THREAD_TOKENS = int(os.getenv("ANYIO_THREAD_TOKENS", "40"))
+MAX_PENDING_LIMIT = max(1, ANYIO_THREAD_TOKENS // 2)
+BCRYPT_MAX_PENDING = min(
+    int(os.getenv("BCRYPT_MAX_PENDING", str(BCRYPT_WORKERS * 4))), MAX_PENDING_LIMIT
+)
+BCRYPT_TIMEOUT = float(os.getenv("BCRYPT_TIMEOUT", "10"))
+
+
+def _hashpw(password: bytes, rounds: int) -> bytes:
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+
+
+def _checkpw(password: bytes, hashed: bytes) -> bool:
+    return bcrypt.checkpw(password, hashed)
+
+
+def hash_rounds(hashed: str) -> int | None:
+    """Costo di un hash "$2b$12$..." (None se il formato non è bcrypt)"""
+    parts = hashed.split("$")
+    if len(parts) < 4 or not parts[2].isdigit():
+        return None
+    return int(parts[2])
+
+
+class PasswordHasher:
+    def __init__(
+        self,
+        executor: HasherExecutorKind = BCRYPT_EXECUTOR,
+        workers: int = BCRYPT_WORKERS,
+        max_pending: int = BCRYPT_MAX_PENDING,
+        rounds: int = BCRYPT_ROUNDS,
+        timeout: float = BCRYPT_TIMEOUT,
+    ):
+        self.rounds = rounds
+        self._executor_kind = executor
+        self._workers = workers
+        self._timeout = timeout
+        self.max_pending = max(1, min(max_pending, MAX_PENDING_LIMIT))
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._executor: Executor | None = None
+        self._executor_lock = threading.Lock()
+
+    def hash(self, password: str) -> str:
+        return self._run(_hashpw, password.encode("utf-8"), self.rounds).decode("utf-8")
+
+    def verify(self, password: str, hashed: str) -> bool:
+        return self._run(_checkpw, password.encode("utf-8"), hashed.encode("utf-8"))
+
+    async def ahash(self, password: str) -> str:
+        return (await self._arun(_hashpw, password.encode("utf-8"), self.rounds)).decode("utf-8")
+
+    async def averify(self, password: str, hashed: str) -> bool:
+        return await self._arun(_checkpw, password.encode("utf-8"), hashed.encode("utf-8"))
+
+    def needs_rehash(self, hashed: str) -> bool:
+        return hash_rounds(hashed) != self.rounds
+
+    def _submit(self, executor: Executor, fn, *args):
+        """Accoda nel pool; lo slot resta occupato finché il task non termina"""
+        if not self._slots.acquire(blocking=False):
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many concurrent password operations, retry shortly",
+                headers={"Retry-After": "1"},
+            )
+        try:
+            future = executor.submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def _timed_out(self) -> HTTPException:
+        return HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Password operation timed out, retry shortly",
+            headers={"Retry-After": "1"},
+        )
+
+    def _run(self, fn, *args):
+        executor = self._get_executor()
+        if executor is None:
+            return fn(*args)
+        future = self._submit(executor, fn, *args)
+        try:
+            return future.result(timeout=self._timeout)
+        except FutureTimeoutError:
+            raise self._timed_out()
+
+    async def _arun(self, fn, *args):
+        executor = self._get_executor()
+        if executor is None:
+            return await run_in_threadpool(fn, *args)
+        future = self._submit(executor, fn, *args)
+        try:
+            # shield: un timeout non cancella il future del pool, che libera lo slot a fine task
+            return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), self._timeout)
+        except asyncio.TimeoutError:
+            raise self._timed_out()
+
+    def _get_executor(self) -> Executor | None:
+        if self._executor_kind == "none":
+            return None
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    if self._executor_kind == "process":
+                        self._executor = ProcessPoolExecutor(max_workers=self._workers)
+                    else:
+                        self._executor = ThreadPoolExecutor(
+                            max_workers=self._workers,
+                            thread_name_prefix="bcrypt",
+                        )
+        return self._executor
+
+    def warm_up(self) -> None:
+        """Avvia i processi del pool prima del primo login"""
+        executor = self._get_executor()
+        if executor is not None:
+            list(executor.map(_checkpw, [b""] * self._workers, [_hashpw(b"", 4)] * self._workers))
+
+    def shutdown(self) -> None:
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+
+
+password_hasher = PasswordHasher()
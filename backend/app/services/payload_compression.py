@@ -0,0 +1,187 @@
+# app/services/payload_compression.py
+"""
+Dizionari zlib per modulo (tabella payload_dictionary, in chiaro).
+
+Il dizionario contiene solo materiale ricavato dallo schema Pydantic del
+modulo: chiavi JSON ("campo": ) e valori letterali (enum, Literal, const),
+anche in coppia con la loro chiave. I payload di esempio servono solo a
+pesare questi frammenti: nomi, firme e testo libero non finiscono mai nel
+dizionario.
+"""
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Iterable
+import json
+import logging
+import re
+
+from pydantic import BaseModel
+from sqlalchemy import Engine
+from sqlmodel import Session, select
+
+from app.models import ModuleEntry, PayloadDictionary
+from app.module_registry import REGISTRY
+from app.services.encryption import deflate_payload, field_encryption
+
+logger = logging.getLogger(__name__)
+
+# Finestra massima di deflate: un dizionario più lungo non viene usato
+MAX_DICTIONARY_SIZE = 32 * 1024
+
+# Frammenti JSON nei campioni: coppie "chiave": "valore", chiavi ("chiave": ) e stringhe
+_FRAGMENT_RE = re.compile(r'"((?:[^"\\]|\\.)*)"\s*:\s*(?:"((?:[^"\\]|\\.)*)")?|"((?:[^"\\]|\\.)*)"')
+
+
+@dataclass(frozen=True)
+class SchemaVocabulary:
+    """Chiavi e valori letterali ammessi nel dizionario di un modulo"""
+    keys: frozenset[str] = field(default_factory=frozenset)
+    literals: frozenset[str] = field(default_factory=frozenset)
+
+    def fragment(self, match: re.Match) -> str | None:
+        """Frammento ammesso per una corrispondenza di _FRAGMENT_RE (None se non derivabile dallo schema)"""
+        key, value, string = match.groups()
+        if string is not None:
+            return json.dumps(string, ensure_ascii=False) if string in self.keys | self.literals else None
+        if key not in self.keys:
+            return None
+        prefix = f"{json.dumps(key, ensure_ascii=False)}: "
+        if value is not None and value in self.literals:
+            return prefix + json.dumps(value, ensure_ascii=False)
+        return prefix
+
+
+def schema_vocabulary(models: Iterable[type[BaseModel]]) -> SchemaVocabulary:
+    """Nomi delle proprietà e valori enum/const degli schemi JSON dei modelli"""
+    keys: set[str] = set()
+    literals: set[str] = set()
+    nodes: list = [model.model_json_schema() for model in models]
+    while nodes:
+        node = nodes.pop()
+        if isinstance(node, list):
+            nodes.extend(node)
+            continue
+        if not isinstance(node, dict):
+            continue
+        keys.update(node.get("properties", {}))
+        literals.update(value for value in node.get("enum", ()) if isinstance(value, str))
+        if isinstance(node.get("const"), str):
+            literals.add(node["const"])
+        nodes.extend(node.values())
+    return SchemaVocabulary(frozenset(keys), frozenset(literals))
+
+
+def module_vocabulary(module_code: str) -> SchemaVocabulary:
+    return schema_vocabulary(info.model for (code, _), info in REGISTRY.items() if code == module_code)
+
+
+class PayloadDictionaryStore:
+    """Sorgente dei dizionari su tabella payload_dictionary (usata da FieldEncryption)"""
+
+    def __init__(self, engine: Engine):
+        self._engine = engine
+
+    def all(self) -> list[tuple[int, str, bytes]]:
+        with Session(self._engine) as session:
+            rows = session.exec(select(PayloadDictionary).order_by(PayloadDictionary.id)).all()
+            return [(row.id, row.module_code, row.dictionary) for row in rows]
+
+    def get(self, dict_id: int) -> tuple[str, bytes] | None:
+        with Session(self._engine) as session:
+            row = session.get(PayloadDictionary, dict_id)
+            return (row.module_code, row.dictionary) if row else None
+
+
+def train_dictionary(
+    samples: Iterable[bytes], vocabulary: SchemaVocabulary, max_size: int = MAX_DICTIONARY_SIZE
+) -> bytes:
+    """
+    Costruisce un dizionario zlib dai frammenti dello schema presenti nei
+    payload JSON di esempio.
+
+    Tiene i frammenti presenti in almeno due campioni, in ordine di risparmio
+    atteso crescente: deflate raggiunge più a buon mercato la fine del
+    dizionario, quindi i frammenti più utili vanno in coda.
+    """
+    document_frequency: Counter[str] = Counter()
+    for sample in samples:
+        text = sample.decode('utf-8', errors='ignore')
+        fragments = (vocabulary.fragment(match) for match in _FRAGMENT_RE.finditer(text))
+        document_frequency.update({fragment for fragment in fragments if fragment})
+
+    fragments = [f for f, n in document_frequency.items() if n > 1]
+    # Peso = frequenza * lunghezza: privilegia i frammenti che fanno risparmiare di più
+    fragments.sort(key=lambda f: document_frequency[f] * len(f), reverse=True)
+
+    selected: list[bytes] = []
+    size = 0
+    for fragment in fragments:
+        encoded = fragment.encode('utf-8')
+        if size + len(encoded) > max_size:
+            continue
+        selected.append(encoded)
+        size += len(encoded)
+
+    return b"".join(reversed(selected))
+
+
+def measure_ratio(samples: list[bytes], dictionary: bytes | None, level: int = 6) -> float | None:
+    raw = sum(len(s) for s in samples)
+    if not raw:
+        return None
+    compressed = sum(len(deflate_payload(s, dictionary, level)) for s in samples)
+    return compressed / raw
+
+
+def train_module_dictionaries(
+    session: Session,
+    module_codes: Iterable[str],
+    sample_size: int = 500,
+) -> list[dict]:
+    """
+    Addestra e salva un nuovo dizionario per ciascun modulo a partire dalle
+    entry più recenti. Ritorna il report del rapporto di compressione per modulo.
+    """
+    report = []
+    for module_code in module_codes:
+        entries = session.exec(
+            select(ModuleEntry)
+            .where(ModuleEntry.module_code == module_code, ModuleEntry.deleted_at.is_(None))
+            .order_by(ModuleEntry.occurred_at.desc())
+            .limit(sample_size)
+        ).all()
+        payloads = field_encryption.decrypt_dicts([entry.data_encrypted for entry in entries])
+        samples = [
+            json.dumps(data, ensure_ascii=False, default=str).encode('utf-8')
+            for data in payloads if data
+        ]
+        if len(samples) < 2:
+            logger.info(f"{module_code}: campione insufficiente ({len(samples)} payload)")
+            continue
+
+        dictionary = train_dictionary(samples, module_vocabulary(module_code))
+        ratio_plain = measure_ratio(samples, None)
+        ratio = measure_ratio(samples, dictionary)
+
+        row = PayloadDictionary(
+            module_code=module_code,
+            dictionary=dictionary,
+            sample_size=len(samples),
+            ratio=ratio,
+        )
+        session.add(row)
+        session.commit()
+        session.refresh(row)
+        field_encryption.register_dictionary(row.id, module_code, dictionary)
+
+        item = {
+            "module_code": module_code,
+            "dictionary_id": row.id,
+            "dictionary_bytes": len(dictionary),
+            "samples": len(samples),
+            "ratio_without_dictionary": round(ratio_plain, 3) if ratio_plain else None,
+            "ratio_with_dictionary": round(ratio, 3) if ratio else None,
+        }
+        logger.info(f"Dizionario addestrato: {item}")
+        report.append(item)
+    return report
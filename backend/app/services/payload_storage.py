@@ -0,0 +1,199 @@
+# app/services/payload_storage.py
+"""
+Ricodifica online dei payload ModuleEntry dal formato legacy (doppio base64)
+al formato binario versionato.
+
+La conversione non decritta nulla: il token Fernet viene solo ridecodificato,
+quindi non serve la chiave e il contenuto clinico resta invariato.
+Ogni batch è una transazione breve; l'UPDATE è condizionato al valore letto,
+così una scrittura concorrente dall'applicazione non viene mai sovrascritta.
+
+reencode_to_envelope porta invece i payload ancora cifrati con la chiave
+globale (0x01/legacy) e le tessere sanitarie al formato envelope 0x02 con
+la DEK del dossier/paziente: qui la decifratura serve, e la DEK nuova viene
+creata nella stessa transazione del batch.
+"""
+from dataclasses import dataclass, field
+from time import monotonic, sleep
+from typing import Callable, Optional
+import logging
+import uuid
+
+from sqlalchemy import Engine, and_, func, literal, select, update
+
+from app.models import ModuleEntry, Patient
+from app.services.encryption import PAYLOAD_FORMAT_ENVELOPE, field_encryption, legacy_to_binary
+
+logger = logging.getLogger(__name__)
+
+_table = ModuleEntry.__table__
+_data = _table.c.data
+_id = _table.c.id
+
+# Righe ancora in formato legacy: il primo byte è un carattere base64, non una versione
+_legacy_filter = func.get_byte(_data, 0) >= 0x20
+# Righe non ancora envelope (0x01 o legacy); substr vale anche su sqlite
+_global_key_filter = func.substr(_data, 1, 1) != literal(bytes([PAYLOAD_FORMAT_ENVELOPE]))
+
+_patients = Patient.__table__
+_card = _patients.c.health_card_number
+# Il base64 di un frame envelope inizia per "A" (byte 0x02), quello di un token Fernet per "Z"
+_card_global_key_filter = and_(_card.is_not(None), _card.not_like("A%"))
+
+
+@dataclass
+class ReencodeProgress:
+    total: int
+    converted: int = 0
+    skipped: int = 0
+    failed: int = 0
+    bytes_before: int = 0
+    bytes_after: int = 0
+    started_at: float = field(default_factory=monotonic)
+
+    @property
+    def processed(self) -> int:
+        return self.converted + self.skipped + self.failed
+
+    @property
+    def percent(self) -> float:
+        return 100.0 if not self.total else min(100.0, self.processed * 100 / self.total)
+
+    @property
+    def ratio(self) -> Optional[float]:
+        return self.bytes_after / self.bytes_before if self.bytes_before else None
+
+    def as_dict(self) -> dict:
+        return {
+            "total": self.total,
+            "converted": self.converted,
+            "skipped": self.skipped,
+            "failed": self.failed,
+            "percent": round(self.percent, 1),
+            "size_ratio": round(self.ratio, 3) if self.ratio else None,
+            "elapsed_s": round(monotonic() - self.started_at, 1),
+        }
+
+
+def count_legacy_payloads(engine: Engine) -> int:
+    with engine.connect() as conn:
+        return conn.execute(select(func.count()).select_from(_table).where(_legacy_filter)).scalar_one()
+
+
+def count_global_key_payloads(engine: Engine) -> int:
+    """Payload module_entry più tessere sanitarie ancora cifrati con la chiave globale"""
+    with engine.connect() as conn:
+        entries = conn.execute(select(func.count()).select_from(_table).where(_global_key_filter)).scalar_one()
+        cards = conn.execute(select(func.count()).select_from(_patients).where(_card_global_key_filter)).scalar_one()
+    return entries + cards
+
+
+def _reencode_rows(
+    engine: Engine,
+    progress: ReencodeProgress,
+    id_column,
+    value_column,
+    owner_column,
+    where,
+    convert: Callable,
+    batch_size: int,
+    pause_s: float,
+    on_progress: Callable[[ReencodeProgress], None] | None,
+) -> None:
+    """
+    Scorre in keyset sull'id le righe che soddisfano where e riscrive
+    value_column con convert(value, owner_id, conn); un batch per transazione.
+    """
+    table = id_column.table
+    last_id: uuid.UUID | None = None
+    while True:
+        stmt = select(id_column, value_column, owner_column).where(where).order_by(id_column).limit(batch_size)
+        if last_id is not None:
+            stmt = stmt.where(id_column > last_id)
+
+        with engine.begin() as conn:
+            rows = conn.execute(stmt).all()
+            if not rows:
+                break
+
+            for row_id, value, owner_id in rows:
+                try:
+                    new_value = convert(value, owner_id, conn)
+                except Exception as e:
+                    progress.failed += 1
+                    logger.error(f"Valore non convertibile per {table.name} {row_id}: {e}")
+                    continue
+
+                result = conn.execute(
+                    update(table)
+                    .where(and_(id_column == row_id, value_column == value))
+                    .values({value_column.name: new_value})
+                )
+                if result.rowcount:
+                    progress.converted += 1
+                    progress.bytes_before += len(value)
+                    progress.bytes_after += len(new_value)
+                else:
+                    # Riga modificata nel frattempo: l'applicazione l'ha già riscritta
+                    progress.skipped += 1
+
+        last_id = rows[-1][0]
+        logger.info(f"Ricodifica {table.name}: {progress.as_dict()}")
+        if on_progress:
+            on_progress(progress)
+        if pause_s:
+            sleep(pause_s)
+
+
+def reencode_payloads(
+    engine: Engine,
+    batch_size: int = 500,
+    pause_s: float = 0.0,
+    on_progress: Callable[[ReencodeProgress], None] | None = None,
+) -> ReencodeProgress:
+    """
+    Converte tutte le righe legacy di module_entry nel formato binario.
+
+    Scorre la tabella in keyset sull'id (nessun OFFSET), un batch per
+    transazione, con una pausa opzionale per limitare il carico su WAL/IO.
+    """
+    progress = ReencodeProgress(total=count_legacy_payloads(engine))
+    logger.info(f"Payload da ricodificare: {progress.total}")
+    _reencode_rows(
+        engine, progress, _id, _data, _table.c.dossier_id, _legacy_filter,
+        lambda value, owner_id, conn: legacy_to_binary(value),
+        batch_size, pause_s, on_progress,
+    )
+    return progress
+
+
+def reencode_to_envelope(
+    engine: Engine,
+    batch_size: int = 500,
+    pause_s: float = 0.0,
+    on_progress: Callable[[ReencodeProgress], None] | None = None,
+) -> ReencodeProgress:
+    """
+    Ricifra con la DEK del proprietario i payload module_entry 0x01/legacy
+    e le tessere sanitarie ancora sotto la chiave globale.
+
+    Richiede un archivio DEK collegato (configure_data_keys). Riprendibile:
+    le righe già envelope escono dal filtro, quindi un'interruzione perde
+    al più il batch in corso.
+    """
+    if not field_encryption.envelope_enabled:
+        raise RuntimeError("Nessun archivio DEK collegato: impossibile ricifrare in formato envelope")
+
+    progress = ReencodeProgress(total=count_global_key_payloads(engine))
+    logger.info(f"Valori da ricifrare in formato envelope: {progress.total}")
+    _reencode_rows(
+        engine, progress, _id, _data, _table.c.dossier_id, _global_key_filter,
+        lambda value, owner_id, conn: field_encryption.to_envelope(value, "dossier", owner_id, connection=conn),
+        batch_size, pause_s, on_progress,
+    )
+    _reencode_rows(
+        engine, progress, _patients.c.id, _card, _patients.c.id, _card_global_key_filter,
+        lambda value, owner_id, conn: field_encryption.str_to_envelope(value, "patient", owner_id, connection=conn),
+        batch_size, pause_s, on_progress,
+    )
+    return progress
@@ -0,0 +1,305 @@
+# app/services/principal.py
+"""
+Principal autenticato: vista compatta e immutabile di utente e ruolo usata
+da autenticazione e RBAC, in cache per PRINCIPAL_CACHE_TTL secondi.
+
+Con la cache calda una richiesta autenticata non fa query di autenticazione
+(né User né Role). Le rotte di users/roles invalidano le voci toccate con
+invalidate_principals(); l'invalidazione è propagata agli altri worker via
+Postgres NOTIFY sul canale PRINCIPAL_NOTIFY_CHANNEL (consegnata al commit
+della transazione). PRINCIPAL_CACHE_NOTIFY è attivo per default: senza, con
+più worker una revoca resta invisibile agli altri fino alla scadenza TTL.
+
+Con TOKEN_ROLE_CLAIMS il token di accesso porta anche struttura, ruolo,
+moduli e user.permissions_version (claim "perm"): a cache fredda il
+principal si ricostruisce dal token, purché la versione coincida con
+quella corrente. Ogni invalidazione incrementa la versione degli utenti
+toccati, quindi i token emessi prima tornano a leggere il DB. Anche a cache
+calda la versione del claim è confrontata con quella della voce: un token
+più recente della cache (invalidazione non arrivata a questo worker) fa
+ricaricare il principal dal DB.
+"""
+from dataclasses import dataclass
+from time import monotonic
+import logging
+import os
+import threading
+import uuid
+
+from sqlalchemy import Engine, event, select, text, update
+from sqlmodel import Session
+
+from app.models import Role, User
+
+logger = logging.getLogger(__name__)
+
+PRINCIPAL_CACHE_TTL = float(os.getenv("PRINCIPAL_CACHE_TTL", "60"))
+PRINCIPAL_CACHE_MAX_SIZE = 10000
+PRINCIPAL_CACHE_NOTIFY = os.getenv("PRINCIPAL_CACHE_NOTIFY", "true").lower() in ("1", "true")
+PRINCIPAL_NOTIFY_CHANNEL = "principal_invalidation"
+TOKEN_ROLE_CLAIMS = os.getenv("TOKEN_ROLE_CLAIMS", "true").lower() in ("1", "true")
+PERMISSIONS_CLAIM = "perm"
+
+_PENDING_KEY = "principal_invalidations"
+
+
+@dataclass(frozen=True, slots=True)
+class Principal:
+    id: uuid.UUID
+    username: str
+    structure_id: uuid.UUID | None
+    role_id: uuid.UUID | None
+    role_name: str | None
+    modules: tuple[str, ...]
+    is_superuser: bool
+    is_active: bool
+    permissions_version: int = 0
+
+    @classmethod
+    def from_user(cls, user: User, role: Role | None) -> "Principal":
+        return cls(
+            id=user.id,
+            username=user.username,
+            structure_id=user.structure_id,
+            role_id=user.role_id,
+            role_name=role.name if role else None,
+            modules=tuple(role.modules or ()) if role else (),
+            is_superuser=user.is_superuser,
+            is_active=user.is_active,
+            permissions_version=user.permissions_version,
+        )
+
+    @classmethod
+    def from_claims(cls, user_id: uuid.UUID, claims: dict) -> "Principal":
+        """Principal dal claim "perm" (KeyError/ValueError se malformato)"""
+        structure_id, role_id = claims["structure_id"], claims["role_id"]
+        return cls(
+            id=user_id,
+            username=claims["username"],
+            structure_id=uuid.UUID(structure_id) if structure_id else None,
+            role_id=uuid.UUID(role_id) if role_id else None,
+            role_name=claims["role"],
+            modules=tuple(claims["modules"]),
+            is_superuser=bool(claims["is_superuser"]),
+            is_active=True,
+            permissions_version=int(claims["version"]),
+        )
+
+
+def principal_claims(principal: Principal) -> dict:
+    """Claim da passare a create_access_token"""
+    return {
+        PERMISSIONS_CLAIM: {
+            "username": principal.username,
+            "structure_id": str(principal.structure_id) if principal.structure_id else None,
+            "role_id": str(principal.role_id) if principal.role_id else None,
+            "role": principal.role_name,
+            "modules": list(principal.modules),
+            "is_superuser": principal.is_superuser,
+            "version": principal.permissions_version,
+        }
+    }
+
+
+class PrincipalCache:
+    """Cache TTL dei principal per id utente, invalidabile per utente o per ruolo"""
+
+    def __init__(self, ttl: float = PRINCIPAL_CACHE_TTL, max_size: int = PRINCIPAL_CACHE_MAX_SIZE):
+        self._ttl = ttl
+        self._max_size = max_size
+        self._entries: dict[uuid.UUID, tuple[float, Principal]] = {}
+        self._versions: dict[uuid.UUID, tuple[float, int]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, user_id: uuid.UUID) -> Principal | None:
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return None
+        expires_at, principal = entry
+        if expires_at < monotonic():
+            with self._lock:
+                self._entries.pop(user_id, None)
+            return None
+        return principal
+
+    def get_version(self, user_id: uuid.UUID) -> int | None:
+        principal = self.get(user_id)
+        if principal is not None:
+            return principal.permissions_version
+        entry = self._versions.get(user_id)
+        if entry is None or entry[0] < monotonic():
+            return None
+        return entry[1]
+
+    def set_version(self, user_id: uuid.UUID, version: int) -> None:
+        with self._lock:
+            if len(self._versions) >= self._max_size:
+                self._versions.clear()
+            self._versions[user_id] = (monotonic() + self._ttl, version)
+
+    def set(self, principal: Principal) -> None:
+        with self._lock:
+            if len(self._entries) >= self._max_size:
+                now = monotonic()
+                self._entries = {k: v for k, v in self._entries.items() if v[0] >= now}
+                if len(self._entries) >= self._max_size:
+                    self._entries.pop(next(iter(self._entries)))
+            self._entries[principal.id] = (monotonic() + self._ttl, principal)
+
+    def invalidate_user(self, user_id: uuid.UUID) -> None:
+        with self._lock:
+            self._entries.pop(user_id, None)
+            self._versions.pop(user_id, None)
+
+    def invalidate_role(self, role_id: uuid.UUID) -> None:
+        with self._lock:
+            self._entries = {k: v for k, v in self._entries.items() if v[1].role_id != role_id}
+            # Gli utenti del ruolo senza principal in cache non sono noti
+            self._versions.clear()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._versions.clear()
+
+    def apply(self, kind: str, key: uuid.UUID | None) -> None:
+        if kind == "user" and key is not None:
+            self.invalidate_user(key)
+        elif kind == "role" and key is not None:
+            self.invalidate_role(key)
+        else:
+            self.clear()
+
+
+principal_cache = PrincipalCache()
+
+
+def load_principal(session: Session, user_id: uuid.UUID) -> Principal | None:
+    """Utente e ruolo con una sola query"""
+    row = session.exec(
+        select(User, Role).outerjoin(Role, Role.id == User.role_id).where(User.id == user_id)
+    ).first()
+    if row is None:
+        return None
+    user, role = row
+    return Principal.from_user(user, role)
+
+
+def get_principal(session: Session, user_id: uuid.UUID) -> Principal | None:
+    principal = principal_cache.get(user_id)
+    if principal is None:
+        principal = load_principal(session, user_id)
+        if principal is not None:
+            principal_cache.set(principal)
+    return principal
+
+
+def current_permissions_version(session: Session, user_id: uuid.UUID) -> int | None:
+    """Versione dei permessi (None se l'utente non esiste), letta dal DB solo a cache fredda"""
+    version = principal_cache.get_version(user_id)
+    if version is None:
+        version = session.exec(select(User.permissions_version).where(User.id == user_id)).scalar()
+        if version is not None:
+            principal_cache.set_version(user_id, version)
+    return version
+
+
+def principal_from_token(session: Session, user_id: uuid.UUID, claims: dict) -> Principal | None:
+    """
+    Principal dai claim del token se la loro versione è quella corrente,
+    altrimenti (token senza claim, vecchio o malformato) dal DB
+    """
+    perm = claims.get(PERMISSIONS_CLAIM)
+    token_principal = None
+    if isinstance(perm, dict):
+        try:
+            token_principal = Principal.from_claims(user_id, perm)
+        except (KeyError, TypeError, ValueError):
+            token_principal = None
+
+    principal = principal_cache.get(user_id)
+    if principal is not None:
+        # Token emesso dopo la voce in cache: la voce è vecchia, si ricarica
+        if token_principal is None or token_principal.permissions_version <= principal.permissions_version:
+            return principal
+        principal_cache.invalidate_user(user_id)
+    elif token_principal is not None:
+        if token_principal.permissions_version == current_permissions_version(session, user_id):
+            return token_principal
+    return get_principal(session, user_id)
+
+
+def invalidate_principals(
+    session: Session, *, user_id: uuid.UUID | None = None, role_id: uuid.UUID | None = None
+) -> None:
+    """
+    Da chiamare prima del commit di una modifica a utenti o ruoli: invalida
+    subito e di nuovo dopo il commit (una richiesta concorrente potrebbe aver
+    ricaricato il valore vecchio nel frattempo) e, se abilitato, notifica gli
+    altri worker nella stessa transazione. Incrementa la versione dei
+    permessi degli utenti toccati (revoca dei claim nei token già emessi).
+    """
+    kind, key = ("user", user_id) if user_id is not None else ("role", role_id) if role_id is not None else ("all", None)
+    principal_cache.apply(kind, key)
+    bump = update(User).values(permissions_version=User.permissions_version + 1)
+    if kind == "user":
+        bump = bump.where(User.id == key)
+    elif kind == "role":
+        bump = bump.where(User.role_id == key)
+    session.execute(bump.execution_options(synchronize_session=False))
+    session.info.setdefault(_PENDING_KEY, []).append((kind, key))
+    if PRINCIPAL_CACHE_NOTIFY and session.get_bind().dialect.name == "postgresql":
+        session.execute(
+            text("SELECT pg_notify(:channel, :payload)"),
+            {"channel": PRINCIPAL_NOTIFY_CHANNEL, "payload": f"{kind}:{key or ''}"},
+        )
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_after_commit(session):
+    for kind, key in session.info.pop(_PENDING_KEY, ()):
+        principal_cache.apply(kind, key)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard_on_rollback(session, previous_transaction):
+    session.info.pop(_PENDING_KEY, None)
+
+
+class PrincipalInvalidationListener:
+    """Thread LISTEN sul canale di invalidazione (una connessione dedicata per worker)"""
+
+    def __init__(self, engine: Engine, cache: PrincipalCache = principal_cache):
+        self._engine = engine
+        self._cache = cache
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> None:
+        if self._engine.dialect.name != "postgresql":
+            return
+        self._thread = threading.Thread(target=self._run, name="principal-listener", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self._listen()
+            except Exception as e:
+                # Notifiche perse durante la riconnessione: si riparte da cache vuota
+                logger.warning(f"Listener invalidazione principal interrotto: {e}")
+                self._cache.clear()
+                self._stop.wait(5)
+
+    def _listen(self) -> None:
+        with self._engine.connect() as conn:
+            driver_connection = conn.connection.driver_connection
+            driver_connection.autocommit = True
+            driver_connection.execute(f"LISTEN {PRINCIPAL_NOTIFY_CHANNEL}")
+            while not self._stop.is_set():
+                for notify in driver_connection.notifies(timeout=1.0, stop_after=100):
+                    kind, _, key = notify.payload.partition(":")
+                    self._cache.apply(kind, uuid.UUID(key) if key else None)
@@ -0,0 +1,122 @@
+# app/services/projection.py
+"""
+Proiezione in chiaro dei campi non sensibili dei payload (punteggi, enum,
+flag) nella tabella module_entry_projection, così le statistiche girano
+interamente in SQL senza decrittare i payload clinici.
+
+I campi sono dichiarati per versione di modulo in SchemaInfo.projection_fields.
+Le righe di campi non più dichiarati vengono eliminate (purge_projections):
+il backfill non le riscrive e non lascia in chiaro valori tolti dal registro.
+"""
+from typing import Any
+import logging
+
+from sqlmodel import Session, delete, select
+
+from app.module_registry import REGISTRY
+from app.services.blind_index import extract_field
+from app.services.encryption import field_encryption
+
+logger = logging.getLogger(__name__)
+
+TEXT_VALUE_MAX_LENGTH = 100
+
+
+def projected_fields(module_code: str, schema_version: int | None = None) -> tuple[str, ...]:
+    """Campi proiettati di una versione (o di tutte le versioni del modulo)"""
+    if schema_version is not None:
+        schema_info = REGISTRY.get((module_code, schema_version))
+        return schema_info.projection_fields if schema_info else ()
+    fields: dict[str, None] = {}
+    for (code, _), schema_info in REGISTRY.items():
+        if code == module_code:
+            fields.update(dict.fromkeys(schema_info.projection_fields))
+    return tuple(fields)
+
+
+def project_value(value: Any) -> tuple[float | None, str | None] | None:
+    """(valore numerico, valore testuale) di un campo; None se non proiettabile"""
+    if isinstance(value, bool):
+        return (1.0 if value else 0.0), ("true" if value else "false")
+    if isinstance(value, (int, float)):
+        return float(value), None
+    if isinstance(value, str) and value:
+        return None, value[:TEXT_VALUE_MAX_LENGTH]
+    return None
+
+
+def entry_projections(
+    module_code: str, schema_version: int, data: dict
+) -> dict[str, tuple[float | None, str | None]]:
+    projections = {}
+    for path in projected_fields(module_code, schema_version):
+        projected = project_value(extract_field(data, path))
+        if projected is not None:
+            projections[path] = projected
+    return projections
+
+
+def purge_projections(session: Session, module_code: str | None = None) -> int:
+    """Elimina le proiezioni di campi non dichiarati nel registro (per un modulo o per tutti)"""
+    from app.models import EntryProjection
+
+    if module_code:
+        module_codes = [module_code]
+    else:
+        module_codes = sorted(set(session.exec(select(EntryProjection.module_code).distinct()).all()))
+
+    purged = 0
+    for code in module_codes:
+        stmt = delete(EntryProjection).where(EntryProjection.module_code == code)
+        fields = projected_fields(code)
+        if fields:
+            stmt = stmt.where(EntryProjection.field.not_in(fields))
+        purged += session.exec(stmt).rowcount
+    if purged:
+        logger.info(f"Proiezioni di campi non dichiarati eliminate: {purged}")
+    return purged
+
+
+def backfill_projections(session: Session, module_code: str | None = None, batch_size: int = 500) -> int:
+    """Ricalcola le proiezioni delle entry esistenti (keyset sull'id, un commit per batch)"""
+    from app.models import ModuleEntry
+
+    purge_projections(session, module_code)
+    session.commit()
+
+    declared = sorted({code for (code, _), info in REGISTRY.items() if info.projection_fields})
+    # Un modulo senza campi dichiarati non ha nulla da proiettare: niente decrittazione
+    module_codes = [code for code in declared if module_code in (None, code)]
+    if not module_codes:
+        return 0
+
+    processed = 0
+    last_id = None
+    while True:
+        stmt = (
+            select(ModuleEntry)
+            .where(ModuleEntry.module_code.in_(module_codes))
+            .order_by(ModuleEntry.id)
+            .limit(batch_size)
+        )
+        if last_id is not None:
+            stmt = stmt.where(ModuleEntry.id > last_id)
+        entries = session.exec(stmt).all()
+        if not entries:
+            break
+
+        payloads = field_encryption.decrypt_dicts([entry.data_encrypted for entry in entries])
+        for entry, data in zip(entries, payloads):
+            if data is None:
+                logger.error(f"Payload non decifrabile per entry {entry.id}: proiezione saltata")
+                continue
+            entry.sync_projections(data)
+            session.add(entry)
+        session.commit()
+
+        processed += len(entries)
+        last_id = entries[-1].id
+        session.expunge_all()
+        logger.info(f"Proiezioni ricalcolate: {processed}")
+
+    return processed
@@ -2,31 +2,32 @@
 from fastapi import HTTPException, status
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.models import User, Role, Dossier, Structure
+from app.services.principal import Principal
 from typing import Literal
 
-from sqlmodel import Session
+from sqlmodel import Session, select
 from uuid import UUID
 
 ActionType = Literal["READ", "CREATE", "UPDATE", "DELETE"]
 
 def check_module_access(
     session: Session,
-    user: User,
+    user: User | Principal,
     module_code: str,
     action: ActionType = "READ"
-) -> Role:
+) -> Role | None:
     """
     Verifica che l'utente abbia accesso al modulo specificato.
-    Ritorna il ruolo se ha accesso, altrimenti solleva HTTPException.
+    Con un Principal i moduli del ruolo sono già in memoria (nessuna query).
     
     Args:
         session: Sessione database
-        user: Utente corrente
+        user: Utente corrente (Principal o User)
         module_code: Codice del modulo (es. "ROG26/1.1")
         action: Tipo di operazione
         
     Returns:
-        Role: Il ruolo dell'utente
+        Il ruolo dell'utente se caricato (None per superuser e Principal)
         
     Raises:
         HTTPException: Se l'utente non ha accesso
@@ -41,25 +42,32 @@ def check_module_access(
             detail="User has no role assigned"
         )
     
+    if isinstance(user, Principal):
+        _authorize_module(user.role_name, user.modules, module_code, action)
+        return None
+    
     role = session.get(Role, user.role_id)
-    if not role:
+    _authorize_module(role.name if role else None, role.modules if role else None, module_code, action)
+    return role
+
+
+def _authorize_module(role_name: str | None, modules, module_code: str, action: ActionType) -> None:
+    if role_name is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Role not found"
         )
     
-    if module_code not in (role.modules or []):
+    if module_code not in (modules or ()):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
-            detail=f"{action} access to module '{module_code}' denied for role '{role.name}'"
+            detail=f"{action} access to module '{module_code}' denied for role '{role_name}'"
         )
-    
-    return role
 
 
 def check_dossier_access(
     session: Session,
-    user: User,
+    user: User | Principal,
     dossier_id: UUID,
     action: ActionType = "READ"
 ) -> Dossier:
@@ -84,6 +92,11 @@ def check_dossier_access(
         HTTPException: Se dossier non trovato o accesso negato
     """
     dossier = session.get(Dossier, dossier_id)
+    _authorize_dossier(user, dossier, action)
+    return dossier
+
+
+def _authorize_dossier(user: User | Principal, dossier: Dossier | None, action: ActionType) -> None:
     if not dossier:
         raise HTTPException(404, "Dossier not found")
     
@@ -94,7 +107,7 @@ def check_dossier_access(
     
     # Superuser può tutto
     if hasattr(user, 'is_superuser') and user.is_superuser:
-        return dossier
+        return
     
     # Verifica stessa struttura
     if not user.structure_id:
@@ -114,13 +127,11 @@ def check_dossier_access(
     #     if role and hasattr(role, 'can_edit_dossiers'):
     #         if not role.can_edit_dossiers:
     #             raise HTTPException(403, f"Role '{role.name}' cannot {action} dossiers")
-    
-    return dossier
 
 
 def check_structure_access(
     session: Session,
-    user: User,
+    user: User | Principal,
     structure_id: UUID
 ) -> Structure:
     """
@@ -148,6 +159,62 @@ def check_structure_access(
     return structure
 
 
+class AccessEvaluator:
+    """
+    Decisioni RBAC di una richiesta calcolate in memoria.
+
+    Strutture e moduli accessibili sono fissati alla creazione; i dossier
+    vengono caricati con una sola query IN per tutti gli id distinti
+    (prefetch_dossiers) e riusati per ogni controllo successivo. Stessi
+    errori di check_dossier_access / check_module_access.
+    """
+
+    def __init__(self, session: Session, user: User | Principal):
+        self.session = session
+        self.user = user
+        self.is_superuser = bool(getattr(user, "is_superuser", False))
+        # None = tutte le strutture
+        self.structure_ids: frozenset[UUID] | None = (
+            None if self.is_superuser
+            else frozenset({user.structure_id}) if user.structure_id else frozenset()
+        )
+        if isinstance(user, Principal):
+            self.role_name, self.modules = user.role_name, frozenset(user.modules)
+        else:
+            role = session.get(Role, user.role_id) if user.role_id else None
+            self.role_name = role.name if role else None
+            self.modules = frozenset(role.modules or ()) if role else frozenset()
+        self._dossiers: dict[UUID, Dossier | None] = {}
+
+    def prefetch_dossiers(self, dossier_ids) -> None:
+        missing = {dossier_id for dossier_id in dossier_ids if dossier_id not in self._dossiers}
+        if not missing:
+            return
+        found = self.session.exec(select(Dossier).where(Dossier.id.in_(missing))).all()
+        self._dossiers.update(dict.fromkeys(missing))
+        self._dossiers.update({dossier.id: dossier for dossier in found})
+
+    def dossier(self, dossier_id: UUID, action: ActionType = "READ") -> Dossier:
+        if dossier_id not in self._dossiers:
+            self.prefetch_dossiers((dossier_id,))
+        dossier = self._dossiers[dossier_id]
+        _authorize_dossier(self.user, dossier, action)
+        return dossier
+
+    def module(self, module_code: str, action: ActionType = "READ") -> None:
+        if self.is_superuser:
+            return
+        if not self.user.role_id:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="User has no role assigned"
+            )
+        _authorize_module(self.role_name, self.modules, module_code, action)
+
+    def can_access_structure(self, structure_id: UUID | None) -> bool:
+        return self.structure_ids is None or structure_id in self.structure_ids
+
+
 """
     
     from app.utils.rbac import check_module_access
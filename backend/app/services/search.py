@@ -0,0 +1,123 @@
+# app/services/search.py
+"""
+Ricerca testuale di pazienti e dossier.
+
+La query viene normalizzata (minuscolo, spazi compattati, caratteri jolly
+di LIKE esclusi) e divisa in token: ogni token deve comparire nel nome o
+nel cognome. I token di almeno TRIGRAM_MIN_LENGTH caratteri sono cercati
+come sottostringa, quelli più corti solo come prefisso: '%ab%' non è
+selettivo e non si serve bene con i trigrammi.
+
+Su PostgreSQL i filtri usano gli indici GIN pg_trgm su lower(first_name),
+lower(last_name), fiscal_code e lower(notes) (migrazione e5a7c9e1f3b5):
+lower(col) LIKE '%tok%' diventa una Bitmap Index Scan invece di una
+scansione sequenziale. L'espressione deve restare identica a quella
+dell'indice.
+
+Un codice fiscale (o il suo prefisso, con almeno una cifra) salta la
+ricerca per nome: uguaglianza sull'indice univoco, oppure LIKE 'PREFISSO%'
+sull'indice varchar_pattern_ops.
+
+Il rank premia i prefissi (cognome prima del nome) e, su PostgreSQL,
+la similarità dei trigrammi come spareggio.
+"""
+from dataclasses import dataclass
+from functools import reduce
+import operator
+import re
+
+from sqlalchemy import ColumnElement, and_, case, func, literal, or_
+
+from app.models import Patient
+
+TRIGRAM_MIN_LENGTH = 3
+FISCAL_CODE_LENGTH = 16
+FISCAL_CODE_PREFIX_MIN = 7
+
+# Posizioni del codice fiscale; le cifre possono essere sostituite (omocodia)
+_LETTER = "A-Z"
+_DIGIT = "0-9LMNPQRSTUV"
+_MONTH = "ABCDEHLMPRST"
+_FISCAL_CODE_POSITIONS = [_LETTER] * 6 + [_DIGIT] * 2 + [_MONTH] + [_DIGIT] * 2 + [_LETTER] + [_DIGIT] * 3 + [_LETTER]
+
+_LIKE_WILDCARDS = re.compile(r"[%_\\]")
+
+
+@dataclass(frozen=True)
+class TextSearch:
+    condition: ColumnElement[bool]
+    rank: ColumnElement | None = None
+
+
+def normalize_query(q: str | None) -> str:
+    """Minuscolo, spazi compattati, senza caratteri jolly di LIKE"""
+    if not q:
+        return ""
+    return " ".join(_LIKE_WILDCARDS.sub(" ", q).lower().split())
+
+
+def fiscal_code_query(q: str | None) -> str | None:
+    """Codice fiscale (o prefisso) in maiuscolo se la query ne ha la forma, altrimenti None"""
+    if not q:
+        return None
+    code = "".join(q.split()).upper()
+    if not FISCAL_CODE_PREFIX_MIN <= len(code) <= FISCAL_CODE_LENGTH:
+        return None
+    if not all(re.fullmatch(f"[{allowed}]", char) for char, allowed in zip(code, _FISCAL_CODE_POSITIONS)):
+        return None
+    # Un prefisso senza cifre può essere un nome (ROSSIMARIO)
+    if len(code) < FISCAL_CODE_LENGTH and not any(char.isdigit() for char in code):
+        return None
+    return code
+
+
+def _token_condition(column: ColumnElement, token: str) -> ColumnElement[bool]:
+    if len(token) >= TRIGRAM_MIN_LENGTH:
+        return column.like(f"%{token}%")
+    return column.like(f"{token}%")
+
+
+def contains_all(column, q: str | None) -> ColumnElement[bool] | None:
+    """Ogni token della query come sottostringa di lower(column); None se la query è vuota"""
+    tokens = normalize_query(q).split()
+    if not tokens:
+        return None
+    lowered = func.lower(column)
+    return and_(*(lowered.like(f"%{token}%") for token in tokens))
+
+
+def patient_search(q: str | None, dialect_name: str = "postgresql") -> TextSearch | None:
+    """Filtro e rank per la ricerca pazienti; None se la query è vuota"""
+    code = fiscal_code_query(q)
+    if code is not None:
+        if len(code) == FISCAL_CODE_LENGTH:
+            return TextSearch(Patient.fiscal_code == code)
+        return TextSearch(Patient.fiscal_code.like(f"{code}%"))
+
+    tokens = normalize_query(q).split()
+    if not tokens:
+        return None
+
+    first_name = func.lower(Patient.first_name)
+    last_name = func.lower(Patient.last_name)
+    conditions = []
+    for token in tokens:
+        matches = [_token_condition(first_name, token), _token_condition(last_name, token)]
+        # Frammenti di codice fiscale (contengono cifre, i nomi no)
+        if len(token) >= TRIGRAM_MIN_LENGTH and any(char.isdigit() for char in token):
+            matches.append(Patient.fiscal_code.like(f"%{token.upper()}%"))
+        conditions.append(or_(*matches))
+
+    rank = reduce(operator.add, (
+        case(
+            (last_name.like(f"{token}%"), literal(2.0)),
+            (first_name.like(f"{token}%"), literal(1.0)),
+            else_=literal(0.0),
+        )
+        for token in tokens
+    ))
+    if dialect_name == "postgresql":
+        text = " ".join(tokens)
+        rank = rank + func.greatest(func.similarity(last_name, text), func.similarity(first_name, text))
+
+    return TextSearch(and_(*conditions), rank)
@@ -9,9 +9,11 @@ const pageSize = 20;
 async function loadDossiers() {
     try {
         const filters = getFilters();
+        // Totale stimato dal planner: la navigazione usa solo has_next
         const params = new URLSearchParams({
             page: currentPage,
             page_size: pageSize,
+            count: 'estimate',
             ...filters
         });
         
@@ -154,7 +156,8 @@ function renderPagination(data) {
     const start = (currentPage - 1) * pageSize + 1;
     const end = Math.min(currentPage * pageSize, totalDossiers);
     
-    info.textContent = `Mostrando ${start}-${end} di ${totalDossiers}`;
+    const totalLabel = data.total_estimated ? `circa ${totalDossiers}` : totalDossiers;
+    info.textContent = `Mostrando ${start}-${end} di ${totalLabel}`;
     
     prevBtn.disabled = currentPage === 1;
     nextBtn.disabled = !data.has_next;
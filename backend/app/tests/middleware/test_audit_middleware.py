@@ -0,0 +1,49 @@
+from datetime import timedelta
+
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from app.core import security
+from app.middleware.audit_middleware import AuditMiddleware, scope_claims
+from app.services.audit import get_audit_context
+
+
+def _context(request: Request) -> JSONResponse:
+    token = request.headers.get("authorization", "").partition(" ")[2]
+    found, claims = scope_claims(request.scope, token)
+    return JSONResponse({"context": get_audit_context(), "found": found, "claims": claims})
+
+
+def _stream(request: Request) -> StreamingResponse:
+    return StreamingResponse(iter([b"a", b"b", b"c"]))
+
+
+client = TestClient(Starlette(
+    routes=[Route("/context", _context), Route("/stream", _stream)],
+    middleware=[Middleware(AuditMiddleware)],
+))
+
+
+def test_claims_are_decoded_once_and_shared() -> None:
+    token = security.create_access_token("4f1c2a4e-0000-4000-8000-000000000001", timedelta(minutes=5))
+    body = client.get("/context", headers={"Authorization": f"Bearer {token}"}).json()
+    assert body["found"] is True
+    assert body["claims"]["sub"] == "4f1c2a4e-0000-4000-8000-000000000001"
+    assert body["context"]["user_id"] == body["claims"]["sub"]
+    assert body["context"]["endpoint"] == "GET /context"
+
+
+def test_invalid_token_leaves_no_audit_context() -> None:
+    body = client.get("/context", headers={"Authorization": "Bearer not-a-jwt"}).json()
+    assert body["found"] is True
+    assert body["claims"] is None
+    assert body["context"] == {}
+
+
+def test_anonymous_and_streaming_requests_pass_through() -> None:
+    assert client.get("/context").json()["found"] is False
+    assert client.get("/stream").content == b"abc"
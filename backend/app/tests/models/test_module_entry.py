@@ -0,0 +1,80 @@
+import copy
+import json
+import uuid
+from datetime import datetime, timezone
+from unittest.mock import patch
+
+import pytest
+
+from app.models import ModuleEntry
+from app.services.encryption import field_encryption
+
+
+def _entry() -> ModuleEntry:
+    return ModuleEntry(
+        dossier_id=uuid.uuid4(),
+        module_code="ROG26/1.3",
+        schema_version=1,
+        occurred_at=datetime.now(timezone.utc),
+    )
+
+
+def test_get_data_decrypts_once() -> None:
+    entry = _entry()
+    entry.data_encrypted = field_encryption.encrypt_dict({"punteggio_totale": 7})
+    with patch.object(
+        field_encryption, "decrypt_dict", wraps=field_encryption.decrypt_dict
+    ) as decrypt:
+        assert entry.data == {"punteggio_totale": 7}
+        assert entry.data == {"punteggio_totale": 7}
+    assert decrypt.call_count == 1
+
+
+def test_set_data_invalidates_cache() -> None:
+    entry = _entry()
+    entry.set_data({"a": 1})
+    with pytest.raises(TypeError):
+        entry.data["a"] = 99  # vista in sola lettura sulla cache
+    assert entry.data == {"a": 1}
+    editable = copy.deepcopy(dict(entry.get_data()))
+    editable["a"] = 99
+    assert entry.data == {"a": 1}
+    entry.set_data({"a": 2})
+    assert entry.data == {"a": 2}
+    assert "_data_cache" not in entry.model_dump()
+
+
+def test_nested_payload_is_frozen() -> None:
+    entry = _entry()
+    payload = {"paziente": {"nome": "Mario"}, "farmaci": [{"nome": "a"}]}
+    entry.set_data(payload)
+    payload["paziente"]["nome"] = "Anna"  # il chiamante non altera la cache
+    with pytest.raises(TypeError):
+        entry.data["paziente"]["nome"] = "Anna"
+    with pytest.raises(TypeError):
+        entry.data["farmaci"].append({"nome": "b"})
+    with pytest.raises(TypeError):
+        entry.data["farmaci"][0].update(nome="b")
+
+    editable = copy.deepcopy(dict(entry.get_data()))
+    editable["farmaci"].append({"nome": "b"})
+    assert type(editable["paziente"]) is dict and type(editable["farmaci"]) is list
+    assert entry.data == {"paziente": {"nome": "Mario"}, "farmaci": [{"nome": "a"}]}
+    assert json.loads(json.dumps(entry.data["paziente"])) == {"nome": "Mario"}
+
+
+def test_encryption_error_propagates() -> None:
+    entry = _entry()
+    entry.set_data({"a": 1})
+    with patch.object(field_encryption, "encrypt_payload", side_effect=RuntimeError("archivio DEK non raggiungibile")):
+        with pytest.raises(RuntimeError):
+            entry.set_data({"a": 2})
+    assert entry.data == {"a": 1}
+
+
+def test_decryption_error_is_logged(caplog) -> None:
+    entry = _entry()
+    entry.data_encrypted = b"non cifrato"
+    with caplog.at_level("ERROR", logger="app.models.tables"):
+        assert entry.get_data() == {}
+    assert "Decryption error" in caplog.text
@@ -0,0 +1,62 @@
+import csv
+import io
+import json
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.ext.compiler import compiles
+from sqlmodel import create_engine
+
+from app.models import AuditLog
+from app.services.audit_export import EXPORT_COLUMNS, export_statement, stream_audit_export
+from app.services.audit_writer import audit_row, write_audit_rows
+
+
+@compiles(JSONB, "sqlite")
+def _jsonb_on_sqlite(type_, compiler, **kw):
+    return "JSON"
+
+
+@pytest.fixture
+def engine():
+    engine = create_engine("sqlite://")
+    AuditLog.__table__.create(engine)
+    user_id = uuid.uuid4()
+    start = datetime(2026, 10, 1, 8, 0, tzinfo=timezone.utc)
+    with engine.begin() as conn:
+        write_audit_rows(conn, [
+            audit_row(
+                "UPDATE" if i % 2 else "READ", "patient", f"P{i % 3}",
+                {"user_id": user_id, "username": "mrossi"},
+                after={"gender": "F"} if i % 2 else None, ts=start + timedelta(hours=i),
+            )
+            for i in range(5)
+        ])
+    return engine
+
+
+def test_ndjson_export_streams_filtered_rows_in_order(engine) -> None:
+    stmt = export_statement(table_name="patient", record_id="P1")
+    lines = "".join(stream_audit_export(engine, stmt, "ndjson", batch_size=1)).splitlines()
+    events = [json.loads(line) for line in lines]
+    assert [event["record_id"] for event in events] == ["P1", "P1"]
+    assert events[0]["ts"] < events[1]["ts"]
+    assert events[0]["after"] == {"gender": "F"}
+
+
+def test_csv_export_has_header_once(engine) -> None:
+    stmt = export_statement(action="read")
+    rows = list(csv.reader(io.StringIO("".join(stream_audit_export(engine, stmt, "csv", batch_size=2)))))
+    assert rows[0] == list(EXPORT_COLUMNS)
+    assert len(rows) == 4
+
+    empty = export_statement(action="delete")
+    assert list(csv.reader(io.StringIO("".join(stream_audit_export(engine, empty, "csv"))))) == [list(EXPORT_COLUMNS)]
+
+
+def test_record_filter_requires_table() -> None:
+    with pytest.raises(HTTPException):
+        export_statement(record_id="P1")
@@ -0,0 +1,35 @@
+from datetime import date, datetime
+from pathlib import Path
+
+from app.services.audit_partitions import (
+    ARCHIVED_COMMENT_PREFIX,
+    add_months,
+    archived_comment,
+    month_start,
+    partition_month,
+    partition_name,
+    partitions_to_archive,
+)
+
+
+def test_partition_names_round_trip() -> None:
+    month = month_start(datetime(2026, 10, 17, 15, 30))
+    assert partition_name(month) == "audit_log_y2026m10"
+    assert partition_month("audit_log_y2026m10") == date(2026, 10, 1)
+    assert partition_month("audit_log_default") is None
+
+
+def test_add_months_crosses_years() -> None:
+    assert add_months(date(2026, 11, 1), 3) == date(2027, 2, 1)
+    assert add_months(date(2026, 1, 1), -13) == date(2024, 12, 1)
+
+
+def test_only_months_before_cutoff_are_archived() -> None:
+    names = ["audit_log_y2025m11", "audit_log_default", "audit_log_y2025m09", "audit_log_y2025m10"]
+    assert partitions_to_archive(names, date(2025, 11, 1)) == ["audit_log_y2025m09", "audit_log_y2025m10"]
+
+
+def test_archived_comment_marks_the_export_file() -> None:
+    comment = archived_comment(Path("audit_archive/audit_log_y2025m09.csv.gz"))
+    assert comment.startswith(ARCHIVED_COMMENT_PREFIX)
+    assert comment.endswith("audit_log_y2025m09.csv.gz")
@@ -0,0 +1,50 @@
+import uuid
+from datetime import date, datetime
+
+from sqlmodel import Session, create_engine
+
+from app.models import ModuleEntry, Patient, User
+from app.services.audit_serializers import BINARY, REDACTED, AuditSerializer
+
+
+def _patient() -> Patient:
+    return Patient(
+        first_name="Mario", last_name="Rossi", fiscal_code="RSSMRA50A01G479X",
+        date_of_birth=date(1950, 1, 1), place_of_birth="Pesaro", gender="M",
+    )
+
+
+def test_sensitive_columns_are_redacted() -> None:
+    entry = ModuleEntry(
+        dossier_id=uuid.uuid4(), module_code="ROG26/1.3", schema_version=1, occurred_at=datetime(2026, 1, 2)
+    )
+    entry.set_data({"punteggio_totale": 12})
+    serialized = AuditSerializer(ModuleEntry).serialize(entry)
+    assert serialized["data"] == REDACTED
+    assert serialized["occurred_at"] == "2026-01-02T00:00:00"
+    assert serialized["dossier_id"] == str(entry.dossier_id)
+
+    user = User(first_name="A", last_name="B", username="ab", hashed_password="$2b$12$x")
+    assert AuditSerializer(User).serialize(user)["hashed_password"] == REDACTED
+
+    patient = _patient()
+    patient.set_health_card_number("80380000001234567890")
+    serialized = AuditSerializer(Patient).serialize(patient)
+    assert serialized["health_card_number"] == REDACTED
+    assert serialized["health_card_number_bidx"] == BINARY
+
+
+def test_changes_reports_only_modified_columns() -> None:
+    engine = create_engine("sqlite://")
+    Patient.__table__.create(engine)
+    serializer = AuditSerializer(Patient)
+    with Session(engine) as session:
+        patient = _patient()
+        session.add(patient)
+        session.commit()
+        session.refresh(patient)
+
+        assert serializer.changes(patient) == {}
+        patient.gender = "F"
+        patient.place_of_birth = "Pesaro"
+        assert serializer.changes(patient) == {"gender": "M"}
@@ -0,0 +1,149 @@
+import uuid
+from datetime import date, datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.pool import StaticPool
+from sqlmodel import Session, create_engine
+
+from app.models import AuditLog, AuditOutbox, Patient
+from app.services import audit, audit_writer as writer
+from app.services.audit import current_user_context, log_read_access, set_audit_context, setup_audit_listeners
+from app.services.audit_coalesce import ReadCoalescer
+from app.services.audit_writer import AuditWriter, audit_row
+
+
+@compiles(JSONB, "sqlite")
+def _jsonb_on_sqlite(type_, compiler, **kw):
+    return "JSON"
+
+
+@pytest.fixture
+def engine():
+    engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    for table in (AuditLog.__table__, AuditOutbox.__table__, Patient.__table__):
+        table.create(engine)
+    return engine
+
+
+def _count(engine, model) -> int:
+    with engine.connect() as conn:
+        return conn.execute(select(func.count()).select_from(model.__table__)).scalar_one()
+
+
+def _context() -> dict:
+    return {"user_id": str(uuid.uuid4()), "username": "mrossi", "ip_address": "10.0.0.1", "endpoint": "GET /x"}
+
+
+def _read(session: Session, user: SimpleNamespace, record_id: str) -> None:
+    log_read_access(session, "dossiers", record_id, user, {"ip": "10.0.0.1", "endpoint": "GET /dossiers/x"})
+    session.commit()
+
+
+def test_first_read_survives_a_writer_crash(engine, monkeypatch) -> None:
+    monkeypatch.setattr(writer, "AUDIT_READ_DELIVERY", "batched")
+    monkeypatch.setattr(audit, "audit_writer", AuditWriter(engine, flush_interval=3600, coalesce_window=60))
+    user = SimpleNamespace(id=uuid.uuid4(), username="mrossi")
+    with Session(engine) as session:
+        for _ in range(3):
+            _read(session, user, "D1")
+
+    # Writer perso prima di qualsiasi flush (crash, OOM, redeploy)
+    monkeypatch.setattr(audit, "audit_writer", AuditWriter(engine, flush_interval=3600, coalesce_window=60))
+    with engine.connect() as conn:
+        rows = conn.execute(select(AuditLog.record_id, AuditLog.hit_count)).all()
+    assert [(row.record_id, row.hit_count) for row in rows] == [("D1", 1)]
+
+
+def test_repeated_reads_update_the_first_row(engine, monkeypatch) -> None:
+    monkeypatch.setattr(writer, "AUDIT_READ_DELIVERY", "batched")
+    audit_writer = AuditWriter(engine, flush_interval=3600, coalesce_window=60)
+    monkeypatch.setattr(audit, "audit_writer", audit_writer)
+    user = SimpleNamespace(id=uuid.uuid4(), username="mrossi")
+    with Session(engine) as session:
+        for _ in range(5):
+            _read(session, user, "D1")
+        _read(session, user, "D2")
+    assert _count(engine, AuditLog) == 2
+
+    # Finestra ancora aperta: nulla da applicare
+    assert audit_writer.flush() == 0
+    assert audit_writer.flush(everything=True) == 1
+    with engine.connect() as conn:
+        rows = conn.execute(
+            select(AuditLog.record_id, AuditLog.hit_count, AuditLog.ts, AuditLog.last_ts).order_by(AuditLog.record_id)
+        ).all()
+    assert [(row.record_id, row.hit_count) for row in rows] == [("D1", 5), ("D2", 1)]
+    assert rows[0].last_ts >= rows[0].ts and rows[1].last_ts is None
+    audit_writer.stop()
+
+
+def test_lost_first_row_is_rewritten_with_all_hits(engine) -> None:
+    audit_writer = AuditWriter(engine, flush_interval=3600, coalesce_window=60)
+    context = _context()
+    first = datetime.now(timezone.utc)
+    # Il primo accesso non è mai stato scritto (rollback della richiesta)
+    assert audit_writer.record_read(audit_row("READ", "dossiers", "D1", context, ts=first))
+    for second in (10, 20):
+        assert not audit_writer.record_read(audit_row("READ", "dossiers", "D1", context, ts=first + timedelta(seconds=second)))
+
+    assert audit_writer.flush(everything=True) == 1
+    with engine.connect() as conn:
+        row = conn.execute(select(AuditLog.hit_count, AuditLog.ts, AuditLog.last_ts)).one()
+    assert row.hit_count == 3 and row.last_ts - row.ts == timedelta(seconds=20)
+    audit_writer.stop()
+
+
+def test_coalesced_reads_close_after_the_window() -> None:
+    coalescer = ReadCoalescer(window_s=60)
+    start = datetime(2026, 10, 17, 8, 0, tzinfo=timezone.utc)
+    context = _context()
+    assert coalescer.add(audit_row("READ", "patient", "P1", context, ts=start))
+    assert not coalescer.add(audit_row("READ", "patient", "P1", context, ts=start + timedelta(seconds=5)))
+    assert coalescer.pop_ready(now=start + timedelta(seconds=30)) == []
+    [entry] = coalescer.pop_ready(now=start + timedelta(seconds=61))
+    assert (entry["record_id"], entry["extra_hits"]) == ("P1", 1)
+    # Dopo la finestra lo stesso accesso apre una nuova riga
+    assert coalescer.add(audit_row("READ", "patient", "P1", context, ts=start + timedelta(seconds=90)))
+
+
+def test_outbox_rows_move_to_audit_log_in_order(engine) -> None:
+    with engine.begin() as conn:
+        conn.execute(AuditOutbox.__table__.insert(), [
+            audit_row("UPDATE", "patient", i, _context(), after={"n": i}) for i in range(5)
+        ])
+
+    assert AuditWriter(engine, batch_size=2).drain_outbox() == 5
+    assert _count(engine, AuditOutbox) == 0
+    with engine.connect() as conn:
+        records = conn.execute(select(AuditLog.record_id).order_by(AuditLog.audit_id)).scalars().all()
+    assert records == ["0", "1", "2", "3", "4"]
+
+
+def test_write_events_share_the_transaction(engine, monkeypatch) -> None:
+    monkeypatch.setattr(writer, "AUDIT_WRITE_DELIVERY", "outbox")
+    setup_audit_listeners([Patient])
+    token = current_user_context.set({})
+    set_audit_context(user_id=str(uuid.uuid4()), username="mrossi", endpoint="POST /patients")
+    try:
+        def patient(i: int) -> Patient:
+            return Patient(
+                first_name="Mario", last_name="Rossi", fiscal_code=f"CF{i}",
+                date_of_birth=date(1950, 1, 1), place_of_birth="Pesaro", gender="M",
+            )
+
+        with Session(engine) as session:
+            session.add_all([patient(1), patient(2)])
+            session.flush()
+            session.rollback()
+            assert _count(engine, AuditOutbox) == 0
+
+            session.add_all([patient(3), patient(4)])
+            session.commit()
+        assert _count(engine, AuditOutbox) == 2
+        assert _count(engine, AuditLog) == 0
+    finally:
+        current_user_context.reset(token)
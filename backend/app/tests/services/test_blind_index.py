@@ -0,0 +1,50 @@
+import uuid
+from datetime import datetime
+
+import pytest
+from fastapi import HTTPException
+
+from app.models import ModuleEntry
+from app.services.blind_index import FieldFilter, blind_index, entry_blind_indexes, parse_field_filters
+
+
+def test_blind_index_normalizes_and_separates_fields() -> None:
+    assert blind_index("paziente.paziente_nominativo", "Mario  Rossi") == blind_index(
+        "paziente.paziente_nominativo", " mario rossi"
+    )
+    assert blind_index("punteggio_totale", 12) == blind_index("punteggio_totale", "12")
+    assert blind_index("punteggio_totale", 12) != blind_index("paziente.paziente_nominativo", 12)
+
+
+def test_entry_indexes_follow_registry_fields() -> None:
+    data = {"paziente": {"paziente_nominativo": "Mario Rossi"}, "punteggio_totale": 12, "note": "x"}
+    # punteggio_totale è proiettato in chiaro: nessun token (sarebbe un oracolo per l'HMAC)
+    assert set(entry_blind_indexes("ROG26/1.3", 1, data)) == {"paziente.paziente_nominativo"}
+    assert entry_blind_indexes("UNKNOWN", 1, data) == {}
+
+
+def test_set_data_keeps_blind_indexes_in_sync() -> None:
+    entry = ModuleEntry(
+        dossier_id=uuid.uuid4(), module_code="ROG26/1.3", schema_version=1, occurred_at=datetime.now()
+    )
+    entry.set_data({"paziente": {"paziente_nominativo": "Mario Rossi"}, "punteggio_totale": 12})
+    assert {index.field for index in entry.blind_indexes} == {"paziente.paziente_nominativo"}
+
+    entry.set_data({"paziente": {"paziente_nominativo": "Anna Bianchi"}})
+    assert [(index.field, index.token) for index in entry.blind_indexes] == [
+        ("paziente.paziente_nominativo", blind_index("paziente.paziente_nominativo", "anna bianchi"))
+    ]
+
+
+def test_field_filters_reject_unindexed_fields() -> None:
+    assert parse_field_filters(["paziente.paziente_nominativo=Mario Rossi", "punteggio_totale=12"], "ROG26/1.3") == [
+        FieldFilter("paziente.paziente_nominativo", token=blind_index("paziente.paziente_nominativo", "mario rossi")),
+        FieldFilter("punteggio_totale", num_value=12.0),
+    ]
+    assert parse_field_filters(["compilazione.compilatore=infermiere"], "ROG26/1.3") == [
+        FieldFilter("compilazione.compilatore", text_value="infermiere")
+    ]
+    with pytest.raises(HTTPException):
+        parse_field_filters(["note=x"], "ROG26/1.3")
+    with pytest.raises(HTTPException):
+        parse_field_filters(["punteggio_totale=12"], "ROG26/1.4")
@@ -0,0 +1,48 @@
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+from sqlalchemy.dialects import postgresql
+
+from app.models import Dossier
+from app.models.tables import CareLevel
+from app.services.dossier_stats import dossier_stats_statement, summarize_stats
+
+
+def _row(all_levels: int, all_months: int, care_level=None, month=None, total=0, discharged=0, avg=None) -> SimpleNamespace:
+    return SimpleNamespace(
+        all_levels=all_levels, all_months=all_months, care_level=care_level, month=month,
+        total=total, active=total - discharged, discharged=discharged, transferred=0,
+        avg_stay_days=avg, p50=avg, p90=avg,
+    )
+
+
+def test_statement_is_a_single_grouped_aggregation() -> None:
+    sql = str(dossier_stats_statement(Dossier.structure_id.is_not(None)).compile(dialect=postgresql.dialect()))
+    assert sql.count("SELECT") == 1
+    assert "GROUP BY GROUPING SETS((), (dossiers.care_level), (date_trunc('month', dossiers.admission_date)))" in sql
+    assert "count(*) FILTER (WHERE dossiers.status = " in sql
+    assert "percentile_cont(" in sql and "WITHIN GROUP (ORDER BY EXTRACT(epoch FROM" in sql
+
+
+def test_rows_are_split_into_total_levels_and_months() -> None:
+    rows = [
+        _row(1, 1, total=5, discharged=2, avg=12.345),
+        _row(0, 1, care_level=CareLevel.R3, total=3, discharged=2, avg=12.345),
+        _row(0, 1, care_level=CareLevel.R3D, total=2),
+        _row(1, 0, month=datetime(2026, 9, 1, tzinfo=timezone.utc), total=4, discharged=2, avg=12.345),
+        _row(1, 0, month=datetime(2026, 8, 1, tzinfo=timezone.utc), total=1),
+    ]
+    stats = summarize_stats(rows)
+
+    assert stats["total"] == 5
+    assert stats["by_status"] == {"active": 3, "discharged": 2, "transferred": 0}
+    assert stats["avg_stay_days"] == 12.3
+    assert stats["stay_days_percentiles"] == {"p50": 12.3, "p90": 12.3}
+    assert set(stats["by_care_level"]) == {"R3", "R3D"}
+    assert stats["by_care_level"]["R3D"]["avg_stay_days"] is None
+    assert [bucket["month"] for bucket in stats["by_month"]] == ["2026-08", "2026-09"]
+
+
+def test_no_dossiers() -> None:
+    stats = summarize_stats([])
+    assert stats["total"] == 0 and stats["by_month"] == [] and stats["by_care_level"] == {}
@@ -0,0 +1,165 @@
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.pool import StaticPool
+from sqlmodel import Session, create_engine, delete, select
+
+from app.models import BlindIndex, Dossier, DossierSummary, EntryProjection, ModuleEntry
+from app.services.dossier_summary import rebuild_dossier_summaries, summaries_for, summary_for
+
+
+@compiles(JSONB, "sqlite")
+def _jsonb_on_sqlite(type_, compiler, **kw):
+    return "JSON"
+
+
+@pytest.fixture
+def engine():
+    engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    for model in (Dossier, ModuleEntry, BlindIndex, EntryProjection, DossierSummary):
+        model.__table__.create(engine)
+    return engine
+
+
+@pytest.fixture
+def dossier_id(engine) -> uuid.UUID:
+    with Session(engine) as session:
+        dossier = Dossier(
+            patient_id=uuid.uuid4(), structure_id=uuid.uuid4(), care_level="R3",
+            admission_date=datetime.now(timezone.utc), created_by_user_id=uuid.uuid4(),
+        )
+        session.add(dossier)
+        session.commit()
+        return dossier.id
+
+
+def _entry(dossier_id: uuid.UUID, module_code: str, days_ago: int, data: dict) -> ModuleEntry:
+    entry = ModuleEntry(
+        dossier_id=dossier_id, module_code=module_code, schema_version=1,
+        occurred_at=datetime(2026, 10, 17, tzinfo=timezone.utc) - timedelta(days=days_ago),
+    )
+    entry.set_data(data)
+    return entry
+
+
+def _summary(engine, dossier_id: uuid.UUID) -> DossierSummary:
+    with Session(engine) as session:
+        return session.get(DossierSummary, dossier_id)
+
+
+def test_summary_follows_entry_writes(engine, dossier_id) -> None:
+    with Session(engine) as session:
+        latest = _entry(dossier_id, "ROG26/1.3", 1, {"punteggio_totale": 14})
+        session.add_all([
+            _entry(dossier_id, "ROG26/1.3", 5, {"punteggio_totale": 9}),
+            latest,
+            _entry(dossier_id, "ROG26/1.4", 0, {"tao": True}),
+        ])
+        session.commit()
+        latest_id = latest.id
+
+    summary = _summary(engine, dossier_id)
+    assert summary.entries_count == 3
+    assert summary.module_counts == {"ROG26/1.3": 2, "ROG26/1.4": 1}
+    assert summary.last_scores["ROG26/1.3"]["value"] == 14.0
+    assert "ROG26/1.4" not in summary.last_scores
+
+    # Soft delete dell'ultima valutazione: torna il punteggio precedente
+    with Session(engine) as session:
+        entry = session.get(ModuleEntry, latest_id)
+        entry.deleted_at = datetime.now(timezone.utc)
+        session.add(entry)
+        session.commit()
+    summary = _summary(engine, dossier_id)
+    assert summary.entries_count == 2
+    assert summary.last_scores["ROG26/1.3"]["value"] == 9.0
+
+    # Ripristino
+    with Session(engine) as session:
+        entry = session.get(ModuleEntry, latest_id)
+        entry.deleted_at = None
+        session.add(entry)
+        session.commit()
+    assert _summary(engine, dossier_id).module_counts == {"ROG26/1.3": 2, "ROG26/1.4": 1}
+
+
+def test_rebuild_and_fallback(engine, dossier_id) -> None:
+    with Session(engine) as session:
+        session.add(_entry(dossier_id, "ROG26/1.4", 0, {"tao": False}))
+        session.commit()
+        session.exec(delete(DossierSummary))
+        session.commit()
+
+        # Riga mancante: calcolata al volo senza scriverla
+        assert summary_for(session, dossier_id)["entries_count"] == 1
+        page = summaries_for(session, [dossier_id])
+        assert page[dossier_id].entries_count == 1
+        assert page[dossier_id].module_counts == {"ROG26/1.4": 1}
+        assert session.get(DossierSummary, dossier_id) is None
+
+        assert rebuild_dossier_summaries(session, batch_size=1) == 1
+    assert _summary(engine, dossier_id).module_counts == {"ROG26/1.4": 1}
+
+
+def test_writes_apply_deltas_and_recompute_only_the_latest(engine, dossier_id, monkeypatch) -> None:
+    from app.services import dossier_summary
+
+    with Session(engine) as session:
+        latest = _entry(dossier_id, "ROG26/1.3", 1, {"punteggio_totale": 14})
+        session.add(latest)
+        session.commit()
+        latest_id = latest.id
+
+    recomputed = []
+    compute = dossier_summary.compute_summaries
+    monkeypatch.setattr(
+        dossier_summary, "compute_summaries", lambda conn, ids: recomputed.extend(ids) or compute(conn, ids)
+    )
+
+    # Entry più vecchia dell'ultima: solo delta, nessun ricalcolo
+    with Session(engine) as session:
+        older = _entry(dossier_id, "ROG26/1.3", 5, {"punteggio_totale": 9})
+        session.add_all([older, _entry(dossier_id, "ROG26/1.4", 3, {"tao": True})])
+        session.commit()
+        older = session.get(ModuleEntry, older.id)
+        older.deleted_at = datetime.now(timezone.utc)
+        session.add(older)
+        session.commit()
+    summary = _summary(engine, dossier_id)
+    assert (summary.entries_count, summary.module_counts) == (2, {"ROG26/1.3": 1, "ROG26/1.4": 1})
+    assert summary.last_scores["ROG26/1.3"]["value"] == 14.0
+    assert recomputed == []
+
+    # Nuova entry più recente: massimo aggiornato senza ricalcolo
+    with Session(engine) as session:
+        session.add(_entry(dossier_id, "ROG26/1.3", 0, {"punteggio_totale": 20}))
+        session.commit()
+    summary = _summary(engine, dossier_id)
+    assert summary.last_scores["ROG26/1.3"]["value"] == 20.0
+    assert summary.last_entry_at.date() == datetime(2026, 10, 17).date()
+    assert recomputed == []
+
+    # La 14 non è più l'ultima: eliminarla è un delta
+    with Session(engine) as session:
+        entry = session.get(ModuleEntry, latest_id)
+        entry.deleted_at = datetime.now(timezone.utc)
+        session.add(entry)
+        session.commit()
+    assert recomputed == []
+    assert _summary(engine, dossier_id).module_counts == {"ROG26/1.3": 1, "ROG26/1.4": 1}
+
+    # Eliminata l'entry più recente: ricalcolo del solo dossier
+    with Session(engine) as session:
+        newest = session.exec(
+            select(ModuleEntry).where(ModuleEntry.deleted_at.is_(None), ModuleEntry.module_code == "ROG26/1.3")
+        ).one()
+        newest.deleted_at = datetime.now(timezone.utc)
+        session.add(newest)
+        session.commit()
+    assert recomputed == [dossier_id]
+    summary = _summary(engine, dossier_id)
+    assert (summary.entries_count, summary.module_counts) == (1, {"ROG26/1.4": 1})
+    assert "ROG26/1.3" not in summary.last_scores
@@ -0,0 +1,129 @@
+import uuid
+
+import pytest
+from cryptography.fernet import Fernet
+
+from app.services.encryption import (
+    FieldEncryption,
+    data_key_id_of,
+    field_encryption,
+    get_key_material,
+    is_binary_payload,
+    key_material_loaded,
+    legacy_to_binary,
+)
+
+
+def test_decrypt_dicts_roundtrip() -> None:
+    payloads = [{"i": i, "nome": "Mario"} for i in range(5)]
+    tokens = [field_encryption.encrypt_dict(p) for p in payloads]
+    assert field_encryption.decrypt_dicts(tokens) == payloads
+
+
+def test_decrypt_dicts_handles_empty_and_invalid() -> None:
+    token = field_encryption.encrypt_dict({"a": 1})
+    result = field_encryption.decrypt_dicts([token, None, "not-a-token", token])
+    assert result == [{"a": 1}, None, None, {"a": 1}]
+
+
+def test_decrypt_dicts_thread_pool() -> None:
+    enc = FieldEncryption(batch_executor="thread", batch_threshold=2, batch_workers=2)
+    try:
+        tokens = [enc.encrypt_dict({"i": i}) for i in range(10)]
+        assert enc.decrypt_dicts(tokens) == [{"i": i} for i in range(10)]
+    finally:
+        enc.shutdown()
+
+
+def test_binary_payload_reads_legacy_and_new_format() -> None:
+    legacy = field_encryption.encrypt_dict({"a": 1})
+    binary = field_encryption.encrypt_payload({"a": 1})
+    assert is_binary_payload(binary)
+    assert not is_binary_payload(legacy.encode())
+    assert len(binary) < len(legacy)
+    assert field_encryption.decrypt_dict(legacy) == {"a": 1}
+    assert field_encryption.decrypt_dict(legacy.encode()) == {"a": 1}
+    assert field_encryption.decrypt_dict(binary) == {"a": 1}
+    assert field_encryption.decrypt_dict(legacy_to_binary(legacy)) == {"a": 1}
+
+
+def test_compressed_payload_with_dictionary() -> None:
+    payload = {"sezioni": [{"descrizione": "Autonomo", "punteggio": i % 4} for i in range(20)]}
+    enc = FieldEncryption(compression="zlib")
+    enc.register_dictionary(1, "TEST", b'"descrizione": "Autonomo""punteggio": ')
+    with_dict = enc.encrypt_payload(payload, "TEST")
+    without_dict = enc.encrypt_payload(payload)
+    assert enc.decrypt_dict(with_dict) == payload
+    assert enc.decrypt_dict(without_dict) == payload
+    assert len(with_dict) < len(field_encryption.encrypt_payload(payload))
+
+    # Un processo senza dizionario registrato legge comunque le righe senza dizionario
+    other = FieldEncryption(compression="none")
+    assert other.decrypt_dict(without_dict) == payload
+    with pytest.raises(LookupError):
+        other.decrypt_dict(with_dict)
+
+
+def test_key_material_is_shared_and_warm_up_reports_timings() -> None:
+    enc = FieldEncryption()
+    timings = enc.warm_up()
+    assert "key_material_ms" in timings
+    assert key_material_loaded()
+    assert enc._key is get_key_material() is field_encryption._key
+    assert enc.decrypt_dict(field_encryption.encrypt_payload({"a": 1})) == {"a": 1}
+
+
+class _MemoryDataKeys:
+    def __init__(self) -> None:
+        self.rows: dict[uuid.UUID, tuple[str, uuid.UUID, bytes]] = {}
+
+    def find(self, owner_type, owner_id, connection=None):
+        for key_id, (row_type, row_owner, wrapped) in self.rows.items():
+            if (row_type, row_owner) == (owner_type, owner_id):
+                return key_id, wrapped
+        return None
+
+    def get_many(self, key_ids, connection=None):
+        return {key_id: self.rows[key_id][2] for key_id in key_ids if key_id in self.rows}
+
+    def create(self, owner_type, owner_id, wrapped_key, master_key_id, connection=None):
+        key_id = uuid.uuid4()
+        self.rows[key_id] = (owner_type, owner_id, wrapped_key)
+        return key_id, wrapped_key
+
+
+def test_envelope_requires_a_separate_master_key(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.delenv("ENCRYPTION_MASTER_KEYS", raising=False)
+    with pytest.raises(RuntimeError):
+        FieldEncryption().set_data_key_source(_MemoryDataKeys())
+    monkeypatch.setenv("ENCRYPTION_MASTER_KEYS", get_key_material().decode())
+    with pytest.raises(RuntimeError):
+        FieldEncryption().set_data_key_source(_MemoryDataKeys())
+
+
+def test_envelope_payload_uses_dossier_data_key(monkeypatch: pytest.MonkeyPatch) -> None:
+    old_master = Fernet.generate_key().decode()
+    monkeypatch.setenv("ENCRYPTION_MASTER_KEYS", old_master)
+    keys = _MemoryDataKeys()
+    enc = FieldEncryption()
+    enc.set_data_key_source(keys)
+    dossier_a, dossier_b = uuid.uuid4(), uuid.uuid4()
+    tokens = [enc.encrypt_payload({"i": i}, dossier_id=dossier_a if i % 2 else dossier_b) for i in range(4)]
+    assert len(keys.rows) == 2
+    assert data_key_id_of(tokens[0]) != data_key_id_of(tokens[1])
+    patient_card = enc.encrypt_str("ABC123", owner_id=uuid.uuid4())
+
+    # Rotazione della master key: cambiano solo le DEK cifrate, non i payload
+    new_master = Fernet.generate_key().decode()
+    monkeypatch.setenv("ENCRYPTION_MASTER_KEYS", f"{new_master},{old_master}")
+    rotating = FieldEncryption()
+    for key_id, (owner_type, owner_id, wrapped) in list(keys.rows.items()):
+        keys.rows[key_id] = (owner_type, owner_id, rotating.rewrap_key(wrapped))
+
+    monkeypatch.setenv("ENCRYPTION_MASTER_KEYS", new_master)
+    reader = FieldEncryption()
+    reader.set_data_key_source(keys)
+    assert reader.decrypt_dicts(tokens) == [{"i": i} for i in range(4)]
+    assert reader.decrypt_str(patient_card) == "ABC123"
+    with pytest.raises(LookupError):
+        FieldEncryption().decrypt_dict(tokens[0])
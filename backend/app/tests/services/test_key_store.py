@@ -0,0 +1,126 @@
+import os
+import uuid
+
+import pytest
+from cryptography.fernet import Fernet
+from sqlalchemy import create_engine, select
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.pool import StaticPool
+
+from app.core.config import settings
+from app.models import DataKey
+from app.services import key_store
+from app.services.encryption import FieldEncryption, master_key_id
+from app.services.key_store import DataKeyStore, rewrap_data_keys
+
+OLD_MASTER = Fernet.generate_key().decode()
+NEW_MASTER = Fernet.generate_key().decode()
+
+
+@pytest.fixture
+def engine():
+    engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    DataKey.__table__.create(engine)
+    return engine
+
+
+def _encryption(monkeypatch, master_keys: str) -> FieldEncryption:
+    monkeypatch.setenv("ENCRYPTION_MASTER_KEYS", master_keys)
+    enc = FieldEncryption()
+    monkeypatch.setattr(key_store, "field_encryption", enc)
+    return enc
+
+
+def _seed_payloads(engine, monkeypatch, dossiers: int) -> list[bytes]:
+    enc = _encryption(monkeypatch, OLD_MASTER)
+    enc.set_data_key_source(DataKeyStore(engine))
+    return [enc.encrypt_payload({"i": i}, dossier_id=uuid.uuid4()) for i in range(dossiers)]
+
+
+def _master_key_ids(engine) -> list[str]:
+    with engine.connect() as conn:
+        return list(conn.execute(select(DataKey.__table__.c.master_key_id)).scalars())
+
+
+def test_data_key_follows_the_caller_transaction(engine) -> None:
+    store = DataKeyStore(engine)
+    owner = uuid.uuid4()
+    with engine.connect() as conn:
+        with conn.begin() as transaction:
+            created = store.create("dossier", owner, b"wrapped", "old", connection=conn)
+            # Seconda creazione: vince la DEK già salvata
+            assert store.create("dossier", owner, b"other", "old", connection=conn) == created
+            assert store.find("dossier", owner, connection=conn) == created
+            transaction.rollback()
+    assert store.find("dossier", owner) is None
+
+    created = store.create("dossier", owner, b"wrapped", "old")
+    assert store.get_many([created[0]]) == {created[0]: b"wrapped"}
+
+
+def test_rotation_resumes_and_old_master_still_decrypts(engine, monkeypatch) -> None:
+    payloads = _seed_payloads(engine, monkeypatch, dossiers=5)
+    rotating = _encryption(monkeypatch, f"{NEW_MASTER},{OLD_MASTER}")
+
+    class Interrupted(Exception):
+        pass
+
+    def stop_after_first_batch(progress):
+        raise Interrupted
+
+    with pytest.raises(Interrupted):
+        rewrap_data_keys(engine, batch_size=2, on_progress=stop_after_first_batch)
+    ids = _master_key_ids(engine)
+    assert ids.count(master_key_id(NEW_MASTER.encode())) == 2
+
+    # A metà rotazione le DEK di entrambe le master key si leggono
+    reader = FieldEncryption()
+    reader.set_data_key_source(DataKeyStore(engine))
+    assert reader.decrypt_dicts(payloads) == [{"i": i} for i in range(5)]
+
+    progress = rewrap_data_keys(engine, batch_size=2)
+    assert progress.total == 3 and progress.rewrapped == 3
+    assert set(_master_key_ids(engine)) == {rotating.primary_master_key_id}
+
+    # Rotazione completa: la vecchia master key non serve più
+    _encryption(monkeypatch, NEW_MASTER)
+    reader = FieldEncryption()
+    reader.set_data_key_source(DataKeyStore(engine))
+    assert reader.decrypt_dicts(payloads) == [{"i": i} for i in range(5)]
+
+
+def test_data_key_cache_is_bounded(engine, monkeypatch) -> None:
+    monkeypatch.setattr("app.services.encryption.ENCRYPTION_DATA_KEY_CACHE_SIZE", 3)
+    enc = _encryption(monkeypatch, OLD_MASTER)
+    enc.set_data_key_source(DataKeyStore(engine))
+    payloads = [enc.encrypt_payload({"i": i}, dossier_id=uuid.uuid4()) for i in range(10)]
+    assert len(enc._data_keys) == 3
+    assert enc.decrypt_dicts(payloads) == [{"i": i} for i in range(10)]
+
+
+def test_concurrent_rotation_workers_skip_locked_rows(monkeypatch) -> None:
+    """Più worker sulla stessa tabella: ogni DEK ruotata una sola volta (serve PostgreSQL)"""
+    url = os.getenv("QUERY_PLAN_DATABASE_URL", str(settings.SQLALCHEMY_DATABASE_URI))
+    schema = f"key_store_{uuid.uuid4().hex[:8]}"
+    engine = create_engine(url, connect_args={"connect_timeout": 3, "options": f"-csearch_path={schema}"})
+    try:
+        with engine.begin() as conn:
+            conn.exec_driver_sql(f"CREATE SCHEMA {schema}")
+            DataKey.__table__.create(conn)
+    except OperationalError as e:
+        pytest.skip(f"PostgreSQL non raggiungibile: {e}")
+    try:
+        payloads = _seed_payloads(engine, monkeypatch, dossiers=200)
+        _encryption(monkeypatch, f"{NEW_MASTER},{OLD_MASTER}")
+        progress = rewrap_data_keys(engine, batch_size=10, workers=4)
+        assert (progress.rewrapped, progress.failed) == (200, 0)
+        assert set(_master_key_ids(engine)) == {master_key_id(NEW_MASTER.encode())}
+
+        _encryption(monkeypatch, NEW_MASTER)
+        reader = FieldEncryption()
+        reader.set_data_key_source(DataKeyStore(engine))
+        assert reader.decrypt_dicts(payloads) == [{"i": i} for i in range(200)]
+    finally:
+        with engine.begin() as conn:
+            conn.exec_driver_sql(f"DROP SCHEMA {schema} CASCADE")
+        engine.dispose()
@@ -0,0 +1,106 @@
+import uuid
+from datetime import datetime, timezone
+
+import pytest
+from sqlalchemy import event, func, select
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.pool import StaticPool
+from sqlmodel import Session, create_engine
+
+from app.models import AuditLog, AuditOutbox, BlindIndex, Dossier, DossierSummary, EntryProjection, ModuleEntry
+from app.services import audit_writer as writer
+from app.services.audit import current_user_context, set_audit_context
+from app.services.lifecycle import restore_dossier_entries, soft_delete_dossier_entries, soft_delete_patient_dossiers
+
+
+@compiles(JSONB, "sqlite")
+def _jsonb_on_sqlite(type_, compiler, **kw):
+    return "JSON"
+
+
+@pytest.fixture
+def engine(monkeypatch):
+    monkeypatch.setattr(writer, "AUDIT_WRITE_DELIVERY", "direct")
+    engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    for model in (Dossier, ModuleEntry, BlindIndex, EntryProjection, DossierSummary, AuditLog, AuditOutbox):
+        model.__table__.create(engine)
+    return engine
+
+
+@pytest.fixture
+def audit_context():
+    token = current_user_context.set({})
+    set_audit_context(user_id=str(uuid.uuid4()), username="mrossi", endpoint="DELETE /dossiers/x")
+    yield
+    current_user_context.reset(token)
+
+
+def _dossier(session: Session, patient_id: uuid.UUID) -> Dossier:
+    dossier = Dossier(
+        patient_id=patient_id, structure_id=uuid.uuid4(), care_level="R3",
+        admission_date=datetime.now(timezone.utc), created_by_user_id=uuid.uuid4(),
+    )
+    session.add(dossier)
+    session.flush()
+    return dossier
+
+
+def _entries(session: Session, dossier_id: uuid.UUID, n: int) -> None:
+    for _ in range(n):
+        entry = ModuleEntry(
+            dossier_id=dossier_id, module_code="ROG26/1.4", schema_version=1,
+            occurred_at=datetime.now(timezone.utc),
+        )
+        entry.set_data({"tao": True})
+        session.add(entry)
+    session.commit()
+
+
+def _audit(engine) -> list:
+    with engine.connect() as conn:
+        return conn.execute(select(AuditLog.table_name, AuditLog.before, AuditLog.after)).all()
+
+
+def test_entry_cascade_is_one_update_with_batched_audit(engine, audit_context) -> None:
+    user_id = uuid.uuid4()
+    with Session(engine) as session:
+        dossier_id = _dossier(session, uuid.uuid4()).id
+        _entries(session, dossier_id, 50)
+
+    updates = []
+    event.listen(engine, "before_cursor_execute", lambda conn, cursor, statement, *args: updates.append(statement) if statement.startswith("UPDATE module_entry") else None)
+    with Session(engine) as session:
+        assert len(soft_delete_dossier_entries(session, dossier_id, user_id)) == 50
+        session.commit()
+    assert len(updates) == 1
+
+    rows = _audit(engine)
+    assert len(rows) == 50
+    table_name, before, after = rows[0]
+    assert table_name == "module_entry"
+    assert before == {"deleted_at": None, "deleted_by_user_id": None}
+    assert after["deleted_by_user_id"] == str(user_id) and after["data"] == "<encrypted>"
+    with Session(engine) as session:
+        assert session.get(DossierSummary, dossier_id).entries_count == 0
+
+        assert len(restore_dossier_entries(session, dossier_id)) == 50
+        assert soft_delete_dossier_entries(session, uuid.uuid4(), user_id) == []
+        session.commit()
+        assert session.get(DossierSummary, dossier_id).entries_count == 50
+        live = session.exec(select(func.count()).select_from(ModuleEntry).where(ModuleEntry.deleted_at.is_(None))).one()
+    assert live == (50,)
+    assert _audit(engine)[-1].after["deleted_at"] is None
+
+
+def test_patient_cascade_skips_already_deleted_dossiers(engine, audit_context) -> None:
+    patient_id = uuid.uuid4()
+    with Session(engine) as session:
+        first, second = _dossier(session, patient_id), _dossier(session, patient_id)
+        second.deleted_at = datetime.now(timezone.utc)
+        session.commit()
+        first_id = first.id
+
+        assert soft_delete_patient_dossiers(session, patient_id, uuid.uuid4()) == [first_id]
+        session.commit()
+    assert [row.table_name for row in _audit(engine)] == ["dossiers"]
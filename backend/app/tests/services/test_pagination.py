@@ -0,0 +1,71 @@
+from datetime import date
+
+import pytest
+from fastapi import HTTPException
+from sqlmodel import Session, create_engine, select
+
+from app.models import Patient
+from app.services.pagination import count_cache, decode_cursor, paginate
+
+ORDER = [Patient.last_name, Patient.first_name, Patient.id]
+
+
+@pytest.fixture
+def patient_session():
+    engine = create_engine("sqlite://")
+    Patient.__table__.create(engine)
+    with Session(engine) as session:
+        for i in range(7):
+            session.add(Patient(
+                first_name=f"Nome{i % 2}", last_name=f"Cognome{i % 3}", fiscal_code=f"CF{i}",
+                date_of_birth=date(1950, 1, 1), place_of_birth="Pesaro", gender="M",
+            ))
+        session.commit()
+        yield session
+
+
+def test_cursor_mode_walks_same_order_as_page_mode(patient_session: Session) -> None:
+    stmt = select(Patient)
+    expected = [p.id for p in paginate(patient_session, stmt, ORDER, direction="asc", page_size=10).items]
+
+    seen, cursor = [], ""
+    while cursor is not None:
+        result = paginate(patient_session, stmt, ORDER, direction="asc", page_size=3, cursor=cursor)
+        assert result.total is None
+        seen += [p.id for p in result.items]
+        cursor = result.next_cursor
+    assert seen == expected
+
+
+def test_page_mode_keeps_total_and_has_next(patient_session: Session) -> None:
+    result = paginate(patient_session, select(Patient), ORDER, direction="asc", page=3, page_size=3)
+    assert result.total == 7
+    assert len(result.items) == 1
+    assert not result.has_next
+
+
+def test_cursor_from_another_ordering_is_rejected(patient_session: Session) -> None:
+    result = paginate(patient_session, select(Patient), ORDER, direction="asc", page_size=3)
+    with pytest.raises(HTTPException):
+        decode_cursor([Patient.last_name, Patient.id], result.next_cursor)
+    with pytest.raises(HTTPException):
+        decode_cursor(ORDER, "not-a-cursor")
+
+
+def test_count_strategies(patient_session: Session) -> None:
+    stmt = select(Patient).where(Patient.gender == "M")
+    count_cache.clear()
+    assert paginate(patient_session, stmt, ORDER, direction="asc", page_size=3, count="none").total is None
+    assert paginate(patient_session, stmt, ORDER, direction="asc", page_size=3, count="cached").total == 7
+
+    # Il valore in cache viene riusato anche se i dati cambiano, fino alla scadenza del TTL
+    patient = patient_session.exec(select(Patient)).first()
+    patient.gender = "F"
+    patient_session.add(patient)
+    patient_session.commit()
+    assert paginate(patient_session, stmt, ORDER, direction="asc", page_size=3, count="cached").total == 7
+    assert paginate(patient_session, stmt, ORDER, direction="asc", page_size=3, count="exact").total == 6
+
+    # Fuori da Postgres la stima ricade sul conteggio esatto
+    result = paginate(patient_session, stmt, ORDER, direction="asc", page_size=3, count="estimate")
+    assert (result.total, result.total_estimated) == (6, False)
@@ -0,0 +1,95 @@
+import asyncio
+import threading
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy.pool import StaticPool
+from sqlmodel import Session, create_engine
+
+from app import crud
+from app.core import security
+from app.models import User
+from app.services.password_hasher import MAX_PENDING_LIMIT, PasswordHasher, hash_rounds
+
+
+def test_hash_and_verify_in_pool() -> None:
+    hasher = PasswordHasher("thread", workers=2, max_pending=4, rounds=4)
+    hashed = hasher.hash("cambio-turno")
+    assert hash_rounds(hashed) == 4
+    assert hasher.verify("cambio-turno", hashed)
+    assert not hasher.verify("sbagliata", hashed)
+    assert not hasher.needs_rehash(hashed)
+    assert PasswordHasher("none", rounds=5).needs_rehash(hashed)
+    hasher.shutdown()
+
+
+def test_overload_is_rejected_with_503() -> None:
+    hasher = PasswordHasher("thread", workers=1, max_pending=1, rounds=4)
+    hasher._slots.acquire()  # una verifica già in corso
+    with pytest.raises(HTTPException) as overloaded:
+        hasher.verify("x", "$2b$04$" + "a" * 53)
+    assert overloaded.value.status_code == 503
+    assert overloaded.value.headers == {"Retry-After": "1"}
+    hasher._slots.release()
+    hasher.shutdown()
+
+
+def test_timed_out_task_keeps_its_slot_until_it_finishes() -> None:
+    hasher = PasswordHasher("thread", workers=1, max_pending=1, rounds=4, timeout=0.05)
+    release = threading.Event()
+    with pytest.raises(HTTPException) as timed_out:
+        hasher._run(release.wait)
+    assert timed_out.value.status_code == 503
+    # Il task è ancora nel pool: nessuno slot libero
+    with pytest.raises(HTTPException):
+        hasher.verify("x", "$2b$04$" + "a" * 53)
+    release.set()
+    hasher.shutdown()
+    assert hasher._slots.acquire(blocking=False)
+
+
+def test_async_timeout_keeps_the_slot() -> None:
+    hasher = PasswordHasher("thread", workers=1, max_pending=1, rounds=4, timeout=0.05)
+    release = threading.Event()
+    with pytest.raises(HTTPException):
+        asyncio.run(hasher._arun(release.wait))
+    assert not hasher._slots.acquire(blocking=False)
+    release.set()
+    hasher.shutdown()
+    hashed = PasswordHasher("none", rounds=4).hash("cambio-turno")
+    assert asyncio.run(hasher.averify("cambio-turno", hashed))
+    hasher.shutdown()
+
+
+def test_max_pending_stays_below_the_anyio_limiter() -> None:
+    assert PasswordHasher("thread", max_pending=1000).max_pending == MAX_PENDING_LIMIT < 40
+
+
+def test_login_rehashes_when_cost_changes(monkeypatch) -> None:
+    engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    User.__table__.create(engine)
+    old_hash = PasswordHasher("none", rounds=4).hash("cambio-turno")
+    with Session(engine) as session:
+        session.add(User(first_name="Mario", last_name="Rossi", username="mrossi", hashed_password=old_hash))
+        session.commit()
+
+    monkeypatch.setattr(security, "password_hasher", PasswordHasher("none", rounds=5))
+    with Session(engine) as session:
+        user = crud.authenticate(session=session, email="mrossi", password="cambio-turno")
+        assert hash_rounds(user.hashed_password) == 5
+        assert crud.authenticate(session=session, email="mrossi", password="altra") is None
+
+
+def test_async_login_rehashes_when_cost_changes(monkeypatch) -> None:
+    engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    User.__table__.create(engine)
+    old_hash = PasswordHasher("none", rounds=4).hash("cambio-turno")
+    with Session(engine) as session:
+        session.add(User(first_name="Mario", last_name="Rossi", username="mrossi", hashed_password=old_hash))
+        session.commit()
+
+    monkeypatch.setattr(security, "password_hasher", PasswordHasher("none", rounds=5))
+    with Session(engine) as session:
+        user = asyncio.run(crud.authenticate_async(session=session, email="mrossi", password="cambio-turno"))
+        assert hash_rounds(user.hashed_password) == 5
+        assert asyncio.run(crud.authenticate_async(session=session, email="mrossi", password="altra")) is None
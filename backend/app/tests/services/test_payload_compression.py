@@ -0,0 +1,28 @@
+import json
+import zlib
+
+from app.services.payload_compression import module_vocabulary, train_dictionary
+
+
+def _sample(name: str, firma: str) -> bytes:
+    payload = {
+        "paziente": {"paziente_nominativo": name, "anno": 2026, "numero_progressivo": 1},
+        "compilazione": {"data_compilazione": "2026-10-17", "compilatore": "infermiere", "firma": firma},
+        "punteggio_totale": 120,
+    }
+    return json.dumps(payload, ensure_ascii=False).encode("utf-8")
+
+
+def test_dictionary_holds_only_schema_material() -> None:
+    samples = [_sample("Mario Rossi", "Anna Bianchi") for _ in range(3)]
+    dictionary = train_dictionary(samples, module_vocabulary("ROG26/1.3"))
+
+    assert b"Mario Rossi" not in dictionary
+    assert b"Anna Bianchi" not in dictionary
+    assert b"120" not in dictionary
+    assert b'"paziente_nominativo": ' in dictionary
+    assert b'"compilatore": "infermiere"' in dictionary
+
+    compressor = zlib.compressobj(zdict=dictionary)
+    packed = compressor.compress(samples[0]) + compressor.flush()
+    assert zlib.decompressobj(zdict=dictionary).decompress(packed) == samples[0]
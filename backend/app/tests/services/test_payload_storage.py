@@ -0,0 +1,98 @@
+import base64
+import uuid
+from datetime import date, datetime, timezone
+
+import pytest
+from cryptography.fernet import Fernet
+from sqlalchemy import create_engine, insert, select
+from sqlalchemy.pool import StaticPool
+
+from app.models import DataKey, ModuleEntry, Patient
+from app.services import payload_storage
+from app.services.encryption import PAYLOAD_FORMAT_ENVELOPE, FieldEncryption
+from app.services.key_store import DataKeyStore
+from app.services.payload_storage import count_global_key_payloads, reencode_to_envelope
+
+MASTER = Fernet.generate_key().decode()
+
+
+@pytest.fixture
+def engine():
+    engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    for model in (DataKey, ModuleEntry, Patient):
+        model.__table__.create(engine)
+    return engine
+
+
+@pytest.fixture
+def enc(engine, monkeypatch) -> FieldEncryption:
+    monkeypatch.setenv("ENCRYPTION_MASTER_KEYS", MASTER)
+    enc = FieldEncryption()
+    monkeypatch.setattr(payload_storage, "field_encryption", enc)
+    return enc
+
+
+def _seed(engine, enc: FieldEncryption) -> tuple[list[uuid.UUID], list[uuid.UUID]]:
+    """Payload 0x01 e legacy, più tessere sanitarie, tutti sotto la chiave globale"""
+    dossiers = [uuid.uuid4() for _ in range(5)]
+    patients = [uuid.uuid4() for _ in range(3)]
+    with engine.begin() as conn:
+        for i, dossier_id in enumerate(dossiers):
+            frame = enc.encrypt_payload({"i": i})
+            if i % 2:
+                frame = base64.b64encode(base64.urlsafe_b64encode(frame[1:]))
+            conn.execute(insert(ModuleEntry.__table__).values(
+                id=uuid.uuid4(), dossier_id=dossier_id, module_code="ROG26/1.3", schema_version=1,
+                data=frame, occurred_at=datetime.now(timezone.utc),
+            ))
+        for i, patient_id in enumerate(patients):
+            conn.execute(insert(Patient.__table__).values(
+                id=patient_id, first_name="Mario", last_name="Rossi", fiscal_code=f"RSSMRA0000000{i:03d}",
+                date_of_birth=date(1940, 1, 1), place_of_birth="Pesaro", gender="M",
+                health_card_number=enc.encrypt_str(f"8038000000000000{i:04d}"),
+            ))
+    return dossiers, patients
+
+
+def test_global_key_payloads_move_to_owner_envelopes(engine, enc) -> None:
+    dossiers, patients = _seed(engine, enc)
+    assert count_global_key_payloads(engine) == 8
+
+    with pytest.raises(RuntimeError):
+        reencode_to_envelope(engine)
+    enc.set_data_key_source(DataKeyStore(engine))
+
+    class Interrupted(Exception):
+        pass
+
+    def stop_after_first_batch(progress):
+        raise Interrupted
+
+    with pytest.raises(Interrupted):
+        reencode_to_envelope(engine, batch_size=2, on_progress=stop_after_first_batch)
+    assert count_global_key_payloads(engine) == 6
+
+    progress = reencode_to_envelope(engine, batch_size=2)
+    assert (progress.total, progress.converted, progress.failed) == (6, 6, 0)
+    assert count_global_key_payloads(engine) == 0
+
+    with engine.connect() as conn:
+        entries = conn.execute(
+            select(ModuleEntry.__table__.c.dossier_id, ModuleEntry.__table__.c.data)
+        ).all()
+        cards = conn.execute(
+            select(Patient.__table__.c.id, Patient.__table__.c.health_card_number).order_by(Patient.__table__.c.fiscal_code)
+        ).all()
+    assert all(data[0] == PAYLOAD_FORMAT_ENVELOPE for _, data in entries)
+
+    # Ricifrati: la chiave globale non serve più per leggerli
+    reader = FieldEncryption()
+    reader._fernet_instance = Fernet(Fernet.generate_key())
+    reader.set_data_key_source(DataKeyStore(engine))
+    by_dossier = {dossier_id: reader.decrypt_dict(data) for dossier_id, data in entries}
+    assert [by_dossier[dossier_id] for dossier_id in dossiers] == [{"i": i} for i in range(5)]
+    assert [reader.decrypt_str(card) for _, card in cards] == [f"8038000000000000{i:04d}" for i in range(3)]
+
+    store = DataKeyStore(engine)
+    assert all(store.find("dossier", dossier_id) for dossier_id in dossiers)
+    assert all(store.find("patient", patient_id) for patient_id in patients)
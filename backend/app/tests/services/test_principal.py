@@ -0,0 +1,158 @@
+import uuid
+from time import sleep
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.pool import StaticPool
+from sqlmodel import Session, create_engine
+
+from app.models import Role, Structure, User
+from app.services import principal as principal_module
+from app.services.principal import (
+    Principal,
+    PrincipalCache,
+    get_principal,
+    invalidate_principals,
+    load_principal,
+    principal_claims,
+    principal_from_token,
+)
+from app.services.rbac import check_module_access
+
+
+@pytest.fixture
+def engine():
+    engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    for table in (Role.__table__, Structure.__table__, User.__table__):
+        table.create(engine)
+    return engine
+
+
+@pytest.fixture
+def cache(monkeypatch) -> PrincipalCache:
+    cache = PrincipalCache(ttl=60)
+    monkeypatch.setattr(principal_module, "principal_cache", cache)
+    return cache
+
+
+def _principal(role_id: uuid.UUID | None = None) -> Principal:
+    return Principal(
+        id=uuid.uuid4(), username="mrossi", structure_id=None, role_id=role_id,
+        role_name="medico", modules=("ROG26/1.1",), is_superuser=False, is_active=True,
+    )
+
+
+def _seed(engine) -> tuple[uuid.UUID, uuid.UUID]:
+    with Session(engine) as session:
+        role = Role(name="medico", modules=["ROG26/1.1", "ROG26/2.1"])
+        session.add(role)
+        session.flush()
+        user = User(first_name="Mario", last_name="Rossi", username="mrossi", hashed_password="x", role_id=role.id)
+        session.add(user)
+        session.commit()
+        return user.id, role.id
+
+
+def test_cache_expires_and_invalidates_by_role() -> None:
+    cache = PrincipalCache(ttl=0.05)
+    role_id = uuid.uuid4()
+    first, second, other = _principal(role_id), _principal(role_id), _principal()
+    for principal in (first, second, other):
+        cache.set(principal)
+
+    cache.invalidate_role(role_id)
+    assert cache.get(first.id) is None and cache.get(second.id) is None
+    assert cache.get(other.id) is other
+
+    sleep(0.06)
+    assert cache.get(other.id) is None
+
+
+def test_warm_cache_needs_no_queries(engine, cache) -> None:
+    user_id, _ = _seed(engine)
+    statements = []
+    event.listen(engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+
+    with Session(engine) as session:
+        principal = get_principal(session, user_id)
+    assert principal.modules == ("ROG26/1.1", "ROG26/2.1")
+    assert len(statements) == 1
+
+    with Session(engine) as session:
+        assert get_principal(session, user_id) is principal
+        check_module_access(session, principal, "ROG26/2.1", "READ")
+    assert len(statements) == 1
+
+
+def test_role_change_is_visible_after_commit(engine, cache) -> None:
+    user_id, role_id = _seed(engine)
+    with Session(engine) as session:
+        assert get_principal(session, user_id).modules == ("ROG26/1.1", "ROG26/2.1")
+
+    with Session(engine) as session:
+        role = session.get(Role, role_id)
+        role.modules = ["ROG26/1.1"]
+        session.add(role)
+        invalidate_principals(session, role_id=role_id)
+        # Ricaricato prima del commit: valore vecchio, scartato al commit
+        cache.set(Principal.from_user(session.get(User, user_id), None))
+        session.commit()
+
+    assert cache.get(user_id) is None
+    with Session(engine) as session:
+        assert get_principal(session, user_id).modules == ("ROG26/1.1",)
+
+
+def test_token_claims_until_permissions_change(engine, cache) -> None:
+    user_id, role_id = _seed(engine)
+    with Session(engine) as session:
+        claims = principal_claims(load_principal(session, user_id))
+    cache.clear()
+    statements = []
+    event.listen(engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+
+    # Cache fredda: solo la lettura della versione, poi i claim bastano
+    with Session(engine) as session:
+        assert principal_from_token(session, user_id, claims).modules == ("ROG26/1.1", "ROG26/2.1")
+        assert principal_from_token(session, user_id, claims).role_id == role_id
+    assert len(statements) == 1
+
+    with Session(engine) as session:
+        role = session.get(Role, role_id)
+        role.modules = []
+        session.add(role)
+        invalidate_principals(session, role_id=role_id)
+        session.commit()
+
+    # Token emesso prima della modifica: versione vecchia, permessi dal DB
+    with Session(engine) as session:
+        principal = principal_from_token(session, user_id, claims)
+    assert principal.modules == ()
+    assert principal.permissions_version == claims["perm"]["version"] + 1
+
+
+def test_newer_token_refreshes_a_stale_cache_entry(engine, cache) -> None:
+    user_id, role_id = _seed(engine)
+    with Session(engine) as session:
+        stale = get_principal(session, user_id)
+        claims = principal_claims(stale)
+
+    # Modifica fatta da un altro worker: questa cache non riceve l'invalidazione
+    other_worker = PrincipalCache(ttl=60)
+    principal_module.principal_cache = other_worker
+    with Session(engine) as session:
+        role = session.get(Role, role_id)
+        role.modules = ["ROG26/1.1"]
+        session.add(role)
+        invalidate_principals(session, role_id=role_id)
+        session.commit()
+        fresh_claims = principal_claims(load_principal(session, user_id))
+    principal_module.principal_cache = cache
+
+    with Session(engine) as session:
+        # Token vecchio: la voce in cache è allineata al token
+        assert principal_from_token(session, user_id, claims) is stale
+        # Token nuovo: versione più recente della cache, permessi dal DB
+        principal = principal_from_token(session, user_id, fresh_claims)
+    assert principal.modules == ("ROG26/1.1",)
+    assert cache.get(user_id) is principal
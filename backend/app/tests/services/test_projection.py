@@ -0,0 +1,55 @@
+import uuid
+from datetime import datetime
+
+from sqlalchemy.pool import StaticPool
+from sqlmodel import Session, create_engine, select
+
+from app.models import BlindIndex, EntryProjection, ModuleEntry
+from app.services.projection import backfill_projections, entry_projections, project_value, projected_fields
+
+
+def test_project_value_types() -> None:
+    assert project_value(True) == (1.0, "true")
+    assert project_value(12) == (12.0, None)
+    assert project_value("R3") == (None, "R3")
+    assert project_value(None) is None
+    assert project_value({"a": 1}) is None
+
+
+def test_only_declared_fields_are_projected() -> None:
+    data = {"punteggio_totale": 12, "strutt": "R3", "paziente": {"paziente_nominativo": "Mario Rossi"}}
+    projections = entry_projections("ROG26/1.3", 1, data)
+    assert projections == {"punteggio_totale": (12.0, None), "strutt": (None, "R3")}
+    assert "paziente.paziente_nominativo" not in projected_fields("ROG26/1.3")
+
+
+def test_set_data_keeps_projections_in_sync() -> None:
+    entry = ModuleEntry(
+        dossier_id=uuid.uuid4(), module_code="ROG26/1.3", schema_version=1, occurred_at=datetime.now()
+    )
+    entry.set_data({"punteggio_totale": 12, "strutt": "R3"})
+    entry.set_data({"punteggio_totale": 10})
+    assert [(p.field, p.num_value, p.module_code) for p in entry.projections] == [
+        ("punteggio_totale", 10.0, "ROG26/1.3")
+    ]
+
+
+def test_clinical_fields_are_not_projected_and_backfill_purges_them() -> None:
+    assert projected_fields("ROG26/1.4") == ()
+    assert entry_projections("ROG26/1.4", 1, {"tao": True, "paziente": {"peso_kg": 70}}) == {}
+
+    engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    for model in (ModuleEntry, BlindIndex, EntryProjection):
+        model.__table__.create(engine)
+    with Session(engine) as session:
+        entry_id = uuid.uuid4()
+        # Righe scritte quando ROG26/1.4 proiettava peso e TAO
+        session.add_all([
+            EntryProjection(entry_id=entry_id, module_code="ROG26/1.4", field="paziente.peso_kg", num_value=70.0),
+            EntryProjection(entry_id=entry_id, module_code="ROG26/1.4", field="tao", num_value=1.0),
+        ])
+        session.commit()
+
+        assert backfill_projections(session, module_code="ROG26/1.4") == 0
+        assert backfill_projections(session) == 0
+        assert session.exec(select(EntryProjection)).all() == []
@@ -0,0 +1,206 @@
+"""
+Piani delle query generate dalle route su dati di volume realistico.
+
+Le route girano con TestClient su uno schema temporaneo di PostgreSQL
+(tutto in una transazione annullata alla fine); ogni SELECT emessa viene
+ripassata a EXPLAIN (FORMAT JSON) con gli stessi parametri. Il test fallisce
+se una tabella calda viene letta con una Seq Scan: di solito un indice
+parziale non più allineato al filtro o all'ordinamento della route.
+
+Serve un PostgreSQL raggiungibile (QUERY_PLAN_DATABASE_URL, altrimenti il
+database configurato); senza, i test vengono saltati.
+"""
+import json
+import os
+import uuid
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.exc import OperationalError
+from sqlmodel import Session, SQLModel
+
+from app.api.deps import get_current_principal, get_db
+from app.api.routes import dossiers, modules, patients
+from app.core.config import settings
+from app.module_registry import REGISTRY
+from app.services.encryption import field_encryption
+from app.services.principal import Principal
+
+SCHEMA = "query_plan_harness"
+HOT_TABLES = {"dossiers", "patient", "module_entry"}
+STRUCTURES = 50
+PATIENTS = 50_000
+ENTRIES_PER_DOSSIER = 3
+
+SEED = [
+    """
+    INSERT INTO structure (id, name, code, type, address, city, postal_code, province, is_active, created_at)
+    SELECT gen_random_uuid(), 'Struttura ' || i, 'S' || lpad(i::text, 3, '0'), 'RSA',
+           'Via Roma ' || i, 'Pesaro', '61121', 'PU', true, now()
+    FROM generate_series(1, :structures) AS i
+    """,
+    """
+    INSERT INTO "user" (id, first_name, last_name, username, hashed_password, is_superuser, is_active, permissions_version)
+    VALUES (:user_id, 'Piano', 'Query', 'query-plan-harness', 'x', false, true, 0)
+    """,
+    # Un paziente su 200 si chiama Rossi; codici fiscali univoci e con la forma reale
+    """
+    INSERT INTO patient (id, first_name, last_name, fiscal_code, date_of_birth, place_of_birth, gender, created_at, deleted_at)
+    SELECT gen_random_uuid(),
+           (ARRAY['Mario', 'Giulia', 'Luca', 'Anna', 'Paolo', 'Sara', 'Marco', 'Elena'])[1 + i % 8],
+           CASE WHEN i % 200 = 0 THEN 'Rossi'
+                ELSE initcap(translate(substr(md5('l' || i), 1, 8), '0123456789', 'ghijklmnop')) END,
+           upper(translate(substr(md5(i::text), 1, 6), '0123456789', 'ghijklmnop'))
+               || lpad((i % 100)::text, 2, '0') || 'A' || lpad((i / 100 % 100)::text, 2, '0')
+               || 'H' || lpad((i / 10000)::text, 3, '0') || 'X',
+           date '1930-01-01' + i % 30000, 'Pesaro', 'F', now(),
+           CASE WHEN i % 20 = 0 THEN now() END
+    FROM generate_series(1, :patients) AS i
+    """,
+    """
+    INSERT INTO dossiers (id, patient_id, structure_id, admission_date, care_level, status, created_at, created_by_user_id, deleted_at)
+    SELECT gen_random_uuid(), p.id, s.ids[1 + p.n % :structures], now() - (p.n % 3650) * interval '1 day', 'R3',
+           CASE WHEN p.n % 3 = 0 THEN 'discharged' ELSE 'active' END, now(), :user_id,
+           CASE WHEN p.n % 25 = 0 THEN now() END
+    FROM (SELECT id, row_number() OVER (ORDER BY id) AS n FROM patient) AS p,
+         (SELECT array_agg(id ORDER BY code) AS ids FROM structure) AS s
+    """,
+    """
+    INSERT INTO module_entry (id, dossier_id, module_code, schema_version, data, occurred_at, created_at, deleted_at)
+    SELECT gen_random_uuid(), d.id, codes.list[1 + g % cardinality(codes.list)], 1, :payload,
+           d.admission_date + g * interval '6 hours', now(), CASE WHEN g % 10 = 0 THEN now() END
+    FROM dossiers AS d, generate_series(1, :entries) AS g, (SELECT CAST(:codes AS text[]) AS list) AS codes
+    """,
+]
+
+
+def _seq_scans(plan: dict) -> list[str]:
+    found = []
+    nodes = [plan]
+    while nodes:
+        node = nodes.pop()
+        if node["Node Type"] == "Seq Scan" and node.get("Relation Name") in HOT_TABLES:
+            found.append(node["Relation Name"])
+        nodes.extend(node.get("Plans", []))
+    return found
+
+
+@pytest.fixture(scope="module")
+def connection():
+    url = os.getenv("QUERY_PLAN_DATABASE_URL", str(settings.SQLALCHEMY_DATABASE_URI))
+    engine = create_engine(url, connect_args={"connect_timeout": 3} if url.startswith("postgresql") else {})
+    if engine.dialect.name != "postgresql":
+        pytest.skip("EXPLAIN (FORMAT JSON) richiede PostgreSQL")
+    try:
+        conn = engine.connect()
+    except OperationalError as e:
+        pytest.skip(f"PostgreSQL non raggiungibile: {e}")
+
+    codes = sorted({code for code, _ in REGISTRY})
+    user_id = uuid.uuid4()
+    conn.exec_driver_sql("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    conn.exec_driver_sql(f"CREATE SCHEMA {SCHEMA}")
+    conn.exec_driver_sql(f"SET LOCAL search_path TO {SCHEMA}, public")
+    try:
+        SQLModel.metadata.create_all(conn)
+        params = {
+            "structures": STRUCTURES, "patients": PATIENTS, "entries": ENTRIES_PER_DOSSIER,
+            "user_id": user_id, "codes": codes,
+            # Un payload cifrato valido per tutte le entry: le route decrittano senza errori
+            "payload": field_encryption.encrypt_payload({}),
+        }
+        for statement in SEED:
+            conn.execute(text(statement), params)
+        conn.exec_driver_sql("ANALYZE")
+        yield conn
+    finally:
+        conn.rollback()
+        conn.close()
+        engine.dispose()
+
+
+@pytest.fixture(scope="module")
+def fixtures(connection) -> dict:
+    dossier = connection.execute(text(
+        "SELECT d.id, d.structure_id FROM dossiers d JOIN structure s ON s.id = d.structure_id "
+        "WHERE d.deleted_at IS NULL ORDER BY s.code, d.admission_date DESC LIMIT 1"
+    )).one()
+    fiscal_code = connection.execute(text("SELECT fiscal_code FROM patient ORDER BY fiscal_code LIMIT 1")).scalar()
+    user_id = connection.execute(text('SELECT id FROM "user"')).scalar()
+    return {
+        "dossier_id": dossier.id, "structure_id": dossier.structure_id,
+        "fiscal_code": fiscal_code, "user_id": user_id,
+        "module_code": sorted({code for code, _ in REGISTRY})[0],
+    }
+
+
+def _client(connection, principal: Principal) -> TestClient:
+    app = FastAPI()
+    for module in (dossiers, modules, patients):
+        app.include_router(module.router)
+
+    def get_test_db():
+        with Session(bind=connection, join_transaction_mode="create_savepoint") as session:
+            yield session
+
+    app.dependency_overrides[get_db] = get_test_db
+    app.dependency_overrides[get_current_principal] = lambda: principal
+    return TestClient(app)
+
+
+def _principal(fixtures: dict, superuser: bool = False) -> Principal:
+    return Principal(
+        id=fixtures["user_id"], username="query-plan-harness", structure_id=fixtures["structure_id"],
+        role_id=None, role_name="operatore", modules=tuple(sorted({code for code, _ in REGISTRY})),
+        is_superuser=superuser, is_active=True,
+    )
+
+
+# (nome, percorso, parametri, superuser)
+ROUTES = [
+    ("list_dossiers", "/dossiers", {}, False),
+    ("list_dossiers_cursor", "/dossiers", {"cursor": ""}, False),
+    ("list_dossiers_superuser_cursor", "/dossiers", {"cursor": ""}, True),
+    ("search_dossiers_name", "/dossiers/search/advanced", {"q": "ross"}, False),
+    ("dossier_entries", "/dossiers/{dossier_id}/entries", {}, False),
+    ("list_patients", "/patients", {}, False),
+    ("list_patients_name", "/patients", {"q": "rossi"}, False),
+    ("list_patients_fiscal_code", "/patients", {"q": "{fiscal_code_prefix}"}, True),
+    ("list_entries_dossier", "/modules/entries", {"dossier_id": "{dossier_id}"}, False),
+    ("list_entries_module_cursor", "/modules/entries", {"module_code": "{module_code}", "cursor": ""}, False),
+    ("list_entries_field_filter", "/modules/entries", {"module_code": "{module_code}", "field": "paziente.paziente_nominativo=rossi"}, False),
+]
+
+
+@pytest.mark.parametrize("name, path, params, superuser", ROUTES, ids=[route[0] for route in ROUTES])
+def test_route_queries_avoid_seq_scans(connection, fixtures, name, path, params, superuser, caplog) -> None:
+    values = {**fixtures, "fiscal_code_prefix": fixtures["fiscal_code"][:9]}
+    statements: list[tuple[str, object]] = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            statements.append((statement, parameters))
+
+    event.listen(connection, "before_cursor_execute", capture)
+    try:
+        with caplog.at_level("ERROR"):
+            response = _client(connection, _principal(fixtures, superuser)).get(
+                path.format(**values), params={key: value.format(**values) for key, value in params.items()}
+            )
+    finally:
+        event.remove(connection, "before_cursor_execute", capture)
+    assert response.status_code == 200, response.text
+    assert "Decryption error" not in caplog.text
+    assert statements
+
+    regressions = []
+    for statement, parameters in statements:
+        plan = connection.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {statement}", parameters).scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        tables = _seq_scans(plan[0]["Plan"])
+        if tables:
+            regressions.append(f"Seq Scan su {', '.join(sorted(set(tables)))}:\n{statement}")
+    assert not regressions, f"{name}: " + "\n\n".join(regressions)
@@ -0,0 +1,74 @@
+import uuid
+from datetime import datetime, timezone
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import event
+from sqlalchemy.pool import StaticPool
+from sqlmodel import Session, create_engine
+
+from app.models import Dossier
+from app.services.principal import Principal
+from app.services.rbac import AccessEvaluator
+
+
+@pytest.fixture
+def engine():
+    engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    Dossier.__table__.create(engine)
+    return engine
+
+
+def _principal(structure_id: uuid.UUID | None, is_superuser: bool = False) -> Principal:
+    return Principal(
+        id=uuid.uuid4(), username="mrossi", structure_id=structure_id, role_id=uuid.uuid4(),
+        role_name="medico", modules=("ROG26/1.1",), is_superuser=is_superuser, is_active=True,
+    )
+
+
+def _dossiers(engine, structure_ids: list[uuid.UUID]) -> list[uuid.UUID]:
+    with Session(engine) as session:
+        dossiers = [
+            Dossier(
+                patient_id=uuid.uuid4(), structure_id=structure_id, care_level="R3",
+                admission_date=datetime.now(timezone.utc), created_by_user_id=uuid.uuid4(),
+            )
+            for structure_id in structure_ids
+        ]
+        session.add_all(dossiers)
+        session.commit()
+        return [dossier.id for dossier in dossiers]
+
+
+def test_checks_scale_with_distinct_dossiers(engine) -> None:
+    structure_id = uuid.uuid4()
+    own, other = _dossiers(engine, [structure_id, uuid.uuid4()])
+    statements = []
+    event.listen(engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+
+    with Session(engine) as session:
+        access = AccessEvaluator(session, _principal(structure_id))
+        access.prefetch_dossiers({own, other, uuid.uuid4()})
+        for _ in range(100):
+            assert access.dossier(own).id == own
+            access.module("ROG26/1.1", "CREATE")
+        with pytest.raises(HTTPException) as denied:
+            access.dossier(other)
+        assert denied.value.status_code == 403
+        with pytest.raises(HTTPException) as forbidden:
+            access.module("ROG26/2.1", "CREATE")
+        assert forbidden.value.status_code == 403
+    assert len(statements) == 1
+
+
+def test_missing_dossier_and_superuser(engine) -> None:
+    (dossier_id,) = _dossiers(engine, [uuid.uuid4()])
+    with Session(engine) as session:
+        with pytest.raises(HTTPException) as missing:
+            AccessEvaluator(session, _principal(uuid.uuid4())).dossier(uuid.uuid4())
+        assert missing.value.status_code == 404
+
+        access = AccessEvaluator(session, _principal(None, is_superuser=True))
+        assert access.dossier(dossier_id).id == dossier_id
+        access.module("ROG26/9.9", "DELETE")
+        assert access.can_access_structure(uuid.uuid4())
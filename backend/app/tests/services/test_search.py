@@ -0,0 +1,80 @@
+from datetime import date
+
+import pytest
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.pool import StaticPool
+from sqlmodel import Session, create_engine, select
+
+from app.models import Patient
+from app.services.search import contains_all, fiscal_code_query, normalize_query, patient_search
+
+
+@pytest.fixture
+def session():
+    engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    Patient.__table__.create(engine)
+    with Session(engine) as session:
+        for first_name, last_name, fiscal_code in (
+            ("Mario", "Rossi", "RSSMRA80A01H501U"),
+            ("Rosa", "Bianchi", "BNCRSO75D41L219X"),
+            ("Giulia", "Carossi", "CRSGLI90E50F205Z"),
+            ("Anna", "Verdi", "VRDNNA62C45D969K"),
+        ):
+            session.add(Patient(
+                first_name=first_name, last_name=last_name, fiscal_code=fiscal_code,
+                date_of_birth=date(1980, 1, 1), place_of_birth="Pesaro", gender="F",
+            ))
+        session.commit()
+        yield session
+
+
+def _search(session: Session, q: str) -> list[str]:
+    search = patient_search(q, "sqlite")
+    stmt = select(Patient.last_name).where(search.condition)
+    if search.rank is not None:
+        stmt = stmt.order_by(search.rank.desc())
+    return list(session.exec(stmt.order_by(Patient.last_name)).all())
+
+
+def test_query_normalization() -> None:
+    assert normalize_query("  Mario   ROSSI ") == "mario rossi"
+    assert normalize_query("100%_ok") == "100 ok"
+    assert normalize_query(None) == ""
+
+    assert fiscal_code_query("rssmra80a01h501u") == "RSSMRA80A01H501U"
+    assert fiscal_code_query("RSSMRA8") == "RSSMRA8"
+    assert fiscal_code_query("RSSMRA80A01H5O1U") is None  # O al posto dello zero
+    assert fiscal_code_query("rossimario") is None
+    assert fiscal_code_query("rossi") is None
+
+
+def test_name_search_is_ranked_by_prefix(session) -> None:
+    # Cognome per prefisso, poi nome per prefisso, poi sottostringa
+    assert _search(session, "ros") == ["Rossi", "Bianchi", "Carossi"]
+    assert _search(session, "mario rossi") == ["Rossi"]
+    # Token corti: solo prefisso
+    assert _search(session, "an") == ["Verdi"]
+    assert patient_search("   ", "sqlite") is None
+
+
+def test_fiscal_code_fast_path(session) -> None:
+    exact = patient_search("rssmra80a01h501u", "sqlite")
+    assert exact.rank is None
+    assert session.exec(select(Patient.last_name).where(exact.condition)).all() == ["Rossi"]
+    assert _search(session, "CRSGLI90") == ["Carossi"]
+    # Frammento con cifre: sottostringa del codice
+    assert _search(session, "62c45") == ["Verdi"]
+
+
+def test_postgres_sql_matches_trigram_indexes() -> None:
+    search = patient_search("rossi", "postgresql")
+    sql = str(search.condition.compile(dialect=postgresql.dialect()))
+    assert "lower(patient.last_name) LIKE" in sql and "lower(patient.first_name) LIKE" in sql
+    assert "similarity(lower(patient.last_name)" in str(search.rank.compile(dialect=postgresql.dialect()))
+
+    prefix = patient_search("RSSMRA80A", "postgresql")
+    assert str(prefix.condition.compile(dialect=postgresql.dialect())) == "patient.fiscal_code LIKE %(fiscal_code_1)s"
+
+    notes = contains_all(Patient.notes, "Scompenso  cardiaco")
+    assert str(notes.compile(compile_kwargs={"literal_binds": True})).count("LIKE") == 2
+    assert contains_all(Patient.notes, "") is None
@@ -0,0 +1,36 @@
+import argparse
+import logging
+
+from sqlmodel import Session
+
+from app.core.db import engine
+from app.module_registry import REGISTRY
+from app.services.key_store import configure_data_keys
+from app.services.payload_compression import train_module_dictionaries
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Addestra i dizionari di compressione per modulo")
+    parser.add_argument("--module", action="append", help="Codice modulo (default: tutti quelli del REGISTRY)")
+    parser.add_argument("--sample-size", type=int, default=500)
+    args = parser.parse_args()
+
+    # I payload envelope servono le data key per essere letti
+    configure_data_keys(engine)
+
+    module_codes = args.module or sorted({code for code, _ in REGISTRY})
+    logger.info(f"Training compression dictionaries for {module_codes}")
+    with Session(engine) as session:
+        report = train_module_dictionaries(session, module_codes, sample_size=args.sample_size)
+    for item in report:
+        logger.info(
+            f"{item['module_code']}: ratio {item['ratio_without_dictionary']} -> "
+            f"{item['ratio_with_dictionary']} (dictionary #{item['dictionary_id']}, {item['samples']} samples)"
+        )
+
+
+if __name__ == "__main__":
+    main()